@@ -0,0 +1,645 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <glib.h>
+#include <inttypes.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * In-memory annotation store.
+ */
+
+/**
+ * @defgroup grp_annstore Annotation store
+ *
+ * Keeping decoder annotations in memory for sample range queries.
+ *
+ * A session can optionally keep all annotations submitted by its decoder
+ * instances in an annotation store. Annotations are kept per decoder
+ * instance and annotation row, in columnar arrays sorted by start sample,
+ * so that frontends can look up the annotations visible in a sample range
+ * with a binary search instead of scanning all of them. Annotation texts
+ * are interned, and referred to by a text ID.
+ *
+ * For every annotation row, a pyramid of annotation counts per bucket of
+ * samples is kept as well, with the bucket size doubling on every level.
+ * This allows drawing a zoomed-out overview without touching individual
+ * annotations. Only buckets holding annotations are kept, so the summary
+ * never grows larger than the annotation columns, no matter how long the
+ * capture is or at which sample number it starts.
+ *
+ * @{
+ */
+
+/** @cond PRIVATE */
+
+/* One annotation row of one decoder instance. */
+struct ann_store_row {
+	/* Columns, all with the same number of entries. */
+	GArray *start_sample;
+	GArray *end_sample;
+	GArray *ann_class;
+	GArray *text_id;
+	/*
+	 * Running maximum of end_sample, used to find the first annotation
+	 * which can overlap a sample range.
+	 */
+	GArray *max_end;
+	/*
+	 * Annotation counts per bucket, one pair of arrays per zoom level.
+	 * Only non-empty buckets are kept, sorted by bucket index.
+	 */
+	GArray *summary_bucket[SRD_ANN_STORE_LEVELS];
+	GArray *summary_count[SRD_ANN_STORE_LEVELS];
+};
+
+/* All annotation rows of one decoder instance. */
+struct ann_store_inst {
+	int num_rows;
+	struct ann_store_row *rows;
+	/* Maps annotation classes to annotation rows. */
+	int num_classes;
+	int *class_row;
+};
+
+/** @endcond */
+
+static void ann_store_row_init(struct ann_store_row *row)
+{
+	int i;
+
+	row->start_sample = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	row->end_sample = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	row->ann_class = g_array_new(FALSE, FALSE, sizeof(int));
+	row->text_id = g_array_new(FALSE, FALSE, sizeof(uint32_t));
+	row->max_end = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	for (i = 0; i < SRD_ANN_STORE_LEVELS; i++) {
+		row->summary_bucket[i] = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+		row->summary_count[i] = g_array_new(FALSE, FALSE, sizeof(uint32_t));
+	}
+}
+
+static void ann_store_inst_free(struct ann_store_inst *asi)
+{
+	struct ann_store_row *row;
+	int i, j;
+
+	for (i = 0; i < asi->num_rows; i++) {
+		row = &asi->rows[i];
+		g_array_free(row->start_sample, TRUE);
+		g_array_free(row->end_sample, TRUE);
+		g_array_free(row->ann_class, TRUE);
+		g_array_free(row->text_id, TRUE);
+		g_array_free(row->max_end, TRUE);
+		for (j = 0; j < SRD_ANN_STORE_LEVELS; j++) {
+			g_array_free(row->summary_bucket[j], TRUE);
+			g_array_free(row->summary_count[j], TRUE);
+		}
+	}
+	g_free(asi->rows);
+	g_free(asi->class_row);
+	g_free(asi);
+}
+
+/*
+ * Set up the rows of a decoder instance. Decoders without annotation rows
+ * get one row per annotation class. Otherwise, annotation classes which
+ * aren't part of any annotation row end up in one extra, last row.
+ */
+static struct ann_store_inst *ann_store_inst_new(const struct srd_decoder *dec)
+{
+	struct ann_store_inst *asi;
+	struct srd_decoder_annotation_row *ann_row;
+	GSList *l, *c;
+	int i, r, unassigned;
+
+	if (!(asi = g_try_malloc0(sizeof(struct ann_store_inst))))
+		return NULL;
+
+	asi->num_classes = g_slist_length(dec->annotations);
+	if (!(asi->class_row = g_try_malloc(sizeof(int) * (asi->num_classes + 1)))) {
+		g_free(asi);
+		return NULL;
+	}
+
+	if (!dec->annotation_rows) {
+		for (i = 0; i < asi->num_classes; i++)
+			asi->class_row[i] = i;
+		asi->num_rows = asi->num_classes;
+	} else {
+		for (i = 0; i < asi->num_classes; i++)
+			asi->class_row[i] = -1;
+		for (l = dec->annotation_rows, r = 0; l; l = l->next, r++) {
+			ann_row = l->data;
+			for (c = ann_row->ann_classes; c; c = c->next) {
+				i = GPOINTER_TO_INT(c->data);
+				if (i >= 0 && i < asi->num_classes)
+					asi->class_row[i] = r;
+			}
+		}
+		unassigned = 0;
+		for (i = 0; i < asi->num_classes; i++) {
+			if (asi->class_row[i] == -1) {
+				asi->class_row[i] = r;
+				unassigned = 1;
+			}
+		}
+		asi->num_rows = r + unassigned;
+	}
+
+	if (!(asi->rows = g_try_malloc0(sizeof(struct ann_store_row) * (asi->num_rows + 1)))) {
+		g_free(asi->class_row);
+		g_free(asi);
+		return NULL;
+	}
+	for (i = 0; i < asi->num_rows; i++)
+		ann_store_row_init(&asi->rows[i]);
+
+	return asi;
+}
+
+/* Return the index of the first entry in 'arr' which is > 'value'. */
+static uint64_t upper_bound(const GArray *arr, uint64_t value)
+{
+	uint64_t lo, hi, mid;
+
+	lo = 0;
+	hi = arr->len;
+	while (lo < hi) {
+		mid = lo + (hi - lo) / 2;
+		if (g_array_index(arr, uint64_t, mid) <= value)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+
+	return lo;
+}
+
+/* Return the index of the first entry in 'arr' which is >= 'value'. */
+static uint64_t lower_bound(const GArray *arr, uint64_t value)
+{
+	uint64_t lo, hi, mid;
+
+	lo = 0;
+	hi = arr->len;
+	while (lo < hi) {
+		mid = lo + (hi - lo) / 2;
+		if (g_array_index(arr, uint64_t, mid) < value)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+
+	return lo;
+}
+
+/* Count one annotation in a bucket of a (sparse) summary level. */
+static void ann_store_summary_add(GArray *buckets, GArray *counts,
+		uint64_t bucket)
+{
+	uint64_t pos;
+	guint len;
+	uint32_t one;
+
+	/* Like the annotations, buckets are mostly appended. */
+	len = buckets->len;
+	if (len == 0 || g_array_index(buckets, uint64_t, len - 1) < bucket) {
+		pos = len;
+	} else {
+		pos = lower_bound(buckets, bucket);
+		if (g_array_index(buckets, uint64_t, pos) == bucket) {
+			g_array_index(counts, uint32_t, pos)++;
+			return;
+		}
+	}
+
+	one = 1;
+	g_array_insert_val(buckets, pos, bucket);
+	g_array_insert_val(counts, pos, one);
+}
+
+static void ann_store_row_add(struct ann_store_row *row, uint64_t bucket_size,
+		uint64_t start_sample, uint64_t end_sample, int ann_class,
+		uint32_t text_id)
+{
+	uint64_t pos, i, max_end;
+	guint len;
+	int level;
+
+	/*
+	 * Decoders emit annotations mostly in order of their start sample,
+	 * so the common case is appending. Annotations which start earlier
+	 * than the last one (e.g. a byte after its bits) are inserted right
+	 * where they belong, which is usually close to the end.
+	 */
+	len = row->start_sample->len;
+	if (len == 0 || g_array_index(row->start_sample, uint64_t, len - 1) <= start_sample)
+		pos = len;
+	else
+		pos = upper_bound(row->start_sample, start_sample);
+
+	g_array_insert_val(row->start_sample, pos, start_sample);
+	g_array_insert_val(row->end_sample, pos, end_sample);
+	g_array_insert_val(row->ann_class, pos, ann_class);
+	g_array_insert_val(row->text_id, pos, text_id);
+	g_array_insert_val(row->max_end, pos, end_sample);
+
+	/* Fix up the running maximum from the insertion point onwards. */
+	max_end = pos > 0 ? g_array_index(row->max_end, uint64_t, pos - 1) : 0;
+	for (i = pos; i < row->max_end->len; i++) {
+		if (g_array_index(row->end_sample, uint64_t, i) > max_end)
+			max_end = g_array_index(row->end_sample, uint64_t, i);
+		g_array_index(row->max_end, uint64_t, i) = max_end;
+	}
+
+	/*
+	 * Count the annotation in the bucket of its start sample. The
+	 * bucket size was checked to not overflow on the highest level.
+	 */
+	for (level = 0; level < SRD_ANN_STORE_LEVELS; level++)
+		ann_store_summary_add(row->summary_bucket[level],
+				row->summary_count[level],
+				start_sample / (bucket_size << level));
+}
+
+static int ann_store_text_intern(struct srd_ann_store *store, char **ann_text,
+		uint32_t *text_id)
+{
+	gpointer id;
+	char *key;
+
+	key = g_strjoinv("\x1f", ann_text);
+	if ((id = g_hash_table_lookup(store->text_ids, key))) {
+		g_free(key);
+		*text_id = GPOINTER_TO_UINT(id) - 1;
+		return SRD_OK;
+	}
+
+	*text_id = store->texts->len;
+	g_ptr_array_add(store->texts, g_strdupv(ann_text));
+	g_hash_table_insert(store->text_ids, key, GUINT_TO_POINTER(*text_id + 1));
+
+	return SRD_OK;
+}
+
+/** @private */
+SRD_PRIV void srd_ann_store_free(struct srd_ann_store *store)
+{
+	if (!store)
+		return;
+
+	g_hash_table_destroy(store->instances);
+	g_hash_table_destroy(store->text_ids);
+	g_ptr_array_free(store->texts, TRUE);
+	g_free(store);
+}
+
+/**
+ * Drop all annotations kept in a session's annotation store.
+ *
+ * This is needed whenever the decoder instances of the session are freed,
+ * as the stored annotations refer to them.
+ *
+ * @private
+ */
+SRD_PRIV void srd_ann_store_reset(struct srd_session *sess)
+{
+	if (!sess->ann_store)
+		return;
+
+	g_hash_table_remove_all(sess->ann_store->instances);
+}
+
+/**
+ * Add an annotation to a session's annotation store.
+ *
+ * @param di The decoder instance which submitted the annotation.
+ * @param start_sample The annotation's start sample.
+ * @param end_sample The annotation's end sample.
+ * @param ann_class The annotation class.
+ * @param ann_text NULL-terminated list of annotation texts. The store
+ *                 keeps its own copy.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+SRD_PRIV int srd_ann_store_add(struct srd_decoder_inst *di,
+		uint64_t start_sample, uint64_t end_sample, int ann_class,
+		char **ann_text)
+{
+	struct srd_ann_store *store;
+	struct ann_store_inst *asi;
+	uint32_t text_id;
+	int ret;
+
+	if (!(store = di->sess->ann_store))
+		return SRD_OK;
+
+	if (!(asi = g_hash_table_lookup(store->instances, di))) {
+		if (!(asi = ann_store_inst_new(di->decoder))) {
+			srd_err("Failed to g_malloc() annotation store rows.");
+			return SRD_ERR_MALLOC;
+		}
+		g_hash_table_insert(store->instances, di, asi);
+	}
+
+	if (ann_class < 0 || ann_class >= asi->num_classes)
+		return SRD_ERR_ARG;
+
+	if ((ret = ann_store_text_intern(store, ann_text, &text_id)) != SRD_OK)
+		return ret;
+
+	ann_store_row_add(&asi->rows[asi->class_row[ann_class]],
+			store->bucket_size, start_sample, end_sample,
+			ann_class, text_id);
+
+	return SRD_OK;
+}
+
+static struct ann_store_row *ann_store_row_find(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row)
+{
+	struct ann_store_inst *asi;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return NULL;
+	}
+
+	if (!sess->ann_store) {
+		srd_err("Annotation store not enabled in session %d.",
+				sess->session_id);
+		return NULL;
+	}
+
+	if (!di)
+		return NULL;
+
+	if (!(asi = g_hash_table_lookup(sess->ann_store->instances, di)))
+		return NULL;
+
+	if (ann_row < 0 || ann_row >= asi->num_rows)
+		return NULL;
+
+	return &asi->rows[ann_row];
+}
+
+static void ann_store_row_fill(const struct ann_store_row *row,
+		struct srd_ann_store_row *out)
+{
+	out->num_anns = row->start_sample->len;
+	out->start_sample = (const uint64_t *)row->start_sample->data;
+	out->end_sample = (const uint64_t *)row->end_sample->data;
+	out->ann_class = (const int *)row->ann_class->data;
+	out->text_id = (const uint32_t *)row->text_id->data;
+}
+
+/**
+ * Enable the annotation store of a session.
+ *
+ * From then on, all annotations submitted by the session's decoder
+ * instances are kept in the store, in addition to being sent to the
+ * SRD_OUTPUT_ANN callback (if any). Enabling the store again drops all
+ * annotations it held so far.
+ *
+ * @param sess The session.
+ * @param bucket_size The number of samples per bucket on the lowest level
+ *                    of the annotation count summary. Must be > 0, and
+ *                    small enough that the bucket size on the highest
+ *                    level (bucket_size << (SRD_ANN_STORE_LEVELS - 1))
+ *                    fits into 64 bits.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_ann_store_enable(struct srd_session *sess, uint64_t bucket_size)
+{
+	struct srd_ann_store *store;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (bucket_size == 0 ||
+			bucket_size > (UINT64_MAX >> (SRD_ANN_STORE_LEVELS - 1))) {
+		srd_err("Invalid annotation store bucket size.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!(store = g_try_malloc(sizeof(struct srd_ann_store)))) {
+		srd_err("Failed to g_malloc() annotation store.");
+		return SRD_ERR_MALLOC;
+	}
+	store->bucket_size = bucket_size;
+	store->instances = g_hash_table_new_full(g_direct_hash, g_direct_equal,
+			NULL, (GDestroyNotify)ann_store_inst_free);
+	store->texts = g_ptr_array_new_with_free_func((GDestroyNotify)g_strfreev);
+	store->text_ids = g_hash_table_new_full(g_str_hash, g_str_equal,
+			g_free, NULL);
+
+	srd_ann_store_free(sess->ann_store);
+	sess->ann_store = store;
+
+	srd_dbg("Enabled annotation store in session %d, bucket size %"
+			PRIu64 ".", sess->session_id, bucket_size);
+
+	return SRD_OK;
+}
+
+/**
+ * Get the columnar arrays of one annotation row.
+ *
+ * The row's annotations are sorted by start sample. The arrays are owned
+ * by the annotation store, and are only valid until more data is sent to
+ * the session.
+ *
+ * Annotation rows are numbered in the order of the decoder's
+ * 'annotation_rows'. Decoders without annotation rows have one row per
+ * annotation class. Annotation classes not belonging to any row are kept
+ * in one extra row, after all others.
+ *
+ * @param sess The session.
+ * @param di The decoder instance.
+ * @param ann_row The annotation row index.
+ * @param row Pointer to a struct which will be filled in.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise. A row
+ *         which has no annotations yet is returned with 0 entries.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_ann_store_row_get(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row,
+		struct srd_ann_store_row *row)
+{
+	struct ann_store_row *asr;
+
+	if (!row)
+		return SRD_ERR_ARG;
+
+	memset(row, 0, sizeof(struct srd_ann_store_row));
+
+	if (session_is_valid(sess) != SRD_OK || !sess->ann_store || !di)
+		return SRD_ERR_ARG;
+
+	if ((asr = ann_store_row_find(sess, di, ann_row)))
+		ann_store_row_fill(asr, row);
+
+	return SRD_OK;
+}
+
+/**
+ * Find all annotations in a row which overlap a range of samples.
+ *
+ * @param sess The session.
+ * @param di The decoder instance.
+ * @param ann_row The annotation row index.
+ * @param start_sample The first sample of the range.
+ * @param end_sample The last sample of the range (inclusive).
+ * @param cb Function to call for every matching annotation, in order of
+ *           start sample. Must not be NULL.
+ * @param cb_data Private data for the callback function. Can be NULL.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_ann_store_query(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row,
+		uint64_t start_sample, uint64_t end_sample,
+		srd_ann_store_callback cb, void *cb_data)
+{
+	struct ann_store_row *asr;
+	struct srd_ann_store_row row;
+	uint64_t first, last, i;
+
+	if (session_is_valid(sess) != SRD_OK || !sess->ann_store || !di || !cb)
+		return SRD_ERR_ARG;
+
+	if (start_sample > end_sample)
+		return SRD_ERR_ARG;
+
+	if (!(asr = ann_store_row_find(sess, di, ann_row)))
+		return SRD_OK;
+
+	/*
+	 * Only annotations starting at or before the end of the range can
+	 * overlap it. Among those, the running maximum of the end samples
+	 * tells where the first one reaching into the range can be.
+	 */
+	last = upper_bound(asr->start_sample, end_sample);
+	first = lower_bound(asr->max_end, start_sample);
+
+	ann_store_row_fill(asr, &row);
+	for (i = first; i < last; i++) {
+		if (row.end_sample[i] < start_sample)
+			continue;
+		cb(&row, i, cb_data);
+	}
+
+	return SRD_OK;
+}
+
+/**
+ * Get the annotation texts belonging to a text ID.
+ *
+ * @param sess The session.
+ * @param text_id The text ID, as found in an annotation row.
+ *
+ * @return NULL-terminated list of annotation texts, owned by the
+ *         annotation store. NULL upon errors.
+ *
+ * @since 0.4.0
+ */
+SRD_API char **srd_ann_store_text_get(struct srd_session *sess,
+		uint32_t text_id)
+{
+	if (session_is_valid(sess) != SRD_OK || !sess->ann_store)
+		return NULL;
+
+	if (text_id >= sess->ann_store->texts->len)
+		return NULL;
+
+	return g_ptr_array_index(sess->ann_store->texts, text_id);
+}
+
+/**
+ * Get the annotation count summary of an annotation row.
+ *
+ * On level 0, every bucket covers the number of samples given to
+ * srd_ann_store_enable(). Every following level doubles the bucket size.
+ * An annotation is counted in the bucket its start sample falls into,
+ * i.e. bucket n of level l covers the samples starting at
+ * n * (bucket_size << l).
+ *
+ * Only buckets holding at least one annotation are returned, in
+ * ascending order. The arrays are owned by the annotation store, and are
+ * only valid until more data is sent to the session.
+ *
+ * @param sess The session.
+ * @param di The decoder instance.
+ * @param ann_row The annotation row index.
+ * @param level The zoom level, 0 to SRD_ANN_STORE_LEVELS - 1.
+ * @param num_buckets Pointer which will hold the number of buckets.
+ * @param buckets Pointer which will hold the array of bucket indices.
+ * @param counts Pointer which will hold the array of annotation counts,
+ *               one per bucket index.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_ann_store_summary_get(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row, int level,
+		uint64_t *num_buckets, const uint64_t **buckets,
+		const uint32_t **counts)
+{
+	struct ann_store_row *asr;
+
+	if (!num_buckets || !buckets || !counts)
+		return SRD_ERR_ARG;
+
+	*num_buckets = 0;
+	*buckets = NULL;
+	*counts = NULL;
+
+	if (session_is_valid(sess) != SRD_OK || !sess->ann_store || !di)
+		return SRD_ERR_ARG;
+
+	if (level < 0 || level >= SRD_ANN_STORE_LEVELS)
+		return SRD_ERR_ARG;
+
+	if (!(asr = ann_store_row_find(sess, di, ann_row)))
+		return SRD_OK;
+
+	*num_buckets = asr->summary_bucket[level]->len;
+	*buckets = (const uint64_t *)asr->summary_bucket[level]->data;
+	*counts = (const uint32_t *)asr->summary_count[level]->data;
+
+	return SRD_OK;
+}
+
+/** @} */
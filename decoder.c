@@ -687,6 +687,15 @@ SRD_API int srd_decoder_unload(struct srd_decoder *dec)
 	return SRD_OK;
 }
 
+/*
+ * The "common" directory holds helpers shared by several protocol
+ * decoders, it's not a protocol decoder itself.
+ */
+static gboolean is_decoder_dir(const char *name)
+{
+	return strcmp(name, "common") != 0;
+}
+
 static void srd_decoder_load_all_zip_path(char *path)
 {
 	PyObject *zipimport_mod, *zipimporter_class, *zipimporter;
@@ -752,7 +761,8 @@ static void srd_decoder_load_all_zip_path(char *path)
 		char *modname_str;
 		if (py_str_as_str(modname, &modname_str) == SRD_OK) {
 			/* The directory name is the module name (e.g. "i2c"). */
-			srd_decoder_load(modname_str);
+			if (is_decoder_dir(modname_str))
+				srd_decoder_load(modname_str);
 			free(modname_str);
 		}
 		Py_XDECREF(modname);
@@ -785,7 +795,8 @@ static void srd_decoder_load_all_path(char *path)
 	 * want to continue anyway. */
 	while ((direntry = g_dir_read_name(dir)) != NULL) {
 		/* The directory name is the module name (e.g. "i2c"). */
-		srd_decoder_load(direntry);
+		if (is_decoder_dir(direntry))
+			srd_decoder_load(direntry);
 	}
 	g_dir_close(dir);
 
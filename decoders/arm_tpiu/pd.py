@@ -95,6 +95,12 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         ptype, rxtx, pdata = data
 
+        # Burst mode: handle each byte as if it was a separate DATA packet.
+        if ptype == 'BYTES':
+            for b, (ss, es) in zip(*pdata):
+                self.decode(ss, es, ['DATA', rxtx, (b, [])])
+            return
+
         if ptype != 'DATA':
             return
 
@@ -52,6 +52,8 @@ class Decoder(srd.Decoder):
     )
 
     def __init__(self, **kwargs):
+        self.got_data = False
+        self.ranges = []
         self.state = 'IDLE'
         self.mosi_bytes, self.miso_bytes = [], []
         self.ss_cmd, self.es_cmd = 0, 0
@@ -179,6 +181,20 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         ptype, mosi, miso = data
 
+        # Whole transfers, only used if the spi PD doesn't send DATA packets
+        # (i.e. in fast mode). The word ranges come in the packet before.
+        if ptype == 'TRANSFER-RANGES':
+            self.ranges = mosi
+            return
+        if ptype == 'TRANSFER':
+            if self.got_data:
+                return
+            for i, (ss, es) in enumerate(self.ranges):
+                si = mosi[i] if mosi is not None else None
+                so = miso[i] if miso is not None else None
+                self.handle_byte(ss, es, si, so)
+            return
+
         # For now, only use DATA and BITS packets.
         if ptype not in ('DATA', 'BITS'):
             return
@@ -189,6 +205,10 @@ class Decoder(srd.Decoder):
             self.miso_bits, self.mosi_bits = miso, mosi
             return
 
+        self.got_data = True
+        self.handle_byte(ss, es, mosi, miso)
+
+    def handle_byte(self, ss, es, mosi, miso):
         self.ss, self.es = ss, es
 
         if len(self.mosi_bytes) == 0:
@@ -20,6 +20,27 @@
 
 import sigrokdecode as srd
 
+'''
+OUTPUT_PYTHON format:
+
+Packet:
+[<ptype>, <pdata>]
+
+<ptype>:
+ - 'FRAME' (a complete data or remote frame, sent after its EOF)
+
+<pdata> is a tuple (<id>, <ide>, <rtr>, <dlc>, <data>, <crc_ok>):
+ - <id>: The (11-bit standard or 29-bit extended) identifier.
+ - <ide>: True for extended frames, False for standard frames.
+ - <rtr>: True for remote frames, False for data frames.
+ - <dlc>: The data length code (0-15).
+ - <data>: The data bytes, as a bytes object (empty for remote frames).
+ - <crc_ok>: True if the received CRC matches the calculated one.
+
+Example:
+ ['FRAME', (0x123, False, False, 2, b'\x12\x34', True)]
+'''
+
 class SamplerateError(Exception):
     pass
 
@@ -61,9 +82,12 @@ class Decoder(srd.Decoder):
 
     def __init__(self, **kwargs):
         self.samplerate = None
+        # CRC-15/CAN: x^15 + x^14 + x^10 + x^8 + x^7 + x^4 + x^3 + 1.
+        self.crc15 = srd.crc(15, 0x4599)
         self.reset_variables()
 
     def start(self):
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
 
     def metadata(self, key, value):
@@ -92,9 +116,14 @@ class Decoder(srd.Decoder):
     def reset_variables(self):
         self.state = 'IDLE'
         self.sof = self.frame_type = self.dlc = None
-        self.rawbits = [] # All bits, including stuff bits
-        self.bits = [] # Only actual CAN frame bits (no stuff bits)
+        self.frame = 0 # Actual CAN frame bits (no stuff bits), MSB = SOF
+        self.nbits = 0 # Number of bits in self.frame
+        self.run_bit, self.run_len = None, 0 # Identical bits on the wire
         self.curbit = 0 # Current bit of CAN frame (bit 0 == SOF)
+        self.rtr = False
+        self.databytes = b''
+        self.crc_ok = False
+        self.crc15.reset()
         self.last_databit = 999 # Positive value that bitnum+x will never match
         self.ss_block = None
         self.ss_bit12 = None
@@ -107,21 +136,49 @@ class Decoder(srd.Decoder):
             return True
         return False
 
-    def is_stuff_bit(self):
+    # Return the (destuffed) frame bits start..end (inclusive) as a number.
+    def field(self, start, end):
+        shift = self.nbits - 1 - end
+        return (self.frame >> shift) & ((1 << (end - start + 1)) - 1)
+
+    def is_stuff_bit(self, can_rx):
         # CAN uses NRZ encoding and bit stuffing.
         # After 5 identical bits, a stuff bit of opposite value is added.
-        last_6_bits = self.rawbits[-6:]
-        if last_6_bits not in ([0, 0, 0, 0, 0, 1], [1, 1, 1, 1, 1, 0]):
+        if can_rx == self.run_bit:
+            self.run_len += 1
+            # Stuffing is used from SOF up to the end of the CRC sequence.
+            if self.run_len == 6 and self.nbits <= self.last_databit + 15:
+                self.putx([16, ['Stuff error: 6 consecutive bits of value %d'
+                                % can_rx, 'Stuff error', 'SE']])
+            return False
+        stuff_bit = self.run_len >= 5
+        self.run_bit, self.run_len = can_rx, 1
+        if not stuff_bit:
             return False
 
-        # Stuff bit. Keep it in self.rawbits, but drop it from self.bits.
-        self.putx([15, ['Stuff bit: %d' % self.rawbits[-1],
-                        'SB: %d' % self.rawbits[-1], 'SB']])
-        self.bits.pop() # Drop last bit.
+        # Stuff bit. It starts a new run of identical bits, but it's not
+        # part of the frame.
+        self.putx([15, ['Stuff bit: %d' % can_rx, 'SB: %d' % can_rx, 'SB']])
         return True
 
-    def is_valid_crc(self, crc_bits):
-        return True # TODO
+    # The CRC covers all (destuffed) bits from SOF up to the data field,
+    # they're fed into self.crc15 as they come in.
+    def is_valid_crc(self, crc):
+        return self.crc15.value == crc
+
+    # Data frames carry at most 8 bytes (DLC 9-15 also mean 8 bytes),
+    # remote frames don't have a data field at all.
+    def num_databytes(self):
+        return 0 if self.rtr else min(self.dlc, 8)
+
+    def put_frame(self):
+        if self.frame_type == 'extended':
+            ide, can_id = True, self.fullid
+        else:
+            ide, can_id = False, self.id
+        es = self.samplenum + int(self.bit_width - self.bitpos)
+        self.put(self.sof, es, self.out_python, ['FRAME', (can_id, ide,
+                 self.rtr, self.dlc, self.databytes, self.crc_ok)])
 
     def decode_error_frame(self, bits):
         pass # TODO
@@ -141,11 +198,11 @@ class Decoder(srd.Decoder):
         # CRC sequence (15 bits)
         elif bitnum == (self.last_databit + 15):
             x = self.last_databit + 1
-            crc_bits = self.bits[x:x + 15 + 1]
-            self.crc = int(''.join(str(d) for d in crc_bits), 2)
+            self.crc = self.field(x, x + 14)
             self.putb([11, ['CRC sequence: 0x%04x' % self.crc,
                             'CRC: 0x%04x' % self.crc, 'CRC']])
-            if not self.is_valid_crc(crc_bits):
+            self.crc_ok = self.is_valid_crc(self.crc)
+            if not self.crc_ok:
                 self.putb([16, ['CRC is invalid']])
 
         # CRC delimiter bit (recessive)
@@ -170,6 +227,7 @@ class Decoder(srd.Decoder):
         # End of frame (EOF), 7 recessive bits
         elif bitnum == (self.last_databit + 25):
             self.putb([2, ['End of frame', 'EOF', 'E']])
+            self.put_frame()
             self.reset_variables()
             return True
 
@@ -187,7 +245,8 @@ class Decoder(srd.Decoder):
             # Bit 12: Remote transmission request (RTR) bit
             # Data frame: dominant, remote frame: recessive
             # Remote frames do not contain a data field.
-            rtr = 'remote' if self.bits[12] == 1 else 'data'
+            self.rtr = self.field(12, 12) == 1
+            rtr = 'remote' if self.rtr else 'data'
             self.put12([8, ['Remote transmission request: %s frame' % rtr,
                             'RTR: %s frame' % rtr, 'RTR']])
 
@@ -197,10 +256,10 @@ class Decoder(srd.Decoder):
 
         # Bits 15-18: Data length code (DLC), in number of bytes (0-8).
         elif bitnum == 18:
-            self.dlc = int(''.join(str(d) for d in self.bits[15:18 + 1]), 2)
+            self.dlc = self.field(15, 18)
             self.putb([10, ['Data length code: %d' % self.dlc,
                             'DLC: %d' % self.dlc, 'DLC']])
-            self.last_databit = 18 + (self.dlc * 8)
+            self.last_databit = 18 + (self.num_databytes() * 8)
 
         # Remember all databyte bits, except the very last one.
         elif bitnum in range(19, self.last_databit):
@@ -210,13 +269,16 @@ class Decoder(srd.Decoder):
         # The bits within a data byte are transferred MSB-first.
         elif bitnum == self.last_databit:
             self.ss_databytebits.append(self.samplenum) # Last databyte bit.
-            for i in range(self.dlc):
+            databytes = []
+            for i in range(self.num_databytes()):
                 x = 18 + (8 * i) + 1
-                b = int(''.join(str(d) for d in self.bits[x:x + 8]), 2)
+                b = self.field(x, x + 7)
+                databytes.append(b)
                 ss = self.ss_databytebits[i * 8]
                 es = self.ss_databytebits[((i + 1) * 8) - 1]
                 self.putg(ss, es, [0, ['Data byte %d: 0x%02x' % (i, b),
                                        'DB %d: 0x%02x' % (i, b), 'DB']])
+            self.databytes = bytes(databytes)
             self.ss_databytebits = []
 
         elif bitnum > self.last_databit:
@@ -233,7 +295,7 @@ class Decoder(srd.Decoder):
 
         # Bits 14-31: Extended identifier (EID[17..0])
         elif bitnum == 31:
-            self.eid = int(''.join(str(d) for d in self.bits[14:]), 2)
+            self.eid = self.field(14, 31)
             s = '%d (0x%x)' % (self.eid, self.eid)
             self.putb([4, ['Extended Identifier: %s' % s,
                            'Extended ID: %s' % s, 'Extended ID', 'EID']])
@@ -244,14 +306,16 @@ class Decoder(srd.Decoder):
                            'Full ID', 'FID']])
 
             # Bit 12: Substitute remote request (SRR) bit
-            self.put12([9, ['Substitute remote request: %d' % self.bits[12],
-                            'SRR: %d' % self.bits[12], 'SRR']])
+            srr = self.field(12, 12)
+            self.put12([9, ['Substitute remote request: %d' % srr,
+                            'SRR: %d' % srr, 'SRR']])
 
         # Bit 32: Remote transmission request (RTR) bit
         # Data frame: dominant, remote frame: recessive
         # Remote frames do not contain a data field.
         if bitnum == 32:
-            rtr = 'remote' if can_rx == 1 else 'data'
+            self.rtr = can_rx == 1
+            rtr = 'remote' if self.rtr else 'data'
             self.putx([8, ['Remote transmission request: %s frame' % rtr,
                            'RTR: %s frame' % rtr, 'RTR']])
 
@@ -271,10 +335,10 @@ class Decoder(srd.Decoder):
 
         # Bits 35-38: Data length code (DLC), in number of bytes (0-8).
         elif bitnum == 38:
-            self.dlc = int(''.join(str(d) for d in self.bits[35:38 + 1]), 2)
+            self.dlc = self.field(35, 38)
             self.putb([10, ['Data length code: %d' % self.dlc,
                             'DLC: %d' % self.dlc, 'DLC']])
-            self.last_databit = 38 + (self.dlc * 8)
+            self.last_databit = 38 + (self.num_databytes() * 8)
 
         # Remember all databyte bits, except the very last one.
         elif bitnum in range(39, self.last_databit):
@@ -284,13 +348,16 @@ class Decoder(srd.Decoder):
         # The bits within a data byte are transferred MSB-first.
         elif bitnum == self.last_databit:
             self.ss_databytebits.append(self.samplenum) # Last databyte bit.
-            for i in range(self.dlc):
+            databytes = []
+            for i in range(self.num_databytes()):
                 x = 38 + (8 * i) + 1
-                b = int(''.join(str(d) for d in self.bits[x:x + 8]), 2)
+                b = self.field(x, x + 7)
+                databytes.append(b)
                 ss = self.ss_databytebits[i * 8]
                 es = self.ss_databytebits[((i + 1) * 8) - 1]
                 self.putg(ss, es, [0, ['Data byte %d: 0x%02x' % (i, b),
                                        'DB %d: 0x%02x' % (i, b), 'DB']])
+            self.databytes = bytes(databytes)
             self.ss_databytebits = []
 
         elif bitnum > self.last_databit:
@@ -299,20 +366,23 @@ class Decoder(srd.Decoder):
         return False
 
     def handle_bit(self, can_rx):
-        self.rawbits.append(can_rx)
-        self.bits.append(can_rx)
+        # If this is a stuff bit, ignore it.
+        if self.is_stuff_bit(can_rx):
+            self.curbit += 1 # Increase self.curbit (bitnum is not affected).
+            return
+
+        self.frame = (self.frame << 1) | can_rx
+        self.nbits += 1
 
         # Get the index of the current CAN frame bit (without stuff bits).
-        bitnum = len(self.bits) - 1
+        bitnum = self.nbits - 1
 
         # For debugging.
         # self.putx([0, ['Bit %d (CAN bit %d): %d' % \
         #           (self.curbit, bitnum, can_rx)]])
 
-        # If this is a stuff bit, remove it from self.bits and ignore it.
-        if self.is_stuff_bit():
-            self.curbit += 1 # Increase self.curbit (bitnum is not affected).
-            return
+        if bitnum <= self.last_databit:
+            self.crc15.update_bits(can_rx, 1)
 
         # Bit 0: Start of frame (SOF) bit
         if bitnum == 0:
@@ -328,7 +398,7 @@ class Decoder(srd.Decoder):
         # Bits 1-11: Identifier (ID[10..0])
         # The bits ID[10..4] must NOT be all recessive.
         elif bitnum == 11:
-            self.id = int(''.join(str(d) for d in self.bits[1:]), 2)
+            self.id = self.field(1, 11)
             s = '%d (0x%x)' % (self.id, self.id),
             self.putb([3, ['Identifier: %s' % s, 'ID: %s' % s, 'ID']])
 
@@ -0,0 +1,77 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+'''
+Bit width estimation from a histogram of edge intervals.
+
+Used by decoders which have to guess the bitrate of a signal (e.g. uart's
+autobaud, guess_bitrate). The histogram maps a bin (an interval in samples,
+possibly rounded) to a list [count, sum of intervals], so callers are free
+to choose their own binning:
+
+    entry = self.histogram.setdefault(interval, [0, 0])
+    entry[0] += 1
+    entry[1] += interval
+    ...
+    estimate = estimate_bitwidth(self.histogram, 9)
+'''
+
+# Given a histogram (bin: [count, sum of intervals]), return a tuple of the
+# estimated bit width (in samples) and the confidence (0.0 - 1.0), or None
+# if there's no clear answer. Bins close to each other are grouped into
+# clusters, and clusters with too few members (glitches) are ignored. The
+# shortest remaining cluster gives a first guess, which is refined using
+# all clusters which are a multiple (up to max_multiple, e.g. the longest
+# run of equal bits in a frame) of it. The confidence is the fraction of
+# all intervals which are (close to) a multiple of the resulting bit width.
+def estimate_bitwidth(histogram, max_multiple=16):
+    num_intervals = 0
+    clusters = [] # [count, sum of intervals, largest bin]
+    for b in sorted(histogram):
+        count, total = histogram[b]
+        num_intervals += count
+        if clusters and b - clusters[-1][2] <= max(1, 0.15 * b):
+            clusters[-1][0] += count
+            clusters[-1][1] += total
+            clusters[-1][2] = b
+        else:
+            clusters.append([count, total, b])
+
+    min_count = max(2, num_intervals // 20)
+    centres = [(total / count, count) for count, total, _ in clusters
+               if count >= min_count]
+    if not centres:
+        return None
+
+    guess = centres[0][0]
+    total = bits = 0
+    for centre, count in centres:
+        multiple = round(centre / guess)
+        if multiple > max_multiple or abs(centre / guess - multiple) > 0.25:
+            continue
+        total += centre * count
+        bits += multiple * count
+    bitwidth = total / bits
+
+    explained = 0
+    for count, total, _ in clusters:
+        ratio = (total / count) / bitwidth
+        if round(ratio) >= 1 and abs(ratio - round(ratio)) <= 0.15:
+            explained += count
+
+    return bitwidth, explained / num_intervals
@@ -0,0 +1,73 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+'''
+Holding back I²C packets until the slave address is known.
+
+Decoders routing I²C packets by slave address (e.g. i2cdemux, i2cfilter)
+only know where the packets of a message go once its ADDRESS READ/WRITE
+packet arrives. Until then, the START (REPEAT) and any other packets are
+held back, and dropped with a warning (annotation class 0) if no address
+shows up:
+
+    def start(self):
+        self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.held = HeldPackets(self, self.out_ann,
+                                self.options['max_packets'])
+
+    def decode(self, ss, es, data):
+        ...
+        if cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
+            for p in self.held.take():
+                self.put(p[0], p[1], self.out_python, p[2])
+        ...
+        if self.stream is None:
+            self.held.add(ss, es, data)
+            return
+'''
+
+class HeldPackets:
+    '''I²C packets held back by a decoder, as [ss, es, data] lists.'''
+
+    def __init__(self, pd, out_ann, max_packets):
+        self.pd = pd
+        self.out_ann = out_ann
+        self.max_packets = max_packets
+        self.packets = []
+
+    # Hold a packet back. A STOP before any address, or too many packets,
+    # drop all of them.
+    def add(self, ss, es, data):
+        self.packets.append([ss, es, data])
+        if data[0] == 'STOP':
+            self.drop(es, 'no slave address')
+        elif len(self.packets) > self.max_packets:
+            self.drop(es, 'too many packets without slave address')
+
+    # Return the held packets (e.g. to send them on), and forget them.
+    def take(self):
+        packets, self.packets = self.packets, []
+        return packets
+
+    # Drop the held packets (if any), with a warning up to sample 'es'.
+    def drop(self, es, reason):
+        if self.packets:
+            self.pd.put(self.packets[0][0], es, self.out_ann,
+                        [0, ['Dropped %d packets: %s' % (len(self.packets),
+                             reason)]])
+        self.packets = []
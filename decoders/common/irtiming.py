@@ -0,0 +1,96 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+'''
+Edge timing engine for infrared remote control decoders.
+
+PulseTrain turns the samples of one (demodulated) IR channel into edges,
+skipping the (usually long) stretches without any change. PulseTiming
+classifies the time between edges by looking it up in precomputed
+tolerance windows. A new protocol (e.g. Sony SIRC, RC-6) only needs its
+windows and a state machine running on the edges:
+
+    def metadata(self, key, value):
+        ...
+        self.timing = PulseTiming((
+            ('header', *window(self.samplerate, 0.0024, 0.1)),
+            (1, *window(self.samplerate, 0.0012, 0.1)),
+            (0, *window(self.samplerate, 0.0006, 0.1)),
+        ))
+
+    def decode(self, ss, es, data):
+        for (self.samplenum, level) in self.pulses.edges(data):
+            symbol = self.timing.classify(self.samplenum - self.ss_edge)
+            ...
+'''
+
+from bisect import bisect_right
+import math
+
+def window(samplerate, duration, tolerance):
+    '''Sample range [start, end) of a duration (in seconds) with a relative
+    tolerance.'''
+    return (math.ceil(samplerate * duration * (1 - tolerance)),
+            math.floor(samplerate * duration * (1 + tolerance)) + 1)
+
+class PulseTiming:
+    '''Classify a number of samples into named tolerance windows.
+
+    The windows are (name, start, end) tuples, covering the sample counts
+    start <= n < end. Where windows overlap, the one listed first wins.
+    '''
+
+    def __init__(self, windows):
+        windows = [w for w in windows if w[1] < w[2]]
+        points = sorted(set(p for w in windows for p in w[1:]))
+        self.starts, self.ends, self.names = [], [], []
+        for (start, end) in zip(points, points[1:]):
+            for (name, wstart, wend) in windows:
+                if wstart <= start and end <= wend:
+                    break
+            else:
+                continue
+            if self.ends and self.ends[-1] == start and self.names[-1] == name:
+                self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.names.append(name)
+
+    def classify(self, samples):
+        '''Return the name of the window the sample count is in, or None.'''
+        i = bisect_right(self.starts, samples) - 1
+        if i >= 0 and samples < self.ends[i]:
+            return self.names[i]
+        return None
+
+class PulseTrain:
+    '''Track the edges of one logic channel across decode() calls.'''
+
+    def __init__(self, idle):
+        # The level before the first sample (usually the idle level).
+        self.level = idle
+
+    def edges(self, data):
+        '''Yield (samplenum, level) for each edge in the chunk.'''
+        for (samplenum, pins) in data:
+            level = pins[0]
+            if level != self.level:
+                self.level = level
+                yield (samplenum, level)
+            data.skip()
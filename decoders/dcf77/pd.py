@@ -20,11 +20,62 @@
 
 import sigrokdecode as srd
 import calendar
+import math
+
+'''
+OUTPUT_PYTHON format:
+
+Packet:
+['FRAME', [<bits>, <minute>, <hour>, <day>, <dow>, <month>, <year>, <parity>]]
+
+One packet per complete minute frame (DCF77 bits 0-58):
+ - <bits>: All 59 bits as an integer, DCF77 bit n is bit n of the integer.
+ - <minute>, <hour>, <day>, <month>, <year>: The decoded BCD fields, <year>
+   being the two-digit year (0-99).
+ - <dow>: Day of week, 1 means Monday, 7 means Sunday.
+ - <parity>: A (<minute_ok>, <hour_ok>, <date_ok>) tuple of booleans.
+'''
 
 # Return the specified BCD number (max. 8 bits) as integer.
 def bcd2int(b):
     return (b & 0x0f) + ((b >> 4) * 10)
 
+# BCD lookup table for all 8-bit values.
+bcd = [bcd2int(b) for b in range(256)]
+
+# Multi-bit fields: (first bit, last bit).
+SPECIAL = (1, 14)
+MINUTE = (21, 27)
+HOUR = (29, 34)
+DAY = (36, 41)
+DOW = (42, 44)
+MONTH = (45, 49)
+YEAR = (50, 57)
+
+# Single-bit flags: bit, annotation class, texts ({s}: '' or 'not ',
+# {x}: 'yes' or 'no').
+flags = (
+    (15, 2, ('Call bit: {s}set', 'CB: {s}set')),
+    (16, 3, ('Summer time announcement: {s}active', 'Summer time: {s}active',
+             'Summer time: {x}', 'ST: {x}')),
+    (17, 4, ('CEST: {s}in effect', 'CEST: {x}')),
+    (18, 5, ('CET: {s}in effect', 'CET: {x}')),
+    (19, 6, ('Leap second announcement: {s}active', 'Leap second: {s}active',
+             'Leap second: {x}', 'LS: {x}')),
+)
+
+# Even parity groups: (first bit, last bit incl. parity bit).
+MINUTE_PARITY = (21, 28)
+HOUR_PARITY = (29, 35)
+DATE_PARITY = (36, 58)
+
+def field(frame, bits):
+    first, last = bits
+    return (frame >> first) & ((1 << (last - first + 1)) - 1)
+
+def parity_ok(frame, bits):
+    return bin(field(frame, bits)).count('1') % 2 == 0
+
 class SamplerateError(Exception):
     pass
 
@@ -72,245 +123,231 @@ class Decoder(srd.Decoder):
         self.samplerate = None
         self.state = 'WAIT FOR RISING EDGE'
         self.oldpins = None
-        self.oldval = None
         self.samplenum = 0
-        self.ss_bit = self.ss_bit_old = self.es_bit = self.ss_block = 0
-        self.datebits = []
+        self.ss_bit = self.ss_bit_old = 0
+        # The bits of the current minute frame: (ss, es) and value.
+        self.bits = []
+        self.frame = 0
         self.bitcount = 0 # Counter for the DCF77 bits (0..58)
         self.dcf77_bitnumber_is_known = 0
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+
+    # Number of samples a length of the given number of milliseconds
+    # starts at.
+    def ms_to_samples(self, ms):
+        return math.ceil(ms * self.samplerate / 1000)
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
+            # Ranges (in whole milliseconds) as half-open sample ranges.
+            self.minute_range = (self.ms_to_samples(1600),
+                                 self.ms_to_samples(2400 + 1))
+            self.bit0_range = (self.ms_to_samples(40),
+                               self.ms_to_samples(160 + 1))
+            self.bit1_range = (self.ms_to_samples(161),
+                               self.ms_to_samples(260 + 1))
 
-    def putx(self, data):
+    def putx(self, c, data):
         # Annotation for a single DCF77 bit.
-        self.put(self.ss_bit, self.es_bit, self.out_ann, data)
+        ss, es = self.bits[c][0]
+        self.put(ss, es, self.out_ann, data)
 
-    def putb(self, data):
+    def putb(self, bits, data):
         # Annotation for a multi-bit DCF77 field.
-        self.put(self.ss_block, self.samplenum, self.out_ann, data)
+        ss, es = self.bits[bits[0]][0][0], self.bits[bits[1]][0][1]
+        self.put(ss, es, self.out_ann, data)
 
+    # Decode the bits of the current minute frame. This is usually a
+    # complete frame (bits 0-58), but only the fields which were received
+    # completely are annotated for frames which got cut short.
     # TODO: Which range to use? Only the 100ms/200ms or full second?
-    def handle_dcf77_bit(self, bit):
-        c = self.bitcount
+    def decode_frame(self):
+        n, frame = len(self.bits), self.frame
+
+        for (c, ((ss, es), bit)) in enumerate(self.bits):
+            self.put(ss, es, self.out_ann,
+                     [17, ['Bit %d: %d' % (c, bit), '%d' % bit]])
+
+        # Start of minute: DCF bit 0.
+        if frame & 1 == 0:
+            self.putx(0, [0, ['Start of minute (always 0)',
+                              'Start of minute', 'SoM']])
+        else:
+            self.putx(0, [19, ['Start of minute != 0', 'SoM != 0']])
+
+        # Special bits (civil warnings, weather forecast): DCF77 bits 1-14.
+        if n <= SPECIAL[1]:
+            return
+        s = bin(field(frame, SPECIAL))[2:].zfill(14)
+        self.putb(SPECIAL, [1, ['Special bits: %s' % s, 'SB: %s' % s]])
+
+        for (c, ann, texts) in flags:
+            if n <= c:
+                return
+            bit = (frame >> c) & 1
+            s, x = ('', 'yes') if bit else ('not ', 'no')
+            self.putx(c, [ann, [t.format(s=s, x=x) for t in texts]])
+            # TODO: Bit 15 previously indicated use of the backup antenna.
+
+        # Start of encoded time: DCF bit 20.
+        if n <= 20:
+            return
+        if (frame >> 20) & 1:
+            self.putx(20, [7, ['Start of encoded time (always 1)',
+                               'Start of encoded time', 'SoeT']])
+        else:
+            self.putx(20, [19, ['Start of encoded time != 1', 'SoeT != 1']])
+
+        # Minutes (0-59): DCF77 bits 21-27 (BCD format).
+        if n <= MINUTE[1]:
+            return
+        minute = bcd[field(frame, MINUTE)]
+        self.putb(MINUTE, [8, ['Minutes: %d' % minute, 'Min: %d' % minute]])
+
+        # Even parity over minute bits (21-28): DCF77 bit 28.
+        if n <= MINUTE_PARITY[1]:
+            return
+        minute_ok = parity_ok(frame, MINUTE_PARITY)
+        s = 'OK' if minute_ok else 'INVALID!'
+        self.putx(28, [9, ['Minute parity: %s' % s, 'Min parity: %s' % s]])
+
+        # Hours (0-23): DCF77 bits 29-34 (BCD format).
+        if n <= HOUR[1]:
+            return
+        hour = bcd[field(frame, HOUR)]
+        self.putb(HOUR, [10, ['Hours: %d' % hour]])
 
-        # Create one annotation for each DCF77 bit (containing the 0/1 value).
+        # Even parity over hour bits (29-35): DCF77 bit 35.
+        if n <= HOUR_PARITY[1]:
+            return
+        hour_ok = parity_ok(frame, HOUR_PARITY)
+        s = 'OK' if hour_ok else 'INVALID!'
+        self.putx(35, [11, ['Hour parity: %s' % s]])
+
+        # Day of month (1-31): DCF77 bits 36-41 (BCD format).
+        if n <= DAY[1]:
+            return
+        day = bcd[field(frame, DAY)]
+        self.putb(DAY, [12, ['Day: %d' % day]])
+
+        # Day of week (1-7): DCF77 bits 42-44 (BCD format).
+        # A value of 1 means Monday, 7 means Sunday.
+        if n <= DOW[1]:
+            return
+        dow = bcd[field(frame, DOW)]
+        dn = calendar.day_name[dow - 1] if dow else 'invalid'
+        self.putb(DOW, [13, ['Day of week: %d (%s)' % (dow, dn),
+                             'DoW: %d (%s)' % (dow, dn)]])
+
+        # Month (1-12): DCF77 bits 45-49 (BCD format).
+        if n <= MONTH[1]:
+            return
+        month = bcd[field(frame, MONTH)]
+        mn = calendar.month_name[month] if 1 <= month <= 12 else 'invalid'
+        self.putb(MONTH, [14, ['Month: %d (%s)' % (month, mn),
+                               'Mon: %d (%s)' % (month, mn)]])
+
+        # Year (0-99): DCF77 bits 50-57 (BCD format).
+        if n <= YEAR[1]:
+            return
+        year = bcd[field(frame, YEAR)]
+        self.putb(YEAR, [15, ['Year: %d' % year]])
+
+        # Even parity over date bits (36-58): DCF77 bit 58.
+        if n <= DATE_PARITY[1]:
+            return
+        date_ok = parity_ok(frame, DATE_PARITY)
+        s = 'OK' if date_ok else 'INVALID!'
+        self.putx(58, [16, ['Date parity: %s' % s, 'DP: %s' % s]])
+
+        self.put(self.bits[0][0][0], self.bits[58][0][1], self.out_python,
+                 ['FRAME', [frame, minute, hour, day, dow, month, year,
+                            (minute_ok, hour_ok, date_ok)]])
+
+    def handle_dcf77_bit(self, bit, ss, es):
         # Use 'Unknown DCF77 bit x: val' if we're not sure yet which of the
         # 0..58 bits it is (because we haven't seen a 'new minute' marker yet).
-        # Otherwise, use 'DCF77 bit x: val'.
-        s = 'B' if self.dcf77_bitnumber_is_known else 'Unknown b'
-        ann = 17 if self.dcf77_bitnumber_is_known else 18
-        self.putx([ann, ['%sit %d: %d' % (s, c, bit), '%d' % bit]])
-
-        # If we're not sure yet which of the 0..58 DCF77 bits we have, return.
         # We don't want to decode bogus data.
         if not self.dcf77_bitnumber_is_known:
+            c = self.bitcount
+            self.put(ss, es, self.out_ann,
+                     [18, ['Unknown bit %d: %d' % (c, bit), '%d' % bit]])
             return
 
-        # Collect bits 36-58, we'll need them for a parity check later.
-        if c in range(36, 58 + 1):
-            self.datebits.append(bit)
-
-        # Output specific "decoded" annotations for the respective DCF77 bits.
-        if c == 0:
-            # Start of minute: DCF bit 0.
-            if bit == 0:
-                self.putx([0, ['Start of minute (always 0)',
-                               'Start of minute', 'SoM']])
-            else:
-                self.putx([19, ['Start of minute != 0', 'SoM != 0']])
-        elif c in range(1, 14 + 1):
-            # Special bits (civil warnings, weather forecast): DCF77 bits 1-14.
-            if c == 1:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 1))
-            if c == 14:
-                s = bin(self.tmp)[2:].zfill(14)
-                self.putb([1, ['Special bits: %s' % s, 'SB: %s' % s]])
-        elif c == 15:
-            s = '' if (bit == 1) else 'not '
-            self.putx([2, ['Call bit: %sset' % s, 'CB: %sset' % s]])
-            # TODO: Previously this bit indicated use of the backup antenna.
-        elif c == 16:
-            s = '' if (bit == 1) else 'not '
-            x = 'yes' if (bit == 1) else 'no'
-            self.putx([3, ['Summer time announcement: %sactive' % s,
-                           'Summer time: %sactive' % s,
-                           'Summer time: %s' % x, 'ST: %s' % x]])
-        elif c == 17:
-            s = '' if (bit == 1) else 'not '
-            x = 'yes' if (bit == 1) else 'no'
-            self.putx([4, ['CEST: %sin effect' % s, 'CEST: %s' % x]])
-        elif c == 18:
-            s = '' if (bit == 1) else 'not '
-            x = 'yes' if (bit == 1) else 'no'
-            self.putx([5, ['CET: %sin effect' % s, 'CET: %s' % x]])
-        elif c == 19:
-            s = '' if (bit == 1) else 'not '
-            x = 'yes' if (bit == 1) else 'no'
-            self.putx([6, ['Leap second announcement: %sactive' % s,
-                           'Leap second: %sactive' % s,
-                           'Leap second: %s' % x, 'LS: %s' % x]])
-        elif c == 20:
-            # Start of encoded time: DCF bit 20.
-            if bit == 1:
-                self.putx([7, ['Start of encoded time (always 1)',
-                               'Start of encoded time', 'SoeT']])
-            else:
-                self.putx([19, ['Start of encoded time != 1', 'SoeT != 1']])
-        elif c in range(21, 27 + 1):
-            # Minutes (0-59): DCF77 bits 21-27 (BCD format).
-            if c == 21:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 21))
-            if c == 27:
-                m = bcd2int(self.tmp)
-                self.putb([8, ['Minutes: %d' % m, 'Min: %d' % m]])
-        elif c == 28:
-            # Even parity over minute bits (21-28): DCF77 bit 28.
-            self.tmp |= (bit << (c - 21))
-            parity = bin(self.tmp).count('1')
-            s = 'OK' if ((parity % 2) == 0) else 'INVALID!'
-            self.putx([9, ['Minute parity: %s' % s, 'Min parity: %s' % s]])
-        elif c in range(29, 34 + 1):
-            # Hours (0-23): DCF77 bits 29-34 (BCD format).
-            if c == 29:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 29))
-            if c == 34:
-                self.putb([10, ['Hours: %d' % bcd2int(self.tmp)]])
-        elif c == 35:
-            # Even parity over hour bits (29-35): DCF77 bit 35.
-            self.tmp |= (bit << (c - 29))
-            parity = bin(self.tmp).count('1')
-            s = 'OK' if ((parity % 2) == 0) else 'INVALID!'
-            self.putx([11, ['Hour parity: %s' % s]])
-        elif c in range(36, 41 + 1):
-            # Day of month (1-31): DCF77 bits 36-41 (BCD format).
-            if c == 36:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 36))
-            if c == 41:
-                self.putb([12, ['Day: %d' % bcd2int(self.tmp)]])
-        elif c in range(42, 44 + 1):
-            # Day of week (1-7): DCF77 bits 42-44 (BCD format).
-            # A value of 1 means Monday, 7 means Sunday.
-            if c == 42:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 42))
-            if c == 44:
-                d = bcd2int(self.tmp)
-                dn = calendar.day_name[d - 1] # day_name[0] == Monday
-                self.putb([13, ['Day of week: %d (%s)' % (d, dn),
-                                'DoW: %d (%s)' % (d, dn)]])
-        elif c in range(45, 49 + 1):
-            # Month (1-12): DCF77 bits 45-49 (BCD format).
-            if c == 45:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 45))
-            if c == 49:
-                m = bcd2int(self.tmp)
-                mn = calendar.month_name[m] # month_name[1] == January
-                self.putb([14, ['Month: %d (%s)' % (m, mn),
-                                'Mon: %d (%s)' % (m, mn)]])
-        elif c in range(50, 57 + 1):
-            # Year (0-99): DCF77 bits 50-57 (BCD format).
-            if c == 50:
-                self.tmp = bit
-                self.ss_block = self.ss_bit
-            else:
-                self.tmp |= (bit << (c - 50))
-            if c == 57:
-                self.putb([15, ['Year: %d' % bcd2int(self.tmp)]])
-        elif c == 58:
-            # Even parity over date bits (36-58): DCF77 bit 58.
-            parity = self.datebits.count(1)
-            s = 'OK' if ((parity % 2) == 0) else 'INVALID!'
-            self.putx([16, ['Date parity: %s' % s, 'DP: %s' % s]])
-            self.datebits = []
+        # Collect the bits, and decode the frame after the last one (58).
+        self.frame |= bit << len(self.bits)
+        self.bits.append(((ss, es), bit))
+        if len(self.bits) == 59:
+            self.decode_frame()
+            self.bits, self.frame = [], 0
+
+    def handle_rising_edge(self):
+        # Save the sample number where the DCF77 bit begins.
+        self.ss_bit = self.samplenum
+
+        # The time between two rising edges is usually around 1000ms.
+        # For DCF77 bit 59, there is no rising edge at all, i.e. the
+        # time between DCF77 bit 59 and DCF77 bit 0 (of the next
+        # minute) is around 2000ms. Thus, if we see an edge with a
+        # 2000ms distance to the last one, this edge marks the
+        # beginning of a new minute (and DCF77 bit 0 of that minute).
+        len_edges = self.ss_bit - self.ss_bit_old
+        if self.minute_range[0] <= len_edges < self.minute_range[1]:
+            # Decode what we have of a minute frame that got cut short.
+            if self.bits:
+                self.decode_frame()
+                self.bits, self.frame = [], 0
+            self.bitcount = 0
+            self.dcf77_bitnumber_is_known = 1
+
+        self.ss_bit_old = self.ss_bit
+        self.state = 'GET BIT'
+
+    def handle_falling_edge(self):
+        # If the high signal was 100ms long, that encodes a 0 bit.
+        # If it was 200ms long, that encodes a 1 bit.
+        len_high = self.samplenum - self.ss_bit
+        if self.bit0_range[0] <= len_high < self.bit0_range[1]:
+            bit = 0
+        elif self.bit1_range[0] <= len_high < self.bit1_range[1]:
+            bit = 1
         else:
-            raise Exception('Invalid DCF77 bit: %d' % c)
+            bit = -1 # TODO: Error?
+
+        # There's no bit 59, make sure none is decoded.
+        if bit in (0, 1) and self.bitcount <= 58:
+            self.handle_dcf77_bit(bit, self.ss_bit, self.samplenum)
+            self.bitcount += 1
+
+        self.state = 'WAIT FOR RISING EDGE'
 
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
         for (self.samplenum, pins) in data:
 
-            # Ignore identical samples early on (for performance reasons).
+            # Only edges matter, skip to the next one.
             if self.oldpins == pins:
+                data.skip()
+                continue
+            oldpins, self.oldpins, (val,) = self.oldpins, pins, pins
+            data.skip()
+
+            # The first sample isn't an edge.
+            if oldpins is None:
                 continue
-            self.oldpins, (val,) = pins, pins
-
-            if self.state == 'WAIT FOR RISING EDGE':
-                # Wait until the next rising edge occurs.
-                if not (self.oldval == 0 and val == 1):
-                    self.oldval = val
-                    continue
-
-                # Save the sample number where the DCF77 bit begins.
-                self.ss_bit = self.samplenum
-
-                # Calculate the length (in ms) between two rising edges.
-                len_edges = self.ss_bit - self.ss_bit_old
-                len_edges_ms = int((len_edges / self.samplerate) * 1000)
-
-                # The time between two rising edges is usually around 1000ms.
-                # For DCF77 bit 59, there is no rising edge at all, i.e. the
-                # time between DCF77 bit 59 and DCF77 bit 0 (of the next
-                # minute) is around 2000ms. Thus, if we see an edge with a
-                # 2000ms distance to the last one, this edge marks the
-                # beginning of a new minute (and DCF77 bit 0 of that minute).
-                if len_edges_ms in range(1600, 2400 + 1):
-                    self.bitcount = 0
-                    self.ss_bit_old = self.ss_bit
-                    self.dcf77_bitnumber_is_known = 1
-
-                self.ss_bit_old = self.ss_bit
-                self.state = 'GET BIT'
-
-            elif self.state == 'GET BIT':
-                # Wait until the next falling edge occurs.
-                if not (self.oldval == 1 and val == 0):
-                    self.oldval = val
-                    continue
-
-                # Save the sample number where the DCF77 bit ends.
-                self.es_bit = self.samplenum
-
-                # Calculate the length (in ms) of the current high period.
-                len_high = self.samplenum - self.ss_bit
-                len_high_ms = int((len_high / self.samplerate) * 1000)
-
-                # If the high signal was 100ms long, that encodes a 0 bit.
-                # If it was 200ms long, that encodes a 1 bit.
-                if len_high_ms in range(40, 160 + 1):
-                    bit = 0
-                elif len_high_ms in range(161, 260 + 1):
-                    bit = 1
-                else:
-                    bit = -1 # TODO: Error?
-
-                # There's no bit 59, make sure none is decoded.
-                if bit in (0, 1) and self.bitcount in range(0, 58 + 1):
-                    self.handle_dcf77_bit(bit)
-                    self.bitcount += 1
-
-                self.state = 'WAIT FOR RISING EDGE'
-
-            self.oldval = val
+
+            if val == 1 and self.state == 'WAIT FOR RISING EDGE':
+                self.handle_rising_edge()
+            elif val == 0 and self.state == 'GET BIT':
+                self.handle_falling_edge()
+
+    def end(self):
+        # Decode what we have of the last minute frame.
+        if self.bits:
+            self.decode_frame()
+            self.bits, self.frame = [], 0
@@ -98,6 +98,18 @@ class Decoder(srd.Decoder):
         self.sn = []
         # Received data
         self.cache = []
+        # Section handlers, keyed by the end offset of the respective section
+        self.sections = (
+            (OFF_VERSION, self.decode_vendor_product),
+            (OFF_BASIC, self.decode_version),
+            (OFF_CHROM, self.decode_basic),
+            (OFF_EST_TIMING, self.decode_chrom),
+            (OFF_STD_TIMING, self.decode_est),
+            (OFF_DET_TIMING, self.decode_std),
+            (OFF_NUM_EXT, self.decode_det),
+            (OFF_CHECKSUM, self.decode_num_ext),
+            (OFF_CHECKSUM + 1, self.decode_checksum),
+        )
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -105,79 +117,99 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         cmd, data = data
 
-        # We only care about actual data bytes that are read (for now).
-        if cmd != 'DATA READ':
+        # Only whole I²C transactions (START to STOP) are used, and only
+        # the data bytes that are read (for now).
+        if cmd != 'TRANSACTION':
             return
 
-        self.cnt += 1
-        self.sn.append([ss, es])
-        self.cache.append(data)
-        # debug
+        for addr, rw, databytes, acks, ranges, bits in data:
+            if rw == 'READ' and databytes and self.state != 'extensions':
+                self.handle_data(databytes, ranges[1:])
+
+    def handle_data(self, databytes, ranges):
+        self.cache.extend(databytes)
+        self.sn.extend(ranges)
 
         if self.state is None:
             # Wait for the EDID header
-            if self.cnt >= OFF_VENDOR:
-                if self.cache[-8:] == EDID_HEADER:
-                    # Throw away any garbage before the header
-                    self.sn = self.sn[-8:]
-                    self.cache = self.cache[-8:]
-                    self.cnt = 8
-                    self.state = 'edid'
-                    self.put(self.sn[0][0], es, self.out_ann,
-                            [ANN_SECTIONS, ['Header']])
-                    self.put(self.sn[0][0], es, self.out_ann,
-                            [ANN_FIELDS, ['Header pattern']])
-        elif self.state == 'edid':
-            if self.cnt == OFF_VERSION:
-                self.decode_vid(-10)
-                self.decode_pid(-8)
-                self.decode_serial(-6)
-                self.decode_mfrdate(-2)
-                self.put(self.sn[OFF_VENDOR][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['Vendor/product']])
-            elif self.cnt == OFF_BASIC:
-                self.put(self.sn[OFF_VERSION][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['EDID Version']])
-                self.put(self.sn[OFF_VERSION][0], self.sn[OFF_VERSION][1],
-                        self.out_ann, [ANN_FIELDS,
-                            ["Version %d" % self.cache[-2]]])
-                self.put(self.sn[OFF_VERSION+1][0], self.sn[OFF_VERSION+1][1],
-                        self.out_ann, [ANN_FIELDS,
-                            [ "Revision %d" % self.cache[-1]]])
-            elif self.cnt == OFF_CHROM:
-                self.put(self.sn[OFF_BASIC][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['Basic display']])
-                self.decode_basicdisplay(-5)
-            elif self.cnt == OFF_EST_TIMING:
-                self.put(self.sn[OFF_CHROM][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['Color characteristics']])
-                self.decode_chromaticity(-10)
-            elif self.cnt == OFF_STD_TIMING:
-                self.put(self.sn[OFF_EST_TIMING][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['Established timings']])
-                self.decode_est_timing(-3)
-            elif self.cnt == OFF_DET_TIMING:
-                self.put(self.sn[OFF_STD_TIMING][0], es, self.out_ann,
-                        [ANN_SECTIONS, ['Standard timings']])
-                self.decode_std_timing(self.cnt - 16)
-            elif self.cnt == OFF_NUM_EXT:
-                self.decode_descriptors(-72)
-            elif self.cnt == OFF_CHECKSUM:
-                self.put(ss, es, self.out_ann,
-                    [0, ['Extensions present: %d' % self.cache[self.cnt-1]]])
-            elif self.cnt == OFF_CHECKSUM+1:
-                checksum = 0
-                for i in range(128):
-                    checksum += self.cache[i]
-                if checksum % 256 == 0:
-                    csstr = 'OK'
-                else:
-                    csstr = 'WRONG!'
-                self.put(ss, es, self.out_ann, [0, ['Checksum: %d (%s)' % (
-                         self.cache[self.cnt-1], csstr)]])
-                self.state = 'extensions'
-        elif self.state == 'extensions':
-            pass
+            idx = bytes(self.cache).find(bytes(EDID_HEADER))
+            if idx < 0:
+                # Only keep what could be the start of a header.
+                del self.cache[:-7]
+                del self.sn[:-7]
+                return
+            # Throw away any garbage before the header
+            del self.cache[:idx]
+            del self.sn[:idx]
+            self.cnt = 8
+            self.state = 'edid'
+            self.put(self.sn[0][0], self.sn[7][1], self.out_ann,
+                    [ANN_SECTIONS, ['Header']])
+            self.put(self.sn[0][0], self.sn[7][1], self.out_ann,
+                    [ANN_FIELDS, ['Header pattern']])
+
+        # Decode each section once all of its bytes are available, offsets
+        # are relative to the start of the header.
+        for end, handler in self.sections:
+            if self.cnt < end <= len(self.cache):
+                self.cnt = end
+                handler()
+        if self.cnt > OFF_CHECKSUM:
+            self.state = 'extensions'
+            self.cache, self.sn = self.cache[:self.cnt], self.sn[:self.cnt]
+
+    def decode_vendor_product(self):
+        self.decode_vid(OFF_VENDOR)
+        self.decode_pid(OFF_VENDOR + 2)
+        self.decode_serial(OFF_VENDOR + 4)
+        self.decode_mfrdate(OFF_VENDOR + 8)
+        self.put(self.sn[OFF_VENDOR][0], self.sn[OFF_VERSION - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['Vendor/product']])
+
+    def decode_version(self):
+        self.put(self.sn[OFF_VERSION][0], self.sn[OFF_BASIC - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['EDID Version']])
+        self.put(self.sn[OFF_VERSION][0], self.sn[OFF_VERSION][1],
+                self.out_ann, [ANN_FIELDS,
+                    ["Version %d" % self.cache[OFF_VERSION]]])
+        self.put(self.sn[OFF_VERSION+1][0], self.sn[OFF_VERSION+1][1],
+                self.out_ann, [ANN_FIELDS,
+                    [ "Revision %d" % self.cache[OFF_VERSION+1]]])
+
+    def decode_basic(self):
+        self.put(self.sn[OFF_BASIC][0], self.sn[OFF_CHROM - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['Basic display']])
+        self.decode_basicdisplay(OFF_BASIC)
+
+    def decode_chrom(self):
+        self.put(self.sn[OFF_CHROM][0], self.sn[OFF_EST_TIMING - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['Color characteristics']])
+        self.decode_chromaticity(OFF_CHROM)
+
+    def decode_est(self):
+        self.put(self.sn[OFF_EST_TIMING][0], self.sn[OFF_STD_TIMING - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['Established timings']])
+        self.decode_est_timing(OFF_EST_TIMING)
+
+    def decode_std(self):
+        self.put(self.sn[OFF_STD_TIMING][0], self.sn[OFF_DET_TIMING - 1][1],
+                self.out_ann, [ANN_SECTIONS, ['Standard timings']])
+        self.decode_std_timing(OFF_STD_TIMING)
+
+    def decode_det(self):
+        self.decode_descriptors(OFF_DET_TIMING)
+
+    def decode_num_ext(self):
+        self.ann_field(OFF_NUM_EXT, OFF_NUM_EXT,
+                'Extensions present: %d' % self.cache[OFF_NUM_EXT])
+
+    def decode_checksum(self):
+        if sum(self.cache[:OFF_CHECKSUM + 1]) % 256 == 0:
+            csstr = 'OK'
+        else:
+            csstr = 'WRONG!'
+        self.ann_field(OFF_CHECKSUM, OFF_CHECKSUM, 'Checksum: %d (%s)' % (
+                       self.cache[OFF_CHECKSUM], csstr))
 
     def ann_field(self, start, end, annotation):
         self.put(self.sn[start][0], self.sn[end][1],
@@ -352,7 +384,7 @@ class Decoder(srd.Decoder):
                     'Supported standard modes: %s' % modestr[:-2])
 
     def decode_detailed_timing(self, offset):
-        if offset == -72 and self.have_preferred_timing:
+        if offset == OFF_DET_TIMING and self.have_preferred_timing:
             # Only on first detailed timing descriptor
             section = 'Preferred'
         else:
@@ -485,7 +517,7 @@ class Decoder(srd.Decoder):
 
     def decode_descriptors(self, offset):
         # 4 consecutive 18-byte descriptor blocks
-        for i in range(offset, 0, 18):
+        for i in range(offset, OFF_NUM_EXT, 18):
             if self.cache[i] != 0 and self.cache[i+1] != 0:
                 self.decode_detailed_timing(i)
             else:
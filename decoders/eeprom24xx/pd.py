@@ -92,7 +92,6 @@ class Decoder(srd.Decoder):
         self.put(bits[bit1][1], bits[bit2][2], self.out_ann, data)
 
     def reset(self):
-        self.state = 'WAIT FOR START'
         self.packets = []
         self.bytebuf = []
         self.is_cur_addr_read = False
@@ -101,11 +100,6 @@ class Decoder(srd.Decoder):
         self.is_byte_write = False
         self.is_page_write = False
 
-    def packet_append(self):
-        self.packets.append([self.ss, self.es, self.cmd, self.databyte, self.bits])
-        if self.cmd in ('DATA READ', 'DATA WRITE'):
-            self.bytebuf.append(self.databyte)
-
     def hexbytes(self, idx):
         return ' '.join(['%02X' % b for b in self.bytebuf[idx:]])
 
@@ -178,15 +172,6 @@ class Decoder(srd.Decoder):
             d = d[:-1]
         return 'addr=%s, %s' % (a, d)
 
-    def decide_on_seq_or_rnd_read(self):
-        if len(self.bytebuf) < 2:
-            self.reset()
-            return
-        if len(self.bytebuf) == 2:
-            self.is_random_access_read = True
-        else:
-            self.is_seq_random_read = True
-
     def put_operation(self):
         idx = 1 + self.chip['addr_bytes']
         if self.is_byte_write:
@@ -228,203 +213,111 @@ class Decoder(srd.Decoder):
             self.put_word_addr(self.packets)
             self.put_data_bytes(idx + 1, 13, 'Sequential random read')
 
-    def handle_wait_for_start(self):
-        # Wait for an I²C START condition.
-        if self.cmd not in ('START', 'START REPEAT'):
-            return
-        self.ss_block = self.ss
-        self.state = 'GET CONTROL WORD'
-
-    def handle_get_control_word(self):
-        # The packet after START must be an ADDRESS READ or ADDRESS WRITE.
-        if self.cmd not in ('ADDRESS READ', 'ADDRESS WRITE'):
-            self.reset()
-            return
-        self.packet_append()
-        self.put_control_word(self.bits)
-        self.state = '%s GET ACK NACK AFTER CONTROL WORD' % self.cmd[8]
-
-    def handle_r_get_ack_nack_after_control_word(self):
-        if self.cmd == 'ACK':
-            self.state = 'R GET WORD ADDR OR BYTE'
-        elif self.cmd == 'NACK':
-            self.es_block = self.es
-            self.putb([0, ['Warning: No reply from slave!']])
-            self.reset()
+    def packet_append(self, ss, es, cmd, databyte, bits=None):
+        self.packets.append([ss, es, cmd, databyte, bits])
+        if cmd in ('DATA READ', 'DATA WRITE'):
+            self.bytebuf.append(databyte)
+
+    def messages_append(self, msg):
+        # Append the control word and all data bytes of an I²C message.
+        addr, rw, data, acks, ranges, bits = msg
+        self.packet_append(ranges[0][0], ranges[0][1], 'ADDRESS ' + rw,
+                           (addr << 1) | (rw == 'READ'), bits)
+        for b, (ss, es) in zip(data, ranges[1:]):
+            self.packet_append(ss, es, 'DATA ' + rw, b)
+
+    def put_operation_end(self, msgs, i, es):
+        # An operation should be followed by a STOP, not a repeated START.
+        if i < len(msgs):
+            self.es_block = msgs[i][4][0][0]
+            self.putb([0, ['Warning: STOP expected (not RESTART)']])
         else:
-            self.reset()
-
-    def handle_r_get_word_addr_or_byte(self):
-        if self.cmd == 'STOP':
-            self.es_block = self.es
-            self.putb([0, ['Warning: Slave replied, but master aborted!']])
-            self.reset()
-            return
-        elif self.cmd != 'DATA READ':
-            self.reset()
-            return
-        self.packet_append()
-        self.state = 'R GET ACK NACK AFTER WORD ADDR OR BYTE'
+            self.es_block = es
+        self.put_operation()
 
-    def handle_r_get_ack_nack_after_word_addr_or_byte(self):
-        if self.cmd == 'ACK':
-            self.state = 'R GET RESTART'
-        elif self.cmd == 'NACK':
+    def handle_operation(self, msgs, i, es):
+        # Handle the operation starting with message i of a transaction,
+        # return the index of the message following the operation.
+        self.reset()
+        msg = msgs[i]
+        addr, rw, data, acks, ranges, bits = msg
+        self.messages_append(msg)
+        self.put_control_word(self.packets[0][4])
+
+        # The slave has to ACK its address.
+        if acks[:1] != b'\x01':
+            if acks:
+                # The ACK/NACK bit directly follows the address byte.
+                a_ss, a_es = ranges[0]
+                self.es_block = a_es + (a_es - a_ss) // 8
+                self.putb([0, ['Warning: No reply from slave!']])
+            return i + 1
+
+        if not data:
+            if i + 1 == len(msgs):
+                self.es_block = es
+                self.putb([0, ['Warning: Slave replied, but master aborted!']])
+            return i + 1
+
+        if rw == 'READ':
+            # Current address read: no word address, one data byte.
+            if acks[1:] != b'\x00':
+                return i + 1
             self.is_cur_addr_read = True
-            self.state = 'GET STOP AFTER LAST BYTE'
-        else:
-            self.reset()
-
-    def handle_r_get_restart(self):
-        if self.cmd == 'RESTART':
-            self.state = 'R READ BYTE'
-        else:
-            self.reset()
-
-    def handle_r_read_byte(self):
-        if self.cmd == 'DATA READ':
-            self.packet_append()
-            self.state = 'R GET ACK NACK AFTER BYTE WAS READ'
-        else:
-            self.reset()
-
-    def handle_r_get_ack_nack_after_byte_was_read(self):
-        if self.cmd == 'ACK':
-            self.state = 'R READ BYTE'
-        elif self.cmd == 'NACK':
-            # It's either a RANDOM READ or a SEQUENTIAL READ.
-            self.state = 'GET STOP AFTER LAST BYTE'
-        else:
-            self.reset()
-
-    def handle_w_get_ack_nack_after_control_word(self):
-        if self.cmd == 'ACK':
-            self.state = 'W GET WORD ADDR'
-        elif self.cmd == 'NACK':
-            self.es_block = self.es
-            self.putb([0, ['Warning: No reply from slave!']])
-            self.reset()
-        else:
-            self.reset()
+            self.put_operation_end(msgs, i + 1, es)
+            return i + 1
 
-    def handle_w_get_word_addr(self):
-        if self.cmd == 'STOP':
-            self.es_block = self.es
-            self.putb([0, ['Warning: Slave replied, but master aborted!']])
-            self.reset()
-            return
-        elif self.cmd != 'DATA WRITE':
-            self.reset()
-            return
-        self.packet_append()
-        self.state = 'W GET ACK AFTER WORD ADDR'
-
-    def handle_w_get_ack_after_word_addr(self):
-        if self.cmd == 'ACK':
-            self.state = 'W DETERMINE EEPROM READ OR WRITE'
-        else:
-            self.reset()
+        # All bytes written have to be ACKed.
+        if acks.count(1) != len(data) + 1:
+            return i + 1
 
-    def handle_w_determine_eeprom_read_or_write(self):
-        if self.cmd == 'START REPEAT':
+        addr_bytes = self.chip['addr_bytes']
+        if len(data) == addr_bytes and i + 1 < len(msgs) and \
+                msgs[i + 1][1] == 'READ':
             # It's either a RANDOM ACCESS READ or SEQUENTIAL RANDOM READ.
-            self.state = 'R2 GET CONTROL WORD'
-        elif self.cmd == 'DATA WRITE':
-            self.packet_append()
-            self.state = 'W GET ACK NACK AFTER BYTE WAS WRITTEN'
-        else:
-            self.reset()
+            rdata, racks = msgs[i + 1][2:4]
+            self.messages_append(msgs[i + 1])
+            # The address and all data bytes but the last one have to be
+            # ACKed, the last one should be NACKed.
+            n = len(rdata)
+            if not rdata or racks[:n] != b'\x01' * n or len(racks) == n:
+                return i + 2
+            if racks[n] == 1:
+                if i + 2 < len(msgs):
+                    return i + 2
+                self.es_block = es
+                self.putb([0, ['Warning: STOP expected after a NACK '
+                               '(not ACK)']])
+            if len(rdata) == 1:
+                self.is_random_access_read = True
+            else:
+                self.is_seq_random_read = True
+            self.put_operation_end(msgs, i + 2, es)
+            return i + 2
 
-    def handle_w_write_byte(self):
-        if self.cmd == 'DATA WRITE':
-            self.packet_append()
-            self.state = 'W GET ACK NACK AFTER BYTE WAS WRITTEN'
-        elif self.cmd == 'STOP':
-            if len(self.bytebuf) < 2:
-                self.reset()
-                return
-            self.es_block = self.es
-            if len(self.bytebuf) == 2:
+        if len(data) > addr_bytes:
+            if len(data) == addr_bytes + 1:
                 self.is_byte_write = True
             else:
                 self.is_page_write = True
-            self.put_operation()
-            self.reset()
-        elif self.cmd == 'START REPEAT':
-            # It's either a RANDOM ACCESS READ or SEQUENTIAL RANDOM READ.
-            self.state = 'R2 GET CONTROL WORD'
-        else:
-            self.reset()
-
-    def handle_w_get_ack_nack_after_byte_was_written(self):
-        if self.cmd == 'ACK':
-            self.state = 'W WRITE BYTE'
-        else:
-            self.reset()
-
-    def handle_r2_get_control_word(self):
-        if self.cmd == 'ADDRESS READ':
-            self.packet_append()
-            self.state = 'R2 GET ACK AFTER ADDR READ'
-        else:
-            self.reset()
-
-    def handle_r2_get_ack_after_addr_read(self):
-        if self.cmd == 'ACK':
-            self.state = 'R2 READ BYTE'
-        else:
-            self.reset()
-
-    def handle_r2_read_byte(self):
-        if self.cmd == 'DATA READ':
-            self.packet_append()
-            self.state = 'R2 GET ACK NACK AFTER BYTE WAS READ'
-        elif self.cmd == 'STOP':
-            self.decide_on_seq_or_rnd_read()
-            self.es_block = self.es
-            self.putb([0, ['Warning: STOP expected after a NACK (not ACK)']])
-            self.put_operation()
-            self.reset()
-        else:
-            self.reset()
-
-    def handle_r2_get_ack_nack_after_byte_was_read(self):
-        if self.cmd == 'ACK':
-            self.state = 'R2 READ BYTE'
-        elif self.cmd == 'NACK':
-            self.decide_on_seq_or_rnd_read()
-            self.state = 'GET STOP AFTER LAST BYTE'
-        else:
-            self.reset()
-
-    def handle_get_stop_after_last_byte(self):
-        if self.cmd == 'STOP':
-            self.es_block = self.es
-            self.put_operation()
-            self.reset()
-        elif self.cmd == 'START REPEAT':
-            self.es_block = self.es
-            self.putb([0, ['Warning: STOP expected (not RESTART)']])
-            self.put_operation()
-            self.reset()
-            self.ss_block = self.ss
-            self.state = 'GET CONTROL WORD'
-        else:
-            self.reset()
+            self.put_operation_end(msgs, i + 1, es)
+        return i + 1
+
+    def handle_transaction(self, ss, es, msgs):
+        self.ss_block = ss
+        i = 0
+        while i < len(msgs):
+            if i > 0:
+                # Operations following a repeated START.
+                self.ss_block = msgs[i][4][0][0]
+            i = self.handle_operation(msgs, i, es)
+        self.reset()
 
     def decode(self, ss, es, data):
-        self.cmd, self.databyte = data
+        cmd, databyte = data
 
-        # Collect the 'BITS' packet, then return. The next packet is
-        # guaranteed to belong to these bits we just stored.
-        if self.cmd == 'BITS':
-            self.bits = self.databyte
+        # Only whole I²C transactions (START to STOP) are used.
+        if cmd != 'TRANSACTION':
             return
 
-        # Store the start/end samples of this I²C packet.
-        self.ss, self.es = ss, es
-
-        # State machine.
-        s = 'handle_%s' % self.state.lower().replace(' ', '_')
-        handle_state = getattr(self, s)
-        handle_state()
+        self.handle_transaction(ss, es, databyte)
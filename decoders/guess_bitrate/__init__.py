@@ -24,6 +24,12 @@ communication on the specified channel. Typically this will be used to
 guess / detect the baudrate used in a UART communication snippet, but it
 could also be used to guess bitrates of certain other protocols or buses.
 
+The guess is based on a histogram of the intervals between edges, so a few
+glitches don't throw it off. It is updated every 'update_edges' edges (and at
+the end of the capture), and reported both as an annotation and as meta
+output: the most probable bitrate, a confidence figure (the fraction of edge
+intervals which fit that bitrate), and the closest standard bitrate.
+
 It should be noted that this is nothing more than a simple guess / heuristic,
 and that there are various cases in practice where the detection of the
 bitrate or baudrate will not necessarily have the expected result.
@@ -19,10 +19,35 @@
 ##
 
 import sigrokdecode as srd
+from common.bitwidth import estimate_bitwidth
+
+# Commonly used bitrates/baudrates, reported as candidates when close to
+# the estimate.
+STANDARD_BITRATES = (
+    300, 600, 1200, 2400, 4800, 9600, 14400, 19200, 28800, 31250, 38400,
+    57600, 76800, 115200, 230400, 250000, 460800, 500000, 921600, 1000000,
+    1500000, 2000000, 3000000, 4000000,
+)
+
+# Maximum relative deviation of a candidate from the estimated bitrate.
+CANDIDATE_TOLERANCE = 0.03
+
+# Intervals of up to 2^HIST_BITS samples get a histogram bin of their own,
+# longer ones are rounded to HIST_BITS significant bits. This keeps the
+# histogram small (at most 64 * 2^HIST_BITS bins) while keeping the relative
+# resolution better than 1%.
+HIST_BITS = 7
 
 class SamplerateError(Exception):
     pass
 
+# Return the histogram bin of an interval (in samples).
+def hist_bin(interval):
+    shift = interval.bit_length() - HIST_BITS
+    if shift <= 0:
+        return interval
+    return (interval >> shift) << shift
+
 class Decoder(srd.Decoder):
     api_version = 2
     id = 'guess_bitrate'
@@ -35,53 +60,101 @@ class Decoder(srd.Decoder):
     channels = (
         {'id': 'data', 'name': 'Data', 'desc': 'Data line'},
     )
+    options = (
+        {'id': 'update_edges', 'desc': 'Edges between estimates',
+            'default': 1000},
+    )
     annotations = (
         ('bitrate', 'Bitrate / baudrate'),
     )
 
-    def putx(self, data):
-        self.put(self.ss_edge, self.samplenum, self.out_ann, data)
-
     def __init__(self, **kwargs):
+        self.samplerate = None
         self.olddata = None
         self.ss_edge = None
-        self.first_transition = True
-        self.bitwidth = None
+        self.first_edge = None
+        self.histogram = {}
+        self.num_edges = 0
+        self.last_report = None
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_bitrate = self.register(srd.OUTPUT_META,
+                meta=(int, 'Bitrate', 'Most probable bitrate'))
+        self.out_confidence = self.register(srd.OUTPUT_META,
+                meta=(float, 'Confidence', 'Confidence of the bitrate (0-1)'))
+        self.out_standard = self.register(srd.OUTPUT_META,
+                meta=(int, 'Standard bitrate', 'Closest standard bitrate'))
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
 
+    # Report the current estimate, unless nothing changed since last time.
+    def report(self):
+        if self.last_report == self.num_edges:
+            return
+        self.last_report = self.num_edges
+        estimate = estimate_bitwidth(self.histogram)
+        if estimate is None:
+            return
+        bitwidth, confidence = estimate
+        bitrate = int(round(self.samplerate / bitwidth))
+        candidates = sorted((abs(r - bitrate), r) for r in STANDARD_BITRATES
+                            if abs(r - bitrate) <= CANDIDATE_TOLERANCE * r)
+        candidates = [r for _, r in candidates]
+
+        ss, es = self.first_edge, self.ss_edge
+        self.put(ss, es, self.out_bitrate, bitrate)
+        self.put(ss, es, self.out_confidence, confidence)
+        if candidates:
+            self.put(ss, es, self.out_standard, candidates[0])
+
+        c = '%d%%' % round(confidence * 100)
+        s = ', '.join('%d' % r for r in candidates)
+        if s:
+            texts = ['%d (confidence %s, standard: %s)' % (bitrate, c, s),
+                     '%d (%s, %s)' % (bitrate, c, s)]
+        else:
+            texts = ['%d (confidence %s)' % (bitrate, c)]
+        texts += ['%d (%s)' % (bitrate, c), '%d' % bitrate]
+        self.put(ss, es, self.out_ann, [0, texts])
+
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
-        for (self.samplenum, pins) in data:
-
-            data = pins[0]
+        update_edges = max(1, self.options['update_edges'])
+        histogram = self.histogram
+        for (samplenum, pins) in data:
+            # Let the next iteration continue at the next edge. Only edges
+            # (and the first sample of every chunk) get here.
+            data.skip()
 
-            # Wait for any transition on the data line.
-            if data == self.olddata:
+            if pins[0] == self.olddata:
                 continue
-
-            # Initialize first self.olddata with the first sample value.
             if self.olddata is None:
-                self.olddata = data
+                # Initialize with the first sample value, that's no edge.
+                self.olddata = pins[0]
                 continue
+            self.olddata = pins[0]
 
-            # Get the smallest distance between two transitions
-            # and use that to calculate the bitrate/baudrate.
-            if self.first_transition:
-                self.ss_edge = self.samplenum
-                self.first_transition = False
+            if self.ss_edge is None:
+                self.first_edge = self.ss_edge = samplenum
+                continue
+
+            b = hist_bin(samplenum - self.ss_edge)
+            entry = histogram.get(b)
+            if entry is None:
+                histogram[b] = [1, samplenum - self.ss_edge]
             else:
-                b = self.samplenum - self.ss_edge
-                if self.bitwidth is None or b < self.bitwidth:
-                    self.bitwidth = b
-                    bitrate = int(float(self.samplerate) / float(b))
-                    self.putx([0, ['%d' % bitrate]])
-                self.ss_edge = self.samplenum
-
-            self.olddata = data
+                entry[0] += 1
+                entry[1] += samplenum - self.ss_edge
+            self.ss_edge = samplenum
+
+            self.num_edges += 1
+            if self.num_edges % update_edges == 0:
+                self.report()
+
+    def end(self):
+        if self.samplerate:
+            self.report()
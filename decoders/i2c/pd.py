@@ -42,13 +42,40 @@ Packet:
  - 'ACK' (ACK bit)
  - 'NACK' (NACK bit)
  - 'BITS' (<pdata>: list of data/address bits and their ss/es numbers)
+ - 'TRANSACTION' (<pdata>: list of all messages from START to STOP)
 
 <pdata> is the data or address byte associated with the 'ADDRESS*' and 'DATA*'
 command. Slave addresses do not include bit 0 (the READ/WRITE indication bit).
 For example, a slave address field could be 0x51 (instead of 0xa2).
 For 'START', 'START REPEAT', 'STOP', 'ACK', and 'NACK' <pdata> is None.
+
+A 'TRANSACTION' packet is sent when the STOP condition is seen (before the
+'STOP' packet), in addition to the packets above. Its <pdata> holds one
+message per START/START REPEAT condition, as a tuple
+(<address>, <direction>, <data>, <acks>, <ranges>, <bits>):
+ - <address>: The 7-bit slave address (independent of the address format).
+ - <direction>: 'READ' or 'WRITE'.
+ - <data>: A bytes object with all data bytes of the message.
+ - <acks>: A bytes object with one entry per address/data byte, 1 for ACK,
+   0 for NACK. It is one entry short if the last byte wasn't acknowledged.
+ - <ranges>: List of (ss, es) tuples of the address byte and all data bytes,
+   i.e. what would have been the ss/es of the respective 'ADDRESS*'/'DATA*'
+   packets.
+ - <bits>: The bits of the address byte, as in its 'BITS' packet.
+Transactions with more than MAX_TRANSACTION bytes (e.g. due to a missing
+STOP condition) are not sent.
+
+Example (reading two bytes from offset 0x10 of an EEPROM at 0x50):
+ ['TRANSACTION', [(0x50, 'WRITE', b'\x10', b'\x01\x01', [(10, 46), (50, 86)],
+                   [[0, 42, 46], [0, 38, 42], ..., [1, 10, 14]]),
+                  (0x50, 'READ', b'\x3a\xff', b'\x01\x01\x00',
+                   [(95, 131), (135, 171), (175, 211)],
+                   [[1, 127, 131], [0, 123, 127], ..., [1, 95, 99]])]]
 '''
 
+# Upper limit for the number of bytes buffered for a 'TRANSACTION' packet.
+MAX_TRANSACTION = 65536
+
 # CMD: [annotation-type-index, long annotation, short annotation]
 proto = {
     'START':           [0, 'Start',         'S'],
@@ -122,6 +149,11 @@ class Decoder(srd.Decoder):
         self.pdu_start = None
         self.pdu_bits = 0
         self.bits = []
+        # Sample numbers of the (up to 8) bits of the current byte.
+        self.bitsamples = [0] * 8
+        self.ss_transaction = None
+        self.transaction = []
+        self.transaction_bytes = 0
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
@@ -170,6 +202,10 @@ class Decoder(srd.Decoder):
         self.putx([proto[cmd][0], proto[cmd][1:]])
         self.state = 'FIND ADDRESS'
         self.bitcount = self.databyte = 0
+        if not self.is_repeat_start:
+            self.ss_transaction = self.samplenum
+            self.transaction = []
+            self.transaction_bytes = 0
         self.is_repeat_start = 1
         self.wr = -1
         self.bits = []
@@ -184,20 +220,18 @@ class Decoder(srd.Decoder):
         if self.bitcount == 0:
             self.ss_byte = self.samplenum
 
-        # Store individual bits and their start/end samplenumbers.
-        # In the list, index 0 represents the LSB (I²C transmits MSB-first).
-        self.bits.insert(0, [sda, self.samplenum, self.samplenum])
-        if self.bitcount > 0:
-            self.bits[1][2] = self.samplenum
-        if self.bitcount == 7:
-            self.bitwidth = self.bits[1][2] - self.bits[2][2]
-            self.bits[0][2] += self.bitwidth
+        # Only remember where each bit starts, the bit values are in
+        # self.databyte.
+        self.bitsamples[self.bitcount] = self.samplenum
 
         # Return if we haven't collected all 8 + 1 bits, yet.
         if self.bitcount < 7:
             self.bitcount += 1
             return
 
+        self.bitwidth = self.samplenum - self.bitsamples[6]
+        self.bits = self.byte_bits()
+
         d = self.databyte
         if self.state == 'FIND ADDRESS':
             # The READ/WRITE bit is only in address bytes, not data bytes.
@@ -226,6 +260,8 @@ class Decoder(srd.Decoder):
 
         self.putb((bin_class, bytes([d])))
 
+        self.transaction_add(d)
+
         for bit in self.bits:
             self.put(bit[1], bit[2], self.out_ann, [5, ['%d' % bit[0]]])
 
@@ -243,9 +279,47 @@ class Decoder(srd.Decoder):
         self.bits = []
         self.state = 'FIND ACK'
 
+    # Individual bits and their start/end samplenumbers. In the list,
+    # index 0 represents the LSB (I²C transmits MSB-first).
+    def byte_bits(self):
+        s, d = self.bitsamples, self.databyte
+        bits = [[d & 1, s[7], s[7] + self.bitwidth]]
+        for i in range(1, 8):
+            bits.append([(d >> i) & 1, s[7 - i], s[8 - i]])
+        return bits
+
+    # Collect the address/data bytes for the 'TRANSACTION' packet.
+    def transaction_add(self, d):
+        if self.transaction is None:
+            return
+        self.transaction_bytes += 1
+        if self.transaction_bytes > MAX_TRANSACTION:
+            self.transaction = None
+            return
+        if self.state == 'FIND ADDRESS':
+            rw = 'WRITE' if self.wr else 'READ'
+            msg = [self.databyte >> 1, rw, bytearray(), bytearray(),
+                   [(self.ss, self.es)], self.bits]
+            self.transaction.append(msg)
+        elif self.transaction:
+            msg = self.transaction[-1]
+            msg[2].append(d)
+            msg[4].append((self.ss, self.es))
+
+    def puttransaction(self):
+        if self.transaction:
+            msgs = [(a, rw, bytes(data), bytes(acks), ranges, bits)
+                    for a, rw, data, acks, ranges, bits in self.transaction]
+            self.put(self.ss_transaction, self.samplenum, self.out_python,
+                     ['TRANSACTION', msgs])
+        self.transaction = []
+        self.transaction_bytes = 0
+
     def get_ack(self, scl, sda):
         self.ss, self.es = self.samplenum, self.samplenum + self.bitwidth
         cmd = 'NACK' if (sda == 1) else 'ACK'
+        if self.transaction:
+            self.transaction[-1][3].append(0 if sda else 1)
         self.putp([cmd, None])
         self.putx([proto[cmd][0], proto[cmd][1:]])
         # There could be multiple data bytes in a row, so either find
@@ -258,6 +332,8 @@ class Decoder(srd.Decoder):
         bitrate = int(1 / elapsed * self.pdu_bits)
         self.put(self.ss_byte, self.samplenum, self.out_bitrate, bitrate)
 
+        self.puttransaction()
+
         cmd = 'STOP'
         self.ss, self.es = self.samplenum, self.samplenum
         self.putp([cmd, None])
@@ -273,6 +349,8 @@ class Decoder(srd.Decoder):
         for (self.samplenum, pins) in data:
 
             # Ignore identical samples early on (for performance reasons).
+            # Let the next iteration continue at the next change.
+            data.skip()
             if self.oldpins == pins:
                 continue
             self.oldpins, (scl, sda) = pins, pins
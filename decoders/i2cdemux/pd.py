@@ -19,6 +19,7 @@
 ##
 
 import sigrokdecode as srd
+from common.i2cpackets import HeldPackets
 
 class Decoder(srd.Decoder):
     api_version = 2
@@ -29,49 +30,69 @@ class Decoder(srd.Decoder):
     license = 'gplv2+'
     inputs = ['i2c']
     outputs = [] # TODO: Only known at run-time.
+    options = (
+        {'id': 'max_packets', 'desc': 'Max. packets held back per transfer',
+            'default': 64},
+    )
+    annotations = (
+        ('warnings', 'Warnings'),
+    )
 
     def __init__(self, **kwargs):
-        self.packets = [] # Local cache of I²C packets
-        self.slaves = [] # List of known slave addresses
-        self.stream = -1 # Current output stream
-        self.streamcount = 0 # Number of created output streams
+        self.streams = {} # Output streams, keyed by slave address
+        self.stream = None # Current output stream
+        self.msg_streams = [] # Output stream of each message of a transfer
 
     def start(self):
-        self.out_python = []
+        self.out_ann = self.register(srd.OUTPUT_ANN)
+        # Local cache of I²C packets
+        self.held = HeldPackets(self, self.out_ann,
+                                self.options['max_packets'])
 
-    # Grab I²C packets into a local cache, until an I²C STOP condition
-    # packet comes along. At some point before that STOP condition, there
-    # will have been an ADDRESS READ or ADDRESS WRITE which contains the
-    # I²C address of the slave that the master wants to talk to.
-    # We use this slave address to figure out which output stream should
-    # get the whole chunk of packets (from START to STOP).
+    # Send each slave the messages of a transaction that were addressed
+    # to it. The stream of each message was recorded with its address.
+    def put_transaction(self, ss, es, msgs):
+        per_stream = {}
+        for stream, msg in zip(self.msg_streams, msgs):
+            per_stream.setdefault(stream, []).append(msg)
+        for stream, stream_msgs in per_stream.items():
+            self.put(ss, es, stream, ['TRANSACTION', stream_msgs])
+
+    # Grab I²C packets into a local cache, until an ADDRESS READ or
+    # ADDRESS WRITE packet comes along, which contains the I²C address of
+    # the slave that the master wants to talk to. We use this slave address
+    # to figure out which output stream should get the cached packets, and
+    # all further packets of this message (up to the next STOP or START
+    # REPEAT). A START REPEAT is held back as well, as it belongs to the
+    # slave addressed next, which need not be the current one.
     def decode(self, ss, es, data):
 
         cmd, databyte = data
 
-        # Add the I²C packet to our local cache.
-        self.packets.append([ss, es, data])
-
-        if cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
-            if databyte in self.slaves:
-                self.stream = self.slaves.index(databyte)
-                return
-
-            # We're never seen this slave, add a new stream.
-            self.slaves.append(databyte)
-            self.out_python.append(self.register(srd.OUTPUT_PYTHON,
-                                   proto_id='i2c-%s' % hex(databyte)))
-            self.stream = self.streamcount
-            self.streamcount += 1
-        elif cmd == 'STOP':
-            if self.stream == -1:
-                raise Exception('Invalid stream!') # FIXME?
+        if cmd in ('START', 'START REPEAT'):
+            if cmd == 'START':
+                self.msg_streams = []
+            self.held.drop(ss, 'no slave address')
+            self.stream = None
+        elif cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
+            self.stream = self.streams.get(databyte)
+            if self.stream is None:
+                # We've never seen this slave, add a new stream.
+                self.stream = self.register(srd.OUTPUT_PYTHON,
+                                            proto_id='i2c-%s' % hex(databyte))
+                self.streams[databyte] = self.stream
+            self.msg_streams.append(self.stream)
+            for p in self.held.take():
+                self.put(p[0], p[1], self.stream, p[2])
+        elif cmd == 'TRANSACTION':
+            self.put_transaction(ss, es, databyte)
+            return
 
-            # Send the whole chunk of I²C packets to the correct stream.
-            for p in self.packets:
-                self.put(p[0], p[1], self.out_python[self.stream], p[2])
+        if self.stream is None:
+            # Hold packets back until we know which stream they belong to.
+            self.held.add(ss, es, data)
+            return
 
-            self.packets = []
-            self.stream = -1
-        else:
-            pass # Do nothing, only add the I²C packet to our cache.
+        self.put(ss, es, self.stream, data)
+        if cmd == 'STOP':
+            self.stream = None
@@ -21,6 +21,7 @@
 # TODO: Support for filtering out multiple slave/direction pairs?
 
 import sigrokdecode as srd
+from common.i2cpackets import HeldPackets
 
 class Decoder(srd.Decoder):
     api_version = 2
@@ -35,55 +36,75 @@ class Decoder(srd.Decoder):
         {'id': 'address', 'desc': 'Address to filter out of the I²C stream',
             'default': 0},
         {'id': 'direction', 'desc': 'Direction to filter', 'default': 'both',
-            'values': ('read', 'write', 'both')}
+            'values': ('read', 'write', 'both')},
+        {'id': 'max_packets', 'desc': 'Max. packets held back per transfer',
+            'default': 64},
+    )
+    annotations = (
+        ('warnings', 'Warnings'),
     )
 
     def __init__(self, **kwargs):
         self.curslave = -1
         self.curdirection = None
-        self.packets = [] # Local cache of I²C packets
+        self.passing = None # Whether the current message passes the filter
+        self.msg_passing = [] # Filter result of each message of a transfer
 
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON, proto_id='i2c')
+        self.out_ann = self.register(srd.OUTPUT_ANN)
         if self.options['address'] not in range(0, 127 + 1):
             raise Exception('Invalid slave (must be 0..127).')
+        # Local cache of I²C packets
+        self.held = HeldPackets(self, self.out_ann,
+                                self.options['max_packets'])
+
+    def wanted(self):
+        # If this message is not for the correct slave, drop it.
+        if self.options['address'] not in (0, self.curslave):
+            return False
+        # If this message is not in the right direction, drop it.
+        if self.options['direction'] not in ('both', self.curdirection):
+            return False
+        return True
 
-    # Grab I²C packets into a local cache, until an I²C STOP condition
-    # packet comes along. At some point before that STOP condition, there
-    # will have been an ADDRESS READ or ADDRESS WRITE which contains the
-    # I²C address of the slave that the master wants to talk to.
-    # If that slave shall be filtered, output the cache (all packets from
-    # START to STOP) as proto 'i2c', otherwise drop it.
+    # Grab I²C packets into a local cache, until an ADDRESS READ or
+    # ADDRESS WRITE packet comes along, which contains the I²C address of
+    # the slave that the master wants to talk to. If that slave shall be
+    # filtered, output the cache and all further packets of this message
+    # (up to the next STOP or START REPEAT) as proto 'i2c', otherwise
+    # drop them.
     def decode(self, ss, es, data):
 
         cmd, databyte = data
 
-        # Add the I²C packet to our local cache.
-        self.packets.append([ss, es, data])
-
-        if cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
+        if cmd == 'START':
+            self.msg_passing = []
+        if cmd in ('START', 'START REPEAT'):
+            self.passing = None
+            self.held.drop(ss, 'no slave address')
+        elif cmd in ('ADDRESS READ', 'ADDRESS WRITE'):
             self.curslave = databyte
             self.curdirection = cmd[8:].lower()
-        elif cmd in ('STOP', 'START REPEAT'):
-            # If this chunk was not for the correct slave, drop it.
-            if self.options['address'] == 0:
-                pass
-            elif self.curslave != self.options['address']:
-                self.packets = []
-                return
-
-            # If this chunk was not in the right direction, drop it.
-            if self.options['direction'] == 'both':
-                pass
-            elif self.options['direction'] != self.curdirection:
-                self.packets = []
-                return
+            self.passing = self.wanted()
+            self.msg_passing.append(self.passing)
+            packets = self.held.take()
+            if self.passing:
+                for p in packets:
+                    self.put(p[0], p[1], self.out_python, p[2])
+        elif cmd == 'TRANSACTION':
+            # Only keep the messages which passed the filter.
+            msgs = [m for m, p in zip(databyte, self.msg_passing) if p]
+            if msgs:
+                self.put(ss, es, self.out_python, ['TRANSACTION', msgs])
+            return
 
-            # TODO: START->STOP chunks with both read and write (Repeat START)
-            # Otherwise, send out the whole chunk of I²C packets.
-            for p in self.packets:
-                self.put(p[0], p[1], self.out_python, p[2])
+        if self.passing is None:
+            # Hold packets back until we know where they're going.
+            self.held.add(ss, es, data)
+            return
 
-            self.packets = []
-        else:
-            pass # Do nothing, only add the I²C packet to our cache.
+        if self.passing:
+            self.put(ss, es, self.out_python, data)
+        if cmd == 'STOP':
+            self.passing = None
@@ -19,6 +19,9 @@
 ##
 
 import sigrokdecode as srd
+import struct
+import sys
+from array import array
 
 '''
 OUTPUT_PYTHON format:
@@ -31,8 +34,22 @@ Packet:
 
 <channel>: 'L' or 'R'
 <value>: integer
+
+The binary 'wav' output is a stereo PCM WAV file with 16, 24 or 32 bits per
+sample. As the file is streamed, its header can't know the final sizes and
+uses the maximum ones (which most tools accept). At the end of the stream,
+the binary 'wav-header' output gets the header with the correct sizes, which
+can be written over the start of the 'wav' output. Past 4 GiB of samples the
+sizes don't fit into the header, it keeps the maximum ones then.
 '''
 
+# Samples buffered before they're sent to the 'wav' binary output.
+WAV_CHUNK = 8192
+
+# Common audio sample rates, the measured rate is rounded to one of these.
+audio_samplerates = (8000, 11025, 16000, 22050, 32000, 44100, 48000, 88200,
+                     96000, 176400, 192000)
+
 class SamplerateError(Exception):
     pass
 
@@ -55,8 +72,15 @@ class Decoder(srd.Decoder):
         ('right', 'Right channel'),
         ('warnings', 'Warnings'),
     )
+    options = (
+        {'id': 'wav_bits', 'desc': 'WAV bits per sample', 'default': 16,
+            'values': (16, 24, 32)},
+        {'id': 'wav_samplerate', 'desc': 'WAV samplerate (0 = measured)',
+            'default': 0},
+    )
     binary = (
         ('wav', 'WAV file'),
+        ('wav-header', 'WAV header (final sizes)'),
     )
 
     def __init__(self, **kwargs):
@@ -70,15 +94,23 @@ class Decoder(srd.Decoder):
         self.ss_block = None
         self.wordlength = -1
         self.wrote_wav_header = False
+        self.wav_bits = 16
+        self.pcm = []
+        self.ss_pcm = None
+        self.pcm_bytes = 0
+        self.latency = 0 # Max. samples to hold PCM data back (0: no limit)
 
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_bin = self.register(srd.OUTPUT_BINARY)
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.wav_bits = self.options['wav_bits']
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
+        elif key == srd.SRD_CONF_LATENCY:
+            self.latency = value
 
     def putpb(self, data):
         self.put(self.ss_block, self.samplenum, self.out_python, data)
@@ -103,32 +135,65 @@ class Decoder(srd.Decoder):
         return 'I²S: %d %d-bit samples received at %sHz' % \
             (self.samplesreceived, self.wordlength, samplerate)
 
-    def wav_header(self):
-        # Chunk descriptor
-        h  = b'RIFF'
-        h += b'\x24\x80\x00\x00' # Chunk size (2084)
-        h += b'WAVE'
-        # Fmt subchunk
-        h += b'fmt '
-        h += b'\x10\x00\x00\x00' # Subchunk size (16 bytes)
-        h += b'\x01\x00'         # Audio format (0x0001 == PCM)
-        h += b'\x02\x00'         # Number of channels (2)
-        h += b'\x80\x3e\x00\x00' # Samplerate (16000)
-        h += b'\x00\x7d\x00\x00' # Byterate (32000)
-        h += b'\x04\x00'         # Blockalign (4)
-        h += b'\x10\x00'         # Bits per sample (16)
-        # Data subchunk
-        h += b'data'
-        h += b'\xff\xff\x00\x00' # Subchunk size (65535 bytes) TODO
-        return h
+    def wav_samplerate(self):
+        if self.options['wav_samplerate']:
+            return self.options['wav_samplerate']
+        # Measure the WS frequency, and round to a common rate if close.
+        if self.ss_block is None or self.ss_block <= self.first_sample:
+            return 0
+        rate = (self.samplesreceived // 2) * self.samplerate / \
+            (self.ss_block - self.first_sample)
+        common = min(audio_samplerates, key=lambda r: abs(r - rate))
+        if abs(common - rate) <= common / 100:
+            return common
+        return int(round(rate))
+
+    def wav_header(self, datasize=None):
+        # Without a datasize, use the maximum sizes (for streaming). Files
+        # past 4 GiB don't fit into the 32-bit fields, keep the maximum then.
+        if datasize is None:
+            datasize = 0xffffffff
+        riffsize = min(36 + datasize, 0xffffffff)
+        datasize = min(datasize, 0xffffffff)
+        samplerate = self.wav_samplerate()
+        blockalign = 2 * self.wav_bits // 8
+        return struct.pack('<4sI4s4sIHHIIHH4sI',
+            b'RIFF', riffsize, b'WAVE',
+            b'fmt ', 16,                    # Subchunk size (16 bytes)
+            1,                              # Audio format (0x0001 == PCM)
+            2,                              # Number of channels
+            samplerate, samplerate * blockalign, blockalign, self.wav_bits,
+            b'data', datasize)
 
     def wav_sample(self, sample):
-        # TODO: This currently assumes U32 samples, and converts to S16.
-        s = sample >> 16
-        if s >= 0x8000:
-            s -= 0x10000
-        lo, hi = s & 0xff, (s >> 8) & 0xff
-        return bytes([lo, hi])
+        # Keep the top wav_bits bits of the word, as signed integer.
+        bits = self.wav_bits
+        if self.wordlength >= bits:
+            s = sample >> (self.wordlength - bits)
+        else:
+            s = sample << (bits - self.wordlength)
+        if s >= 1 << (bits - 1):
+            s -= 1 << bits
+        return s
+
+    def flush_pcm(self, es):
+        if not self.wrote_wav_header:
+            # Sizes aren't known yet, see end() for the final header.
+            self.put(0, 0, self.out_bin, (0, self.wav_header()))
+            self.wrote_wav_header = True
+        if not self.pcm:
+            return
+
+        a = array('h' if self.wav_bits == 16 else 'i', self.pcm)
+        if sys.byteorder == 'big':
+            a.byteswap()
+        b = bytearray(a.tobytes())
+        if self.wav_bits == 24:
+            # Drop the top byte of each 32-bit little endian value.
+            del b[3::4]
+        self.put(self.ss_pcm, es, self.out_bin, (0, bytes(b)))
+        self.pcm_bytes += len(b)
+        self.pcm = []
 
     def decode(self, ss, es, data):
         if not self.samplerate:
@@ -137,10 +202,12 @@ class Decoder(srd.Decoder):
 
             # Ignore sample if the bit clock hasn't changed.
             if sck == self.oldsck:
+                data.skip()
                 continue
 
             self.oldsck = sck
             if sck == 0:   # Ignore the falling clock edge.
+                data.skip()
                 continue
 
             self.data = (self.data << 1) | sd
@@ -153,10 +220,6 @@ class Decoder(srd.Decoder):
             # Only submit the sample, if we received the beginning of it.
             if self.ss_block is not None:
 
-                if not self.wrote_wav_header:
-                    self.put(0, 0, self.out_bin, (0, self.wav_header()))
-                    self.wrote_wav_header = True
-
                 self.samplesreceived += 1
 
                 idx = 0 if self.oldws else 1
@@ -167,7 +230,6 @@ class Decoder(srd.Decoder):
                 self.putpb(['DATA', [c3, self.data]])
                 self.putb([idx, ['%s: %s' % (c1, v), '%s: %s' % (c2, v),
                                  '%s: %s' % (c3, v), c3]])
-                self.putbin((0, self.wav_sample(self.data)))
 
                 # Check that the data word was the correct length.
                 if self.wordlength != -1 and self.wordlength != self.bitcount:
@@ -176,6 +238,18 @@ class Decoder(srd.Decoder):
 
                 self.wordlength = self.bitcount
 
+                # The WAV file starts with a left channel sample.
+                if self.pcm or c3 == 'L' or self.pcm_bytes:
+                    if not self.pcm:
+                        self.ss_pcm = self.ss_block
+                    self.pcm.append(self.wav_sample(self.data))
+                    # Don't hold whole frames back for longer than the
+                    # configured latency.
+                    if len(self.pcm) >= WAV_CHUNK or (self.latency and
+                            len(self.pcm) % 2 == 0 and
+                            self.samplenum - self.ss_pcm >= self.latency):
+                        self.flush_pcm(self.samplenum)
+
             # Reset decoder state.
             self.data = 0
             self.bitcount = 0
@@ -186,3 +260,12 @@ class Decoder(srd.Decoder):
                 self.first_sample = self.samplenum
 
             self.oldws = ws
+
+    def end(self):
+        if self.ss_block is None or (not self.pcm and not self.pcm_bytes):
+            return
+        # Only whole frames (left and right sample) go into the file.
+        if len(self.pcm) % 2:
+            self.pcm.pop()
+        self.flush_pcm(self.ss_block)
+        self.put(0, 0, self.out_bin, (1, self.wav_header(self.pcm_bytes)))
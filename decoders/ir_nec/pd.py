@@ -19,6 +19,7 @@
 ##
 
 import sigrokdecode as srd
+from common.irtiming import PulseTiming, PulseTrain
 from .lists import *
 
 class SamplerateError(Exception):
@@ -102,33 +103,33 @@ class Decoder(srd.Decoder):
     def __init__(self, **kwargs):
         self.state = 'IDLE'
         self.ss_bit = self.ss_start = self.ss_other_edge = self.ss_remote = 0
-        self.data = self.count = self.active = self.old_ir = None
+        self.data = self.count = self.active = self.pulses = None
         self.addr = self.cmd = None
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
         self.active = 0 if self.options['polarity'] == 'active-low' else 1
-        self.old_ir = 1 if self.active == 0 else 0
+        self.pulses = PulseTrain(1 if self.active == 0 else 0)
 
     def metadata(self, key, value):
-        if key == srd.SRD_CONF_SAMPLERATE:
-            self.samplerate = value
+        if key != srd.SRD_CONF_SAMPLERATE:
+            return
+        self.samplerate = value
         self.margin = int(self.samplerate * 0.0001) - 1 # 0.1ms
         self.lc = int(self.samplerate * 0.0135) - 1 # 13.5ms
         self.rc = int(self.samplerate * 0.01125) - 1 # 11.25ms
         self.dazero = int(self.samplerate * 0.001125) - 1 # 1.125ms
         self.daone = int(self.samplerate * 0.00225) - 1 # 2.25ms
         self.stop = int(self.samplerate * 0.000652) - 1 # 0.652ms
-
-    def handle_bit(self, tick):
-        ret = None
-        if tick in range(self.dazero - self.margin, self.dazero + self.margin):
-            ret = 0
-        elif tick in range(self.daone - self.margin, self.daone + self.margin):
-            ret = 1
-        if ret in (0, 1):
-            self.putb([0, ['%d' % ret]])
-            self.data |= (ret << self.count) # LSB-first
+        # Tolerance windows for the time between two active edges.
+        self.timing = PulseTiming([(name, t - self.margin, t + self.margin)
+            for (name, t) in (('leader', self.lc), ('repeat', self.rc),
+                              (0, self.dazero), (1, self.daone))])
+
+    def handle_bit(self, bit):
+        if bit in (0, 1):
+            self.putb([0, ['%d' % bit]])
+            self.data |= (bit << self.count) # LSB-first
             self.count = self.count + 1
         self.ss_bit = self.samplenum
 
@@ -153,28 +154,24 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
-        for (self.samplenum, pins) in data:
-            self.ir = pins[0]
+        for (self.samplenum, ir) in self.pulses.edges(data):
 
             # Wait for an "interesting" edge, but also record the other ones.
-            if self.old_ir == self.ir:
-                continue
-            if self.ir != self.active:
+            if ir != self.active:
                 self.ss_other_edge = self.samplenum
-                self.old_ir = self.ir
                 continue
 
-            b = self.samplenum - self.ss_bit
+            b = self.timing.classify(self.samplenum - self.ss_bit)
 
             # State machine.
             if self.state == 'IDLE':
-                if b in range(self.lc - self.margin, self.lc + self.margin):
+                if b == 'leader':
                     self.putpause('Long')
                     self.putx([5, ['Leader code', 'Leader', 'LC', 'L']])
                     self.ss_remote = self.ss_start
                     self.data = self.count = 0
                     self.state = 'ADDRESS'
-                elif b in range(self.rc - self.margin, self.rc + self.margin):
+                elif b == 'repeat':
                     self.putpause('Short')
                     self.putstop(self.samplenum)
                     self.samplenum += self.stop
@@ -202,5 +199,3 @@ class Decoder(srd.Decoder):
                 self.putremote()
                 self.ss_bit = self.ss_start = self.samplenum
                 self.state = 'IDLE'
-
-            self.old_ir = self.ir
@@ -19,6 +19,7 @@
 ##
 
 import sigrokdecode as srd
+from common.irtiming import PulseTiming, PulseTrain
 from .lists import *
 
 class SamplerateError(Exception):
@@ -64,13 +65,18 @@ class Decoder(srd.Decoder):
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
-        self.old_ir = 1 if self.options['polarity'] == 'active-low' else 0
+        self.pulses = PulseTrain(1 if self.options['polarity'] == 'active-low'
+                                 else 0)
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
             # One bit: 1.78ms (one half low, one half high).
             self.halfbit = int((self.samplerate * 0.00178) / 2.0)
+            # Categorize edges by distance from the last edge (short/long).
+            s, l, margin = self.halfbit, self.halfbit * 2, int(self.halfbit / 2)
+            self.timing = PulseTiming((('l', l - margin, l + margin + 1),
+                                       ('s', s - margin, s + margin + 1)))
 
     def putb(self, bit1, bit2, data):
         ss, es = self.ss_es_bits[bit1][0], self.ss_es_bits[bit2][1]
@@ -120,17 +126,6 @@ class Decoder(srd.Decoder):
              'Cmd: %d' % c, 'C: %d' % c, 'C']
         self.putb(8, 13, [6, s])
 
-    def edge_type(self):
-        # Categorize according to distance from last edge (short/long).
-        distance = self.samplenum - self.edges[-1]
-        s, l, margin = self.halfbit, self.halfbit * 2, int(self.halfbit / 2)
-        if distance in range(l - margin, l + margin + 1):
-            return 'l'
-        elif distance in range(s - margin, s + margin + 1):
-            return 's'
-        else:
-            return 'e' # Error, invalid edge distance.
-
     def reset_decoder_state(self):
         self.edges, self.bits, self.ss_es_bits = [], [], []
         self.state = 'IDLE'
@@ -138,24 +133,18 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
-        for (self.samplenum, pins) in data:
-
-            self.ir = pins[0]
-
-            # Wait for any edge (rising or falling).
-            if self.old_ir == self.ir:
-                continue
+        for (self.samplenum, ir) in self.pulses.edges(data):
 
             # State machine.
+            if self.state != 'IDLE':
+                edge = self.timing.classify(self.samplenum - self.edges[-1])
+                if edge is None:
+                    # Invalid edge distance, restart at this edge.
+                    self.reset_decoder_state()
             if self.state == 'IDLE':
                 self.edges.append(self.samplenum)
                 self.bits.append([self.samplenum, 1])
                 self.state = 'MID1'
-                self.old_ir = self.ir
-                continue
-            edge = self.edge_type()
-            if edge == 'e':
-                self.reset_decoder_state() # Reset state machine upon errors.
                 continue
             if self.state == 'MID1':
                 self.state = 'START1' if edge == 's' else 'MID0'
@@ -179,5 +168,3 @@ class Decoder(srd.Decoder):
             if len(self.bits) == 14:
                 self.handle_bits()
                 self.reset_decoder_state()
-
-            self.old_ir = self.ir
@@ -24,6 +24,18 @@ This protocol decoder retrieves the timing jitter between two digital signals.
 It allows to define a clock source channel and a resulting signal channel.
 Each time a significant edge is detected in the clock source, we calculate the
 elapsed time before the resulting signal answers and report the timing jitter.
+
+In 'histogram' mode, there are no per-edge jitter annotations. Instead, the
+jitter values go into a histogram, and every 'interval' values the 50th,
+99th and 99.9th percentile and the maximum (of all values so far) are
+reported as annotation and via the meta outputs. Values up to 255 samples
+are counted exactly, larger ones with 8 significant bits (i.e. within 1%),
+the maximum is always exact.
+
+The binary output has the jitter values either as newline-separated ASCII
+floats, or as packed 32-bit little endian floats (in seconds), see the
+'binary' option. In 'histogram' mode, only the float32 binary output is
+available, there's no ASCII binary output.
 '''
 
 from .pd import Decoder
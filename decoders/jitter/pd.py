@@ -19,6 +19,11 @@
 ##
 
 import sigrokdecode as srd
+import sys
+from array import array
+
+# Values sent per binary output chunk, in float32 format.
+FLOAT32_CHUNK = 4096
 
 # Helper dictionary for edge detection.
 edge_detector = {
@@ -30,6 +35,30 @@ edge_detector = {
 class SamplerateError(Exception):
     pass
 
+# Format a jitter value (in seconds) with a suitable unit.
+def format_delta(delta):
+    # Adjust granularity.
+    if delta == 0 or delta >= 1:
+        return u"%us" % (delta)
+    elif delta <= 1e-12:
+        return u"%.1ffs" % (delta * 1e15)
+    elif delta <= 1e-9:
+        return u"%.1fps" % (delta * 1e12)
+    elif delta <= 1e-6:
+        return u"%.1fns" % (delta * 1e9)
+    elif delta <= 1e-3:
+        return u"%.1fμs" % (delta * 1e6)
+    else:
+        return u"%.1fms" % (delta * 1e3)
+
+# Histogram bucket of a jitter value (in samples): exact up to 255, the top
+# 8 significant bits above.
+def bucket(samples):
+    shift = samples.bit_length() - 8
+    if shift <= 0:
+        return samples
+    return (samples >> shift) << shift
+
 class Decoder(srd.Decoder):
     api_version = 2
     id = 'jitter'
@@ -48,19 +77,28 @@ class Decoder(srd.Decoder):
             'default': 'rising', 'values': ('rising', 'falling', 'both')},
         {'id': 'sig_polarity', 'desc': 'Resulting signal edge polarity',
             'default': 'rising', 'values': ('rising', 'falling', 'both')},
+        {'id': 'mode', 'desc': 'Output mode', 'default': 'values',
+            'values': ('values', 'histogram')},
+        {'id': 'interval', 'desc': 'Values per histogram report',
+            'default': 10000},
+        {'id': 'binary', 'desc': 'Binary output format', 'default': 'ascii',
+            'values': ('ascii', 'float32')},
     )
     annotations = (
         ('jitter', 'Jitter value'),
         ('clk_missed', 'Clock missed'),
         ('sig_missed', 'Signal missed'),
+        ('statistics', 'Jitter statistics'),
     )
     annotation_rows = (
         ('jitter', 'Jitter values', (0,)),
         ('clk_missed', 'Clock missed', (1,)),
         ('sig_missed', 'Signal missed', (2,)),
+        ('statistics', 'Jitter statistics', (3,)),
     )
     binary = (
         ('ascii-float', 'Jitter values as newline-separated ASCII floats'),
+        ('float32', 'Jitter values as 32-bit little endian floats'),
     )
 
     def __init__(self, **kwargs):
@@ -72,6 +110,17 @@ class Decoder(srd.Decoder):
         self.sig_start = None
         self.clk_missed = 0
         self.sig_missed = 0
+        # Histogram mode: count per bucket, and the values since the last
+        # report.
+        self.histogram = {}
+        self.max_samples = 0
+        self.num_values = 0
+        self.ss_report = None
+        self.interval_values = 0
+        # Pending float32 binary output.
+        self.floats = array('f')
+        self.ss_floats = None
+        self.latency = 0 # Max. samples to hold values back (0: no limit)
 
     def start(self):
         self.clk_edge = edge_detector[self.options['clk_polarity']]
@@ -82,28 +131,27 @@ class Decoder(srd.Decoder):
             meta=(int, 'Clock missed', 'Clock transition missed'))
         self.out_sig_missed = self.register(srd.OUTPUT_META,
             meta=(int, 'Signal missed', 'Resulting signal transition missed'))
+        self.histogram_mode = self.options['mode'] == 'histogram'
+        self.interval = max(1, self.options['interval'])
+        self.float32 = self.options['binary'] == 'float32'
+        if self.histogram_mode:
+            self.out_percentiles = [self.register(srd.OUTPUT_META,
+                meta=(float, name, desc)) for (name, desc) in (
+                ('p50', 'Jitter 50th percentile (median)'),
+                ('p99', 'Jitter 99th percentile'),
+                ('p99.9', 'Jitter 99.9th percentile'),
+                ('Max', 'Maximum jitter'))]
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
+        elif key == srd.SRD_CONF_LATENCY:
+            self.latency = value
 
     # Helper function for jitter time annotations.
     def putx(self, delta):
-        # Adjust granularity.
-        if delta == 0 or delta >= 1:
-            delta_s = u"%us" % (delta)
-        elif delta <= 1e-12:
-            delta_s = u"%.1ffs" % (delta * 1e15)
-        elif delta <= 1e-9:
-            delta_s = u"%.1fps" % (delta * 1e12)
-        elif delta <= 1e-6:
-            delta_s = u"%.1fns" % (delta * 1e9)
-        elif delta <= 1e-3:
-            delta_s = u"%.1fμs" % (delta * 1e6)
-        else:
-            delta_s = u"%.1fms" % (delta * 1e3)
-
-        self.put(self.clk_start, self.sig_start, self.out_ann, [0, [delta_s]])
+        self.put(self.clk_start, self.sig_start, self.out_ann,
+                 [0, [format_delta(delta)]])
 
     # Helper function for ASCII float jitter values (one value per line).
     def putb(self, delta):
@@ -114,6 +162,62 @@ class Decoder(srd.Decoder):
         self.put(self.clk_start, self.sig_start, self.out_bin,
                  (0, x.encode('UTF-8')))
 
+    # Collect jitter values for the float32 binary output.
+    def putf(self, delta):
+        if not self.floats:
+            self.ss_floats = self.clk_start
+        self.floats.append(delta)
+        # Don't hold values back for longer than the configured latency.
+        if len(self.floats) >= FLOAT32_CHUNK or (self.latency and
+                self.sig_start - self.ss_floats >= self.latency):
+            self.flush_floats(self.sig_start)
+
+    def flush_floats(self, es):
+        if not self.floats:
+            return
+        if sys.byteorder == 'big':
+            self.floats.byteswap()
+        self.put(self.ss_floats, es, self.out_bin, (1, self.floats.tobytes()))
+        self.floats = array('f')
+
+    # Count a jitter value (in samples) in the histogram.
+    def count(self, samples):
+        b = bucket(samples)
+        self.histogram[b] = self.histogram.get(b, 0) + 1
+        if samples > self.max_samples:
+            self.max_samples = samples
+        if self.ss_report is None:
+            self.ss_report = self.clk_start
+        self.interval_values += 1
+        if self.interval_values >= self.interval:
+            self.report(self.sig_start)
+
+    # Report percentiles of all jitter values so far.
+    def report(self, es):
+        self.num_values += self.interval_values
+        self.interval_values = 0
+        n = self.num_values
+        # Number of values at or below each percentile.
+        ranks = [(n * p + 999) // 1000 for p in (500, 990, 999)]
+        values, total = [], 0
+        for b in sorted(self.histogram):
+            total += self.histogram[b]
+            while ranks and total >= ranks[0]:
+                values.append(b)
+                ranks.pop(0)
+        values.append(self.max_samples)
+        values = [v / self.samplerate for v in values]
+
+        ss = self.ss_report
+        for (out, value) in zip(self.out_percentiles, values):
+            self.put(ss, es, out, value)
+        p50, p99, p999, vmax = [format_delta(v) for v in values]
+        self.put(ss, es, self.out_ann, [3, [
+            'Jitter: p50 %s, p99 %s, p99.9 %s, max %s (%d values)' %
+            (p50, p99, p999, vmax, n),
+            'p50 %s, p99 %s, max %s' % (p50, p99, vmax), p50]])
+        self.ss_report = None
+
     # Helper function for missed clock and signal annotations.
     def putm(self, data):
         self.put(self.samplenum, self.samplenum, self.out_ann, data)
@@ -158,8 +262,16 @@ class Decoder(srd.Decoder):
             self.state = 'CLK'
             # Calculate and report the timing jitter.
             delta = (self.sig_start - self.clk_start) / self.samplerate
-            self.putx(delta)
-            self.putb(delta)
+            if self.histogram_mode:
+                self.count(self.sig_start - self.clk_start)
+            else:
+                self.putx(delta)
+            # Histogram mode is meant for long captures, so it only
+            # produces the (cheap) float32 binary output, if selected.
+            if self.float32:
+                self.putf(delta)
+            elif not self.histogram_mode:
+                self.putb(delta)
             return False
         else:
             if self.clk_start != self.samplenum \
@@ -181,6 +293,7 @@ class Decoder(srd.Decoder):
         for (self.samplenum, pins) in data:
             # We are only interested in transitions.
             if self.oldpin == pins:
+                data.skip()
                 continue
 
             self.oldpin, (clk, sig) = pins, pins
@@ -201,3 +314,9 @@ class Decoder(srd.Decoder):
 
             # Save current CLK/SIG values for the next round.
             self.oldclk, self.oldsig = clk, sig
+            data.skip()
+
+    def end(self):
+        if self.interval_values:
+            self.report(self.sig_start)
+        self.flush_floats(self.sig_start)
@@ -169,6 +169,12 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         ptype, rxtx, pdata = data
 
+        # Burst mode: handle each byte as if it was a separate DATA packet.
+        if ptype == 'BYTES':
+            for b, (ss, es) in zip(*pdata):
+                self.decode(ss, es, ['DATA', rxtx, (b, [])])
+            return
+
         # For now, ignore all UART packets except the actual data packets.
         if ptype != 'DATA':
             return
@@ -179,15 +179,10 @@ class Modbus_ADU:
             # have to calculate a CRC on something shorter
             raise Exception("Could not calculate CRC: message too short")
 
-        result = 0xFFFF
-        magic_number = 0xA001  # as defined in the modbus specification
-        for byte in self.data[:last_byte-1]:
-            result = result ^ byte.data
-            for i in range(8):
-                LSB = result & 1
-                result = result >> 1
-                if (LSB):  # if the LSB is true
-                    result = result ^ magic_number
+        # CRC-16/MODBUS, as defined in the modbus specification.
+        crc = srd.crc(16, 0x8005, init=0xFFFF, refin=True, refout=True)
+        crc.update([byte.data for byte in self.data[:last_byte-1]])
+        result = crc.value
         byte1 = result & 0xFF
         byte2 = (result & 0xFF00) >> 8
         return (byte1, byte2)
@@ -954,6 +949,18 @@ class Decoder(srd.Decoder):
         #        ptype= 'DATA'
         ptype, rxtx, pdata = data
 
+        # In burst mode the uart decoder sends a whole run of bytes at once.
+        # Handle them as individual DATA packets. Without start bits to go
+        # by, the bit length is estimated from the (8 data bits of the)
+        # first byte.
+        if ptype == 'BYTES':
+            if self.bitlength is None:
+                first_ss, first_es = pdata[1][0]
+                self.bitlength = (first_es - first_ss) / 8
+            for byte, (byte_ss, byte_es) in zip(*pdata):
+                self.decode(byte_ss, byte_es, ['DATA', rxtx, (byte, [])])
+            return
+
         # Decide what ADU(s) we need this packet to go to
         # Note that it's possible to go to both ADUs
         if rxtx == TX:
@@ -98,6 +98,8 @@ class Decoder(srd.Decoder):
         self.next()
         self.requirements_met = True
         self.cs_was_released = False
+        self.got_data = False
+        self.ranges = []
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -304,7 +306,22 @@ class Decoder(srd.Decoder):
 
                 self.next()
                 self.cs_was_released = True
+        elif ptype == 'TRANSFER-RANGES':
+            # The word ranges of the following TRANSFER packet.
+            self.ranges = data1
+        elif ptype == 'TRANSFER' and self.cs_was_released:
+            # Whole transfers, only used if the spi PD doesn't send DATA
+            # packets (i.e. in fast mode).
+            if self.got_data:
+                return
+            mosi, miso = data1, data2
+            if miso is None or mosi is None:
+                self.requirements_met = False
+                raise ChannelError('Both MISO and MOSI pins required.')
+            for i, pos in enumerate(self.ranges):
+                self.handle_byte(pos, mosi[i], miso[i])
         elif ptype == 'DATA' and self.cs_was_released:
+            self.got_data = True
             mosi, miso = data1, data2
             pos = (ss, es)
 
@@ -312,18 +329,22 @@ class Decoder(srd.Decoder):
                 self.requirements_met = False
                 raise ChannelError('Both MISO and MOSI pins required.')
 
-            if self.first:
-                self.first = False
-                # First MOSI byte is always the command.
-                self.decode_command(pos, mosi)
-                # First MISO byte is always the status register.
-                self.decode_register(pos, self.ann_reg, 'STATUS', [miso])
+            self.handle_byte(pos, mosi, miso)
+
+    def handle_byte(self, pos, mosi, miso):
+        '''Handles one MOSI/MISO byte pair at position 'pos'.'''
+        if self.first:
+            self.first = False
+            # First MOSI byte is always the command.
+            self.decode_command(pos, mosi)
+            # First MISO byte is always the status register.
+            self.decode_register(pos, self.ann_reg, 'STATUS', [miso])
+        else:
+            if not self.cmd or len(self.mb) >= self.max:
+                self.warn(pos, 'excess byte')
             else:
-                if not self.cmd or len(self.mb) >= self.max:
-                    self.warn(pos, 'excess byte')
-                else:
-                    # Collect the bytes after the command byte.
-                    if self.mb_s == -1:
-                        self.mb_s = ss
-                    self.mb_e = es
-                    self.mb.append((mosi, miso))
+                # Collect the bytes after the command byte.
+                if self.mb_s == -1:
+                    self.mb_s = pos[0]
+                self.mb_e = pos[1]
+                self.mb.append((mosi, miso))
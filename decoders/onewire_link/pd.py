@@ -20,6 +20,22 @@
 
 import sigrokdecode as srd
 
+'''
+OUTPUT_PYTHON format:
+
+Packet:
+[<ptype>, <pdata>]
+
+<ptype>:
+ - 'RESET/PRESENCE' (<pdata>: True if a device signalled its presence)
+ - 'BIT' (<pdata>: the bit value, 0 or 1)
+ - 'BYTE' (<pdata>: the byte value, 0-255)
+
+A 'BYTE' packet is sent after every 8th 'BIT' packet since the last
+'RESET/PRESENCE' packet. It holds those 8 bits (LSB-first, as on the bus)
+and spans all of them.
+'''
+
 class SamplerateError(Exception):
     pass
 
@@ -87,6 +103,10 @@ class Decoder(srd.Decoder):
     def putfr(self, data):
         self.put(self.fall, self.rise, self.out_ann, data)
 
+    def putbyte(self):
+        self.put(self.ss_byte, self.samplenum, self.out_python,
+                 ['BYTE', self.byte])
+
     def putprs(self, data):
         self.put(self.rise, self.samplenum, self.out_python, data)
 
@@ -104,6 +124,10 @@ class Decoder(srd.Decoder):
         self.overdrive = 0
         self.fall = 0
         self.rise = 0
+        # The bits since the last reset, in bytes.
+        self.byte = 0
+        self.byte_bits = 0
+        self.ss_byte = 0
 
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
@@ -187,97 +211,132 @@ class Decoder(srd.Decoder):
                  '(%2.1fus-%2.1fus) should be inside (7.3us, 10.0us).'
                  % (time_min * 1000000, time_max * 1000000)]])
 
+    # Sample number the state machine needs to see next (unless the
+    # signal changes before), or None if it only waits for a change.
+    def next_sample(self):
+        if self.state == 'WAIT FOR DATA SAMPLE':
+            return self.fall + self.cnt_bit[self.overdrive]
+        elif self.state == 'WAIT FOR DATA SLOT END':
+            return self.fall + self.cnt_slot[self.overdrive]
+        elif self.state == 'WAIT FOR PRESENCE DETECT':
+            return self.rise + self.cnt_presence[self.overdrive]
+        elif self.state == 'WAIT FOR RESET SLOT END':
+            return self.rise + self.cnt_reset[self.overdrive]
+        return None
+
+    def handle_sample(self, owr):
+        # State machine.
+        if self.state == 'WAIT FOR FALLING EDGE':
+            # The start of a cycle is a falling edge.
+            if owr != 0:
+                return
+            # Save the sample number for the falling edge.
+            self.fall = self.samplenum
+            # Go to waiting for sample time.
+            self.state = 'WAIT FOR DATA SAMPLE'
+        elif self.state == 'WAIT FOR DATA SAMPLE':
+            # Sample data bit.
+            t = self.samplenum - self.fall
+            if t == self.cnt_bit[self.overdrive]:
+                self.bit = owr
+                self.state = 'WAIT FOR DATA SLOT END'
+        elif self.state == 'WAIT FOR DATA SLOT END':
+            # A data slot ends in a recovery period, otherwise, this is
+            # probably a reset.
+            t = self.samplenum - self.fall
+            if t != self.cnt_slot[self.overdrive]:
+                return
+
+            if owr == 0:
+                # This seems to be a reset slot, wait for its end.
+                self.state = 'WAIT FOR RISING EDGE'
+                return
+
+            self.putb([0, ['Bit: %d' % self.bit, '%d' % self.bit]])
+            self.putpb(['BIT', self.bit])
+
+            # Collect the bits into bytes.
+            if self.byte_bits == 0:
+                self.ss_byte = self.fall
+                self.byte = 0
+            self.byte |= self.bit << self.byte_bits
+            self.byte_bits += 1
+            if self.byte_bits == 8:
+                self.putbyte()
+                self.byte_bits = 0
+
+            # Checking the first command to see if overdrive mode
+            # should be entered.
+            if self.bit_cnt <= 8:
+                self.command |= (self.bit << self.bit_cnt)
+            elif self.bit_cnt == 8 and self.command in [0x3c, 0x69]:
+                self.putx([4, ['Entering overdrive mode', 'Overdrive on']])
+            # Increment the bit counter.
+            self.bit_cnt += 1
+            # Wait for next slot.
+            self.state = 'WAIT FOR FALLING EDGE'
+        elif self.state == 'WAIT FOR RISING EDGE':
+            # The end of a cycle is a rising edge.
+            if owr != 1:
+                return
+
+            # Check if this was a reset cycle.
+            t = self.samplenum - self.fall
+            if t > self.cnt_normal_reset:
+                # Save the sample number for the rising edge.
+                self.rise = self.samplenum
+                self.putfr([2, ['Reset', 'Rst', 'R']])
+                self.state = 'WAIT FOR PRESENCE DETECT'
+                # Exit overdrive mode.
+                if self.overdrive:
+                    self.putx([4, ['Exiting overdrive mode', 'Overdrive off']])
+                    self.overdrive = 0
+                # Clear command bit counter and data register.
+                self.bit_cnt = 0
+                self.command = 0
+            elif (t > self.cnt_overdrive_reset) and self.overdrive:
+                # Save the sample number for the rising edge.
+                self.rise = self.samplenum
+                self.putfr([2, ['Reset', 'Rst', 'R']])
+                self.state = 'WAIT FOR PRESENCE DETECT'
+            # Otherwise this is assumed to be a data bit.
+            else:
+                self.state = 'WAIT FOR FALLING EDGE'
+        elif self.state == 'WAIT FOR PRESENCE DETECT':
+            # Sample presence status.
+            t = self.samplenum - self.rise
+            if t == self.cnt_presence[self.overdrive]:
+                self.present = owr
+                self.state = 'WAIT FOR RESET SLOT END'
+        elif self.state == 'WAIT FOR RESET SLOT END':
+            # A reset slot ends in a long recovery period.
+            t = self.samplenum - self.rise
+            if t != self.cnt_reset[self.overdrive]:
+                return
+
+            if owr == 0:
+                # This seems to be a reset slot, wait for its end.
+                self.state = 'WAIT FOR RISING EDGE'
+                return
+
+            p = 'false' if self.present else 'true'
+            self.putrs([3, ['Presence: %s' % p, 'Presence', 'Pres', 'P']])
+            self.putprs(['RESET/PRESENCE', not self.present])
+            self.byte_bits = 0
+
+            # Wait for next slot.
+            self.state = 'WAIT FOR FALLING EDGE'
+
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
         for (self.samplenum, (owr, pwr)) in data:
-            # State machine.
-            if self.state == 'WAIT FOR FALLING EDGE':
-                # The start of a cycle is a falling edge.
-                if owr != 0:
-                    continue
-                # Save the sample number for the falling edge.
-                self.fall = self.samplenum
-                # Go to waiting for sample time.
-                self.state = 'WAIT FOR DATA SAMPLE'
-            elif self.state == 'WAIT FOR DATA SAMPLE':
-                # Sample data bit.
-                t = self.samplenum - self.fall
-                if t == self.cnt_bit[self.overdrive]:
-                    self.bit = owr
-                    self.state = 'WAIT FOR DATA SLOT END'
-            elif self.state == 'WAIT FOR DATA SLOT END':
-                # A data slot ends in a recovery period, otherwise, this is
-                # probably a reset.
-                t = self.samplenum - self.fall
-                if t != self.cnt_slot[self.overdrive]:
-                    continue
-
-                if owr == 0:
-                    # This seems to be a reset slot, wait for its end.
-                    self.state = 'WAIT FOR RISING EDGE'
-                    continue
-
-                self.putb([0, ['Bit: %d' % self.bit, '%d' % self.bit]])
-                self.putpb(['BIT', self.bit])
-
-                # Checking the first command to see if overdrive mode
-                # should be entered.
-                if self.bit_cnt <= 8:
-                    self.command |= (self.bit << self.bit_cnt)
-                elif self.bit_cnt == 8 and self.command in [0x3c, 0x69]:
-                    self.putx([4, ['Entering overdrive mode', 'Overdrive on']])
-                # Increment the bit counter.
-                self.bit_cnt += 1
-                # Wait for next slot.
-                self.state = 'WAIT FOR FALLING EDGE'
-            elif self.state == 'WAIT FOR RISING EDGE':
-                # The end of a cycle is a rising edge.
-                if owr != 1:
-                    continue
-
-                # Check if this was a reset cycle.
-                t = self.samplenum - self.fall
-                if t > self.cnt_normal_reset:
-                    # Save the sample number for the rising edge.
-                    self.rise = self.samplenum
-                    self.putfr([2, ['Reset', 'Rst', 'R']])
-                    self.state = 'WAIT FOR PRESENCE DETECT'
-                    # Exit overdrive mode.
-                    if self.overdrive:
-                        self.putx([4, ['Exiting overdrive mode', 'Overdrive off']])
-                        self.overdrive = 0
-                    # Clear command bit counter and data register.
-                    self.bit_cnt = 0
-                    self.command = 0
-                elif (t > self.cnt_overdrive_reset) and self.overdrive:
-                    # Save the sample number for the rising edge.
-                    self.rise = self.samplenum
-                    self.putfr([2, ['Reset', 'Rst', 'R']])
-                    self.state = 'WAIT FOR PRESENCE DETECT'
-                # Otherwise this is assumed to be a data bit.
-                else:
-                    self.state = 'WAIT FOR FALLING EDGE'
-            elif self.state == 'WAIT FOR PRESENCE DETECT':
-                # Sample presence status.
-                t = self.samplenum - self.rise
-                if t == self.cnt_presence[self.overdrive]:
-                    self.present = owr
-                    self.state = 'WAIT FOR RESET SLOT END'
-            elif self.state == 'WAIT FOR RESET SLOT END':
-                # A reset slot ends in a long recovery period.
-                t = self.samplenum - self.rise
-                if t != self.cnt_reset[self.overdrive]:
-                    continue
-
-                if owr == 0:
-                    # This seems to be a reset slot, wait for its end.
-                    self.state = 'WAIT FOR RISING EDGE'
-                    continue
-
-                p = 'false' if self.present else 'true'
-                self.putrs([3, ['Presence: %s' % p, 'Presence', 'Pres', 'P']])
-                self.putprs(['RESET/PRESENCE', not self.present])
-
-                # Wait for next slot.
-                self.state = 'WAIT FOR FALLING EDGE'
+            self.handle_sample(owr)
+
+            # Skip to the next edge, or the next sample with a meaning
+            # (data bit, presence, slot end), whichever comes first.
+            until = self.next_sample()
+            if until is None:
+                data.skip()
+            else:
+                data.skip(until)
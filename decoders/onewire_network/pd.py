@@ -49,8 +49,7 @@ class Decoder(srd.Decoder):
         self.ss_block = 0
         self.es_block = 0
         self.state = 'COMMAND'
-        self.bit_cnt = 0
-        self.search = 'P'
+        self.bytes = []
         self.data_p = 0x0
         self.data_n = 0x0
         self.data = 0x0
@@ -73,21 +72,21 @@ class Decoder(srd.Decoder):
 
         # State machine.
         if code == 'RESET/PRESENCE':
-            self.search = 'P'
-            self.bit_cnt = 0
+            self.bytes = []
             self.put(ss, es, self.out_ann,
                      [0, ['Reset/presence: %s' % ('true' if val else 'false')]])
             self.put(ss, es, self.out_python, ['RESET/PRESENCE', val])
             self.state = 'COMMAND'
             return
 
-        # For now we're only interested in 'RESET/PRESENCE' and 'BIT' packets.
-        if code != 'BIT':
+        # For now we're only interested in 'RESET/PRESENCE' and 'BYTE'
+        # packets. All fields (even search triplets) add up to whole bytes.
+        if code != 'BYTE':
             return
 
         if self.state == 'COMMAND':
             # Receiving and decoding a ROM command.
-            if self.onewire_collect(8, val, ss, es) == 0:
+            if not self.onewire_collect(1, val, ss, es):
                 return
             if self.data in command:
                 self.putx([0, ['ROM command: 0x%02x \'%s\''
@@ -100,81 +99,59 @@ class Decoder(srd.Decoder):
         elif self.state == 'GET ROM':
             # A 64 bit device address is selected.
             # Family code (1 byte) + serial number (6 bytes) + CRC (1 byte)
-            if self.onewire_collect(64, val, ss, es) == 0:
+            if not self.onewire_collect(8, val, ss, es):
                 return
-            self.rom = self.data & 0xffffffffffffffff
+            self.rom = self.data
             self.putx([0, ['ROM: 0x%016x' % self.rom]])
             self.puty(['ROM', self.rom])
             self.state = 'TRANSPORT'
         elif self.state == 'SEARCH ROM':
             # A 64 bit device address is searched for.
             # Family code (1 byte) + serial number (6 bytes) + CRC (1 byte)
-            if self.onewire_search(64, val, ss, es) == 0:
+            if not self.onewire_search(64, val, ss, es):
                 return
-            self.rom = self.data & 0xffffffffffffffff
+            self.rom = self.data
             self.putx([0, ['ROM: 0x%016x' % self.rom]])
             self.puty(['ROM', self.rom])
             self.state = 'TRANSPORT'
         elif self.state == 'TRANSPORT':
             # The transport layer is handled in byte sized units.
-            if self.onewire_collect(8, val, ss, es) == 0:
+            if not self.onewire_collect(1, val, ss, es):
                 return
             self.putx([0, ['Data: 0x%02x' % self.data]])
             self.puty(['DATA', self.data])
         elif self.state == 'COMMAND ERROR':
             # Since the command is not recognized, print raw data.
-            if self.onewire_collect(8, val, ss, es) == 0:
+            if not self.onewire_collect(1, val, ss, es):
                 return
             self.putx([0, ['ROM error data: 0x%02x' % self.data]])
 
-    # Data collector.
+    # Data collector, for the given number of bytes (LSB-first).
     def onewire_collect(self, length, val, ss, es):
         # Storing the sample this sequence begins with.
-        if self.bit_cnt == 1:
+        if not self.bytes:
             self.ss_block = ss
-        self.data = self.data & ~(1 << self.bit_cnt) | (val << self.bit_cnt)
-        self.bit_cnt += 1
+        self.bytes.append(val)
         # Storing the sample this sequence ends with.
-        # In case the full length of the sequence is received, return 1.
-        if self.bit_cnt == length:
-            self.es_block = es
-            self.data = self.data & ((1 << length) - 1)
-            self.bit_cnt = 0
-            return 1
-        else:
-            return 0
+        # In case the full length of the sequence is received, return True.
+        if len(self.bytes) < length:
+            return False
+        self.es_block = es
+        self.data = int.from_bytes(bytes(self.bytes), 'little')
+        self.bytes = []
+        return True
 
-    # Search collector.
+    # Search collector, for the given number of address bits.
     def onewire_search(self, length, val, ss, es):
-        # Storing the sample this sequence begins with.
-        if (self.bit_cnt == 0) and (self.search == 'P'):
-            self.ss_block = ss
-
-        if self.search == 'P':
-            # Master receives an original address bit.
-            self.data_p = self.data_p & ~(1 << self.bit_cnt) | \
-                          (val << self.bit_cnt)
-            self.search = 'N'
-        elif self.search == 'N':
-            # Master receives a complemented address bit.
-            self.data_n = self.data_n & ~(1 << self.bit_cnt) | \
-                          (val << self.bit_cnt)
-            self.search = 'D'
-        elif self.search == 'D':
-            # Master transmits an address bit.
-            self.data = self.data & ~(1 << self.bit_cnt) | (val << self.bit_cnt)
-            self.search = 'P'
-            self.bit_cnt += 1
-
-        # Storing the sample this sequence ends with.
-        # In case the full length of the sequence is received, return 1.
-        if self.bit_cnt == length:
-            self.es_block = es
-            self.data_p = self.data_p & ((1 << length) - 1)
-            self.data_n = self.data_n & ((1 << length) - 1)
-            self.data = self.data & ((1 << length) - 1)
-            self.search = 'P'
-            self.bit_cnt = 0
-            return 1
-        else:
-            return 0
+        # Each address bit takes three bits: the master receives an original
+        # and a complemented address bit, and transmits an address bit.
+        if not self.onewire_collect(length * 3 // 8, val, ss, es):
+            return False
+        triplets = self.data
+        self.data_p = self.data_n = self.data = 0
+        for i in range(length):
+            self.data_p |= (triplets & 1) << i
+            self.data_n |= ((triplets >> 1) & 1) << i
+            self.data |= ((triplets >> 2) & 1) << i
+            triplets >>= 3
+        return True
@@ -19,7 +19,21 @@
 ## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 ##
 
+import math
 import sigrokdecode as srd
+import sys
+from array import array
+
+'''
+In 'statistics' mode, no annotation and no output is generated per cycle.
+Instead, the cycles are collected into windows of 'window' cycles each, and
+for every window there's one annotation with the min/max/mean/standard
+deviation of the duty cycle and the period.
+
+The 'period-duty' binary output (statistics mode only) contains the period
+and the duty (active time) of every cycle in samples, as pairs of unsigned
+32-bit little endian integers.
+'''
 
 class Decoder(srd.Decoder):
     api_version = 2
@@ -36,12 +50,22 @@ class Decoder(srd.Decoder):
     options = (
         {'id': 'polarity', 'desc': 'Polarity', 'default': 'active-high',
             'values': ('active-low', 'active-high')},
+        {'id': 'mode', 'desc': 'Output mode', 'default': 'cycles',
+            'values': ('cycles', 'statistics')},
+        {'id': 'window', 'desc': 'Cycles per statistics window',
+            'default': 1000},
     )
     annotations = (
         ('duty-cycle', 'Duty cycle'),
+        ('statistics', 'Statistics'),
+    )
+    annotation_rows = (
+        ('duty-cycle', 'Duty cycle', (0,)),
+        ('statistics', 'Statistics', (1,)),
     )
     binary = (
         ('raw', 'RAW file'),
+        ('period-duty', 'Period/duty pairs'),
     )
 
     def __init__(self, **kwargs):
@@ -53,34 +77,112 @@ class Decoder(srd.Decoder):
         self.oldpin = None
         self.num_cycles = 0
         self.average = 0
+        self.samplerate = None
+        # Statistics mode: edge positions of the current window, starting
+        # with a start edge.
+        self.edges = []
 
     def start(self):
         self.startedge = 0 if self.options['polarity'] == 'active-low' else 1
+        self.statistics = self.options['mode'] == 'statistics'
+        self.window = max(1, self.options['window'])
         self.out_ann = self.register(srd.OUTPUT_ANN)
         self.out_bin = self.register(srd.OUTPUT_BINARY)
         self.out_average = \
             self.register(srd.OUTPUT_META,
                           meta=(float, 'Average', 'PWM base (cycle) frequency'))
 
+    def metadata(self, key, value):
+        if key == srd.SRD_CONF_SAMPLERATE:
+            self.samplerate = value
+
     def putx(self, data):
         self.put(self.ss, self.es, self.out_ann, data)
 
     def putb(self, data):
         self.put(self.num_cycles, self.num_cycles, self.out_bin, data)
 
+    def put_statistics(self, edges):
+        # All cycles of the window at once: start edges are at even,
+        # end edges at odd indices.
+        starts, ends = edges[0::2], edges[1::2]
+        periods = [b - a for (a, b) in zip(starts, starts[1:])]
+        duties = [b - a for (a, b) in zip(starts, ends)]
+        ratios = [d / p for (d, p) in zip(duties, periods)]
+        n = len(periods)
+        ss, es = edges[0], edges[2 * n]
+
+        mean = sum(ratios) / n
+        stddev = math.sqrt(max(0, sum(r * r for r in ratios) / n - mean ** 2))
+        mean_period = (es - ss) / n
+        stddev_period = math.sqrt(max(0,
+                sum(p * p for p in periods) / n - mean_period ** 2))
+        if self.samplerate:
+            period = 'mean %f us (%f Hz), min %f us, max %f us, ' \
+                     'stddev %f us' % (mean_period / self.samplerate * 1e6,
+                     self.samplerate / mean_period,
+                     min(periods) / self.samplerate * 1e6,
+                     max(periods) / self.samplerate * 1e6,
+                     stddev_period / self.samplerate * 1e6)
+        else:
+            period = 'mean %f, min %d, max %d, stddev %f samples' % \
+                     (mean_period, min(periods), max(periods), stddev_period)
+        self.put(ss, es, self.out_ann, [1, [
+            'Duty cycle: mean %f%%, min %f%%, max %f%%, stddev %f%%, '
+            'period: %s, %d cycles' % (mean * 100, min(ratios) * 100,
+            max(ratios) * 100, stddev * 100, period, n),
+            'Duty: %.2f%% (%.2f-%.2f%%)' % (mean * 100, min(ratios) * 100,
+            max(ratios) * 100),
+            '%.2f%%' % (mean * 100)]])
+
+        # Period/duty pairs, interleaved. Longer times don't fit, clamp
+        # them (a duty is never longer than its period).
+        if max(periods) > 0xffffffff:
+            periods = [min(p, 0xffffffff) for p in periods]
+            duties = [min(d, 0xffffffff) for d in duties]
+        pairs = array('I', [0]) * (2 * n)
+        pairs[0::2] = array('I', periods)
+        pairs[1::2] = array('I', duties)
+        if sys.byteorder == 'big':
+            pairs.byteswap()
+        self.put(ss, es, self.out_bin, (1, pairs.tobytes()))
+
+        # Update and report the new duty cycle average.
+        self.num_cycles += n
+        self.average += mean * n * 100
+        self.put(self.first_samplenum, es, self.out_average,
+                 float(self.average / self.num_cycles))
+
+    def handle_edge_statistics(self, pin):
+        if not self.edges:
+            # Windows start with a start edge.
+            if pin != self.startedge:
+                return
+            if self.first_samplenum is None:
+                self.first_samplenum = self.samplenum
+        self.edges.append(self.samplenum)
+        if len(self.edges) > 2 * self.window:
+            self.put_statistics(self.edges)
+            # The last start edge begins the next window.
+            self.edges = self.edges[-1:]
+
     def decode(self, ss, es, data):
 
         for (self.samplenum, pins) in data:
             # Ignore identical samples early on (for performance reasons).
             if self.oldpin == pins[0]:
+                data.skip()
                 continue
 
             # Initialize self.oldpins with the first sample value.
             if self.oldpin is None:
                 self.oldpin = pins[0]
+                data.skip()
                 continue
 
-            if self.first_transition:
+            if self.statistics:
+                self.handle_edge_statistics(pins[0])
+            elif self.first_transition:
                 # First rising edge
                 if self.oldpin != self.startedge:
                     self.first_samplenum = self.samplenum
@@ -118,3 +220,11 @@ class Decoder(srd.Decoder):
                     self.end_samplenum = self.ss = self.samplenum
 
             self.oldpin = pins[0]
+            data.skip()
+
+    def end(self):
+        # A partial statistics window (with at least one whole cycle).
+        if self.statistics and len(self.edges) > 2:
+            edges = self.edges[:len(self.edges) - 1 + len(self.edges) % 2]
+            self.put_statistics(edges)
+            self.edges = []
@@ -47,8 +47,14 @@ class Decoder(srd.Decoder):
         self.mosi_bytes, self.miso_bytes = [], []
         self.mosi_bits, self.miso_bits = [], []
         self.row_pos = [0, 0, 0]
+        self.row_texts = [[], [], []]
+        self.ss_cmd = None
+        self.got_data = False
+        self.ranges = []
 
         self.ann_to_row = [0, 0, 0, 1, 1, 2]
+        # Annotation class used per row if there are no bit positions.
+        self.row_to_ann = [0, 3, 5]
 
         # Initialize with Power-On-Reset values.
         self.last_status = [0x00, 0x00]
@@ -70,8 +76,14 @@ class Decoder(srd.Decoder):
             description = [description]
         row = self.ann_to_row[ann]
         bit = self.row_pos[row]
-        self.put(self.mosi_bits[bit][1], self.mosi_bits[bit + length - 1][2],
-                 self.out_ann, [ann, description])
+        if self.mosi_bits:
+            self.put(self.mosi_bits[bit][1],
+                     self.mosi_bits[bit + length - 1][2],
+                     self.out_ann, [ann, description])
+        elif ann not in (2, 4):
+            # No bit positions (spi fast mode): collect what's set, for
+            # one annotation per row over the whole command.
+            self.row_texts[row].append(description)
         bit += length
         self.row_pos[row] = bit
 
@@ -102,6 +114,12 @@ class Decoder(srd.Decoder):
         while i != 0:
             if names[bit] != '' and changes & i:
                 s = ['+', 'Turning on'] if (data & i) else ['-', 'Turning off']
+                if not self.mosi_bits:
+                    # Without bit positions, say which bit it is.
+                    n = names[bit]
+                    if not isinstance(n, list):
+                        n = [n]
+                    s = ['%s %s' % (s[1], n[0]), s[0] + n[-1]]
                 self.putx(5, 1, s)
             else:
                 self.advance_ann(5, 1)
@@ -462,9 +480,33 @@ class Decoder(srd.Decoder):
             r = '%02x %02x' % tuple(ret)
             self.putx(0, 16, ['Uknown command: %s (reply: %s)!' % (c, r)])
 
+    def put_row_texts(self, es):
+        for row, texts in enumerate(self.row_texts):
+            if not texts:
+                continue
+            long, short = [t[0] for t in texts], [t[-1] for t in texts]
+            if row == 0 and len(texts) > 1:
+                # The command, followed by its parameters.
+                long = [long[0] + ': ' + ', '.join(long[1:])]
+                short = [short[0] + ': ' + ', '.join(short[1:])]
+            self.put(self.ss_cmd, es, self.out_ann, [self.row_to_ann[row],
+                     [', '.join(long), ', '.join(short)]])
+
     def decode(self, ss, es, data):
         ptype, mosi, miso = data
 
+        # Whole transfers, only used if the spi PD doesn't send DATA packets
+        # (i.e. in fast mode). The word ranges come in the packet before.
+        if ptype == 'TRANSFER-RANGES':
+            self.ranges = mosi
+            return
+        if ptype == 'TRANSFER':
+            if self.got_data or mosi is None or miso is None:
+                return
+            for i, (ss, es) in enumerate(self.ranges):
+                self.handle_byte(ss, es, mosi[i], miso[i])
+            return
+
         # For now, only use DATA and BITS packets.
         if ptype not in ('DATA', 'BITS'):
             return
@@ -478,6 +520,13 @@ class Decoder(srd.Decoder):
                 self.miso_bits.extend(reversed(miso))
             return
 
+        self.got_data = True
+        self.handle_byte(ss, es, mosi, miso)
+
+    def handle_byte(self, ss, es, mosi, miso):
+        if not self.mosi_bytes:
+            self.ss_cmd = ss
+
         # Append new bytes.
         self.mosi_bytes.append(mosi)
         self.miso_bytes.append(miso)
@@ -487,8 +536,10 @@ class Decoder(srd.Decoder):
             return
 
         self.row_pos = [0, 8, 8]
+        self.row_texts = [[], [], []]
 
         self.handle_cmd(self.mosi_bytes, self.miso_bytes)
+        self.put_row_texts(es)
 
         self.mosi_bytes, self.miso_bytes = [], []
         self.mosi_bits, self.miso_bits = [], []
@@ -36,6 +36,8 @@ class Decoder(srd.Decoder):
     def __init__(self, **kwargs):
         self.ss_cmd, self.es_cmd = 0, 0
         self.mosi_bytes = []
+        self.got_data = False
+        self.ranges = []
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -43,14 +45,7 @@ class Decoder(srd.Decoder):
     def putx(self, data):
         self.put(self.ss_cmd, self.es_cmd, self.out_ann, data)
 
-    def decode(self, ss, es, data):
-        ptype, mosi, miso = data
-
-        # Only care about data packets.
-        if ptype != 'DATA':
-            return
-        self.ss, self.es = ss, es
-
+    def handle_byte(self, ss, es, mosi):
         if len(self.mosi_bytes) == 0:
             self.ss_cmd = ss
         self.mosi_bytes.append(mosi)
@@ -65,3 +60,26 @@ class Decoder(srd.Decoder):
         self.es_cmd = es
         self.putx([0, ['#%.6x' % rgb_value]])
         self.mosi_bytes = []
+
+    def decode(self, ss, es, data):
+        ptype, mosi, miso = data
+
+        # Whole transfers, only used if the spi PD doesn't send DATA packets
+        # (i.e. in fast mode). The word ranges come in the packet before.
+        if ptype == 'TRANSFER-RANGES':
+            self.ranges = mosi
+            return
+        if ptype == 'TRANSFER':
+            if self.got_data or mosi is None:
+                return
+            for b, (ss, es) in zip(mosi, self.ranges):
+                self.handle_byte(ss, es, b)
+            return
+
+        # Only care about data packets.
+        if ptype != 'DATA':
+            return
+        self.got_data = True
+        self.ss, self.es = ss, es
+
+        self.handle_byte(ss, es, mosi)
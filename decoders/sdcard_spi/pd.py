@@ -107,6 +107,10 @@ class Decoder(srd.Decoder):
         self.blocklen = 0
         self.read_buf = []
         self.cmd_str = ''
+        self.mosi_bits, self.miso_bits = None, None
+        self.cmd_token_ranges = []
+        self.got_data = False
+        self.ranges = []
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -140,6 +144,7 @@ class Decoder(srd.Decoder):
 
         self.cmd_token.append(mosi)
         self.cmd_token_bits.append(self.mosi_bits)
+        self.cmd_token_ranges.append((self.ss, self.es))
 
         # All command tokens are 6 bytes long.
         if len(self.cmd_token) < 6:
@@ -152,6 +157,43 @@ class Decoder(srd.Decoder):
         # CMD or ACMD?
         s = 'ACMD' if self.is_acmd else 'CMD'
 
+        cmd = self.cmd_index = t[0] & 0x3f
+        self.arg = (t[1] << 24) | (t[2] << 16) | (t[3] << 8) | t[4]
+        # TODO: Check CRC7.
+        crc = t[5] >> 1
+
+        if None in self.cmd_token_bits:
+            self.handle_command_token_bytes(s, cmd, crc)
+        else:
+            self.handle_command_token_bits(s, cmd, crc)
+
+        # Handle command.
+        if cmd in (0, 1, 9, 16, 17, 41, 49, 55, 59):
+            self.state = 'HANDLE CMD%d' % cmd
+            self.cmd_str = '%s%d (%s)' % (s, cmd, self.cmd_name(cmd))
+        else:
+            self.state = 'HANDLE CMD999'
+            a = '%s%d: %02x %02x %02x %02x %02x %02x' % ((s, cmd) + tuple(t))
+            self.putx([cmd, [a]])
+
+    # Without the bit positions (i.e. in spi fast mode), only the fields
+    # made up of whole bytes get annotated.
+    def handle_command_token_bytes(self, s, cmd, crc):
+        r = self.cmd_token_ranges
+
+        # Bits[45:40]: Command index, in the first byte.
+        self.ss_bit, self.es_bit = r[0]
+        self.putb([134, ['Command: %s%d (%s)' % (s, cmd, self.cmd_name(cmd))]])
+
+        # Bits[39:8]: Argument
+        self.ss_bit, self.es_bit = r[1][0], r[4][1]
+        self.putb([134, ['Argument: 0x%04x' % self.arg]])
+
+        # Bits[7:1]: CRC7, in the last byte.
+        self.ss_bit, self.es_bit = r[5]
+        self.putb([134, ['CRC7: 0x%01x' % crc]])
+
+    def handle_command_token_bits(self, s, cmd, crc):
         def tb(byte, bit):
             return self.cmd_token_bits[5 - byte][bit]
 
@@ -170,18 +212,14 @@ class Decoder(srd.Decoder):
             self.putb([135, ['Transmitter bit: %d (Warning: Must be 1!)' % bit]])
 
         # Bits[45:40]: Command index (BCD; valid: 0-63)
-        cmd = self.cmd_index = t[0] & 0x3f
         self.ss_bit, self.es_bit = tb(5, 5)[1], tb(5, 0)[2]
         self.putb([134, ['Command: %s%d (%s)' % (s, cmd, self.cmd_name(cmd))]])
 
         # Bits[39:8]: Argument
-        self.arg = (t[1] << 24) | (t[2] << 16) | (t[3] << 8) | t[4]
         self.ss_bit, self.es_bit = tb(4, 7)[1], tb(1, 0)[2]
         self.putb([134, ['Argument: 0x%04x' % self.arg]])
 
         # Bits[7:1]: CRC7
-        # TODO: Check CRC7.
-        crc = t[5] >> 1
         self.ss_bit, self.es_bit = tb(0, 7)[1], tb(0, 1)[2]
         self.putb([134, ['CRC7: 0x%01x' % crc]])
 
@@ -193,15 +231,6 @@ class Decoder(srd.Decoder):
         else:
             self.putb([135, ['End bit: %d (Warning: Must be 1!)' % bit]])
 
-        # Handle command.
-        if cmd in (0, 1, 9, 16, 17, 41, 49, 55, 59):
-            self.state = 'HANDLE CMD%d' % cmd
-            self.cmd_str = '%s%d (%s)' % (s, cmd, self.cmd_name(cmd))
-        else:
-            self.state = 'HANDLE CMD999'
-            a = '%s%d: %02x %02x %02x %02x %02x %02x' % ((s, cmd) + tuple(t))
-            self.putx([cmd, [a]])
-
     def handle_cmd0(self):
         # CMD0: GO_IDLE_STATE
         self.putc(0, 'Reset the SD card')
@@ -211,9 +240,10 @@ class Decoder(srd.Decoder):
         # CMD1: SEND_OP_COND
         self.putc(1, 'Send HCS info and activate the card init process')
         hcs = (self.arg & (1 << 30)) >> 30
-        self.ss_bit = self.cmd_token_bits[5 - 4][6][1]
-        self.es_bit = self.cmd_token_bits[5 - 4][6][2]
-        self.putb([134, ['HCS: %d' % hcs]])
+        if self.cmd_token_bits[5 - 4] is not None:
+            self.ss_bit = self.cmd_token_bits[5 - 4][6][1]
+            self.es_bit = self.cmd_token_bits[5 - 4][6][2]
+            self.putb([134, ['HCS: %d' % hcs]])
         self.state = 'GET RESPONSE R1'
 
     def handle_cmd9(self):
@@ -331,6 +361,13 @@ class Decoder(srd.Decoder):
         # The R1 response token format (1 byte).
         # Sent by the card after every command except for SEND_STATUS.
 
+        if self.miso_bits is None:
+            # No bit positions (spi fast mode), only annotate the byte.
+            self.ss_cmd, self.es_cmd = self.ss, self.es
+            self.putx([65, ['R1: 0x%02x' % res]])
+            self.state = 'IDLE'
+            return
+
         self.ss_cmd, self.es_cmd = self.miso_bits[7][1], self.miso_bits[0][2]
         self.putx([65, ['R1: 0x%02x' % res]])
 
@@ -395,6 +432,20 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         ptype, mosi, miso = data
 
+        # Whole transfers, only used if the spi PD doesn't send DATA packets
+        # (i.e. in fast mode). The word ranges come in the packet before.
+        # There are no bit positions then, see handle_command_token_bytes().
+        if ptype == 'TRANSFER-RANGES':
+            self.ranges = mosi
+            return
+        if ptype == 'TRANSFER':
+            if self.got_data or mosi is None or miso is None:
+                return
+            self.miso_bits, self.mosi_bits = None, None
+            for i, (ss, es) in enumerate(self.ranges):
+                self.handle_byte(ss, es, mosi[i], miso[i])
+            return
+
         # For now, only use DATA and BITS packets.
         if ptype not in ('DATA', 'BITS'):
             return
@@ -405,6 +456,10 @@ class Decoder(srd.Decoder):
             self.miso_bits, self.mosi_bits = miso, mosi
             return
 
+        self.got_data = True
+        self.handle_byte(ss, es, mosi, miso)
+
+    def handle_byte(self, ss, es, mosi, miso):
         self.ss, self.es = ss, es
 
         # State machine.
@@ -424,6 +479,7 @@ class Decoder(srd.Decoder):
             handle_cmd()
             self.cmd_token = []
             self.cmd_token_bits = []
+            self.cmd_token_ranges = []
             # Leave ACMD mode again after the first command after CMD55.
             if self.is_acmd and cmdstr != '55':
                 self.is_acmd = False
@@ -18,8 +18,42 @@
 ## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
 ##
 
+
+import math
 import sigrokdecode as srd
 
+'''
+OUTPUT_PYTHON format:
+
+Packet:
+[<ptype>, <pdata>]
+
+<ptype>, <pdata>:
+ - 'BLOCK', [<samples_a>, <samples_b>, <status_a>, <status_b>]
+
+<samples_a>, <samples_b>: Lists of the audio words of channel A (left) and
+  B (right), one per frame. Each word is the 24-bit value of time slots
+  4-27, i.e. the 4 auxiliary bits are the LSBs of the word.
+<status_a>, <status_b>: The 192 channel status bits of channel A and B,
+  as 24 bytes (channel status bit 0 is the LSB of the first byte).
+
+A block normally consists of 192 frames and starts with a 'B' preamble.
+Blocks are sent when complete, or when a 'B' preamble cuts them short.
+Subframes before the first 'B' preamble are not part of any block.
+
+The binary output contains the audio words of all blocks as 24-bit little
+endian PCM, channels A and B interleaved.
+'''
+
+# Subframes (two per frame) in a block.
+BLOCK_SUBFRAMES = 2 * 192
+
+preambles = {
+    (2, 0, 1, 0): ['Preamble W', 'W'],
+    (2, 2, 1, 1): ['Preamble M', 'M'],
+    (2, 1, 1, 2): ['Preamble B', 'B'],
+}
+
 class SamplerateError(Exception):
     pass
 
@@ -45,11 +79,16 @@ class Decoder(srd.Decoder):
         ('subcode', 'Subcode data'),
         ('chan_stat', 'Channnel Status'),
         ('parity', 'Parity Bit'),
+        ('block', 'Block'),
     )
     annotation_rows = (
         ('info', 'Info', (0, 1, 3, 5, 6, 7, 8)),
         ('bits', 'Bits', (2,)),
         ('samples', 'Samples', (4,)),
+        ('blocks', 'Blocks', (9,)),
+    )
+    binary = (
+        ('pcm', 'PCM (24-bit little endian, interleaved)'),
     )
 
     def putx(self, ss, es, data):
@@ -59,51 +98,53 @@ class Decoder(srd.Decoder):
         self.put(self.ss_edge, self.samplenum, self.out_ann, data)
 
     def __init__(self, **kwargs):
-        self.state = 'GET FIRST PULSE WIDTH'
+        self.samplerate = None
         self.olddata = None
         self.ss_edge = None
-        self.first_edge = True
+        self.last_edge = None
         self.pulse_width = 0
+        # The handler for the next pulse (i.e. the state machine state).
+        self.handle_pulse = self.find_first_pulse_width
 
         self.clocks = []
-        self.range1 = 0
-        self.range2 = 0
+        self.pulse_types = b''
 
-        self.preamble_state = 0
         self.preamble = []
-        self.seen_preamble = False
-        self.last_preamble = 0
 
         self.first_one = True
+        self.bitcount = 0
+        self.word = 0
         self.subframe = []
 
+        self.block = None
+        self.block_ss = None
+        self.status = [0, 0]
+
     def start(self):
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_bin = self.register(srd.OUTPUT_BINARY)
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
 
     def get_pulse_type(self):
-        if self.range1 == 0 or self.range2 == 0:
-            return -1
-        if self.pulse_width >= self.range2:
-            return 2
-        elif self.pulse_width >= self.range1:
-            return 0
-        else:
-            return 1
+        # Pulses longer than the table are preamble pulses (type 2).
+        if self.pulse_width < len(self.pulse_types):
+            return self.pulse_types[self.pulse_width]
+        return 2
 
     def find_first_pulse_width(self):
         if self.pulse_width != 0:
             self.clocks.append(self.pulse_width)
-            self.state = 'GET SECOND PULSE WIDTH'
+            self.handle_pulse = self.find_second_pulse_width
 
     def find_second_pulse_width(self):
         if self.pulse_width > (self.clocks[0] * 1.3) or \
                 self.pulse_width < (self.clocks[0] * 0.7):
             self.clocks.append(self.pulse_width)
-            self.state = 'GET THIRD PULSE WIDTH'
+            self.handle_pulse = self.find_third_pulse_width
 
     def find_third_pulse_width(self):
         if not ((self.pulse_width > (self.clocks[0] * 1.3) or \
@@ -114,144 +155,140 @@ class Decoder(srd.Decoder):
 
         self.clocks.append(self.pulse_width)
         self.clocks.sort()
-        self.range1 = (self.clocks[0] + self.clocks[1]) / 2
-        self.range2 = (self.clocks[1] + self.clocks[2]) / 2
+        range1 = (self.clocks[0] + self.clocks[1]) / 2
+        range2 = (self.clocks[1] + self.clocks[2]) / 2
         spdif_bitrate = int(self.samplerate / (self.clocks[2] / 1.5))
         self.ss_edge = 0
 
+        # Classify all pulse widths up front: 1 = half a bit cell,
+        # 0 = a whole bit cell, 2 = one and a half bit cells (preamble).
+        self.pulse_types = bytes(0 if w >= range1 else 1
+                                 for w in range(math.ceil(range2)))
+
         self.puty([0, ['Signal Bitrate: %d Mbit/s (=> %d kHz)' % \
                   (spdif_bitrate, (spdif_bitrate/ (2 * 32)))]])
 
-        clock_period_nsec = 1000000000 / spdif_bitrate
-
-        self.last_preamble = self.samplenum
-
         # We are done recovering the clock, now let's decode the data stream.
-        self.state = 'DECODE STREAM'
+        self.handle_pulse = self.wait_for_preamble
 
     def decode_stream(self):
         pulse = self.get_pulse_type()
+        ss = self.samplenum - self.pulse_width - 1
 
-        if not self.seen_preamble:
-            # This is probably the start of a preamble, decode it.
-            if pulse == 2:
-                self.preamble.append(self.get_pulse_type())
-                self.state = 'DECODE PREAMBLE'
-                self.ss_edge = self.samplenum - self.pulse_width - 1
-            return
-
-        # We've seen a preamble.
         if pulse == 1 and self.first_one:
+            # First half of a '1' bit.
             self.first_one = False
-            self.subframe.append([pulse, self.samplenum - \
-                self.pulse_width - 1, self.samplenum])
-        elif pulse == 1 and not self.first_one:
-            self.subframe[-1][2] = self.samplenum
-            self.putx(self.subframe[-1][1], self.samplenum, [2, ['1']])
-            self.bitcount += 1
+            self.subframe.append([ss, self.samplenum])
+            return
+        elif pulse == 1:
+            self.subframe[-1][1] = self.samplenum
+            self.putx(self.subframe[-1][0], self.samplenum, [2, ['1']])
+            self.word |= 1 << self.bitcount
             self.first_one = True
         else:
-            self.subframe.append([pulse, self.samplenum - \
-                self.pulse_width - 1, self.samplenum])
-            self.putx(self.samplenum - self.pulse_width - 1,
-                      self.samplenum, [2, ['0']])
-            self.bitcount += 1
+            self.subframe.append([ss, self.samplenum])
+            self.putx(ss, self.samplenum, [2, ['0']])
+        self.bitcount += 1
 
         if self.bitcount == 28:
-            aux_audio_data = self.subframe[0:4]
-            sam, sam_rot = '', ''
-            for a in aux_audio_data:
-                sam = sam + str(a[0])
-                sam_rot = str(a[0]) + sam_rot
-            sample = self.subframe[4:24]
-            for s in sample:
-                sam = sam + str(s[0])
-                sam_rot = str(s[0]) + sam_rot
-            validity = self.subframe[24:25]
-            subcode_data = self.subframe[25:26]
-            channel_status = self.subframe[26:27]
-            parity = self.subframe[27:28]
-
-            self.putx(aux_audio_data[0][1], aux_audio_data[3][2], \
-                      [3, ['Aux 0x%x' % int(sam, 2), '0x%x' % int(sam, 2)]])
-            self.putx(sample[0][1], sample[19][2], \
-                      [3, ['Sample 0x%x' % int(sam, 2), '0x%x' % int(sam, 2)]])
-            self.putx(aux_audio_data[0][1], sample[19][2], \
-                      [4, ['Audio 0x%x' % int(sam_rot, 2), '0x%x' % int(sam_rot, 2)]])
-            if validity[0][0] == 0:
-                self.putx(validity[0][1], validity[0][2], [5, ['V']])
-            else:
-                self.putx(validity[0][1], validity[0][2], [5, ['E']])
-            self.putx(subcode_data[0][1], subcode_data[0][2],
-                [6, ['S: %d' % subcode_data[0][0]]])
-            self.putx(channel_status[0][1], channel_status[0][2],
-                [7, ['C: %d' % channel_status[0][0]]])
-            self.putx(parity[0][1], parity[0][2], [8, ['P: %d' % parity[0][0]]])
-
-            self.subframe = []
-            self.seen_preamble = False
-            self.bitcount = 0
+            self.handle_subframe()
+
+    def handle_subframe(self):
+        # Time slots 4-7: aux, 8-27: sample, 28: validity, 29: subcode,
+        # 30: channel status, 31: parity (bits 0-27 after the preamble).
+        s, word = self.subframe, self.word
+        audio = word & 0xffffff
+        aux, sample = audio & 0xf, audio >> 4
+        validity, subcode, channel_status, parity = \
+            [(word >> i) & 1 for i in range(24, 28)]
+
+        self.putx(s[0][0], s[3][1], [3, ['Aux 0x%x' % aux, '0x%x' % aux]])
+        self.putx(s[4][0], s[23][1],
+                  [3, ['Sample 0x%x' % sample, '0x%x' % sample]])
+        self.putx(s[0][0], s[23][1],
+                  [4, ['Audio 0x%x' % audio, '0x%x' % audio]])
+        self.putx(s[24][0], s[24][1], [5, ['E' if validity else 'V']])
+        self.putx(s[25][0], s[25][1], [6, ['S: %d' % subcode]])
+        self.putx(s[26][0], s[26][1], [7, ['C: %d' % channel_status]])
+        self.putx(s[27][0], s[27][1], [8, ['P: %d' % parity]])
+
+        if self.block is not None:
+            n = len(self.block)
+            self.block.append(audio)
+            # Channel status bit i of a channel comes with frame i.
+            self.status[n & 1] |= channel_status << (n >> 1)
+            if n + 1 == BLOCK_SUBFRAMES:
+                self.put_block(s[27][1])
+
+        self.subframe = []
+        self.word = 0
+        self.handle_pulse = self.wait_for_preamble
+
+    def put_block(self, es):
+        block, status = self.block, self.status
+        samples_a, samples_b = block[0::2], block[1::2]
+        status_a = status[0].to_bytes(24, 'little')
+        status_b = status[1].to_bytes(24, 'little')
+        self.put(self.block_ss, es, self.out_python,
+                 ['BLOCK', [samples_a, samples_b, status_a, status_b]])
+        self.put(self.block_ss, es, self.out_ann,
+                 [9, ['Block: %d frames, channel status %s' %
+                      (len(samples_a), status_a[:5].hex().upper()),
+                      'Block: %d frames' % len(samples_a), 'Block', 'B']])
+        pcm = b''.join(w.to_bytes(3, 'little') for w in block)
+        if pcm:
+            self.put(self.block_ss, es, self.out_bin, (0, pcm))
+        self.block = None
+
+    def wait_for_preamble(self):
+        # This is probably the start of a preamble, decode it.
+        if self.get_pulse_type() == 2:
+            self.preamble = [2]
+            self.ss_edge = self.samplenum - self.pulse_width - 1
+            self.handle_pulse = self.decode_preamble
 
     def decode_preamble(self):
-        if self.preamble_state == 0:
-            self.preamble.append(self.get_pulse_type())
-            self.preamble_state = 1
-        elif self.preamble_state == 1:
-            self.preamble.append(self.get_pulse_type())
-            self.preamble_state = 2
-        elif self.preamble_state == 2:
-            self.preamble.append(self.get_pulse_type())
-            self.preamble_state = 0
-            self.state = 'DECODE STREAM'
-            if self.preamble == [2, 0, 1, 0]:
-                self.puty([1, ['Preamble W', 'W']])
-            elif self.preamble == [2, 2, 1, 1]:
-                self.puty([1, ['Preamble M', 'M']])
-            elif self.preamble == [2, 1, 1, 2]:
-                self.puty([1, ['Preamble B', 'B']])
-            else:
-                self.puty([1, ['Unknown Preamble', 'Unkown Prea.', 'U']])
-            self.preamble = []
-            self.seen_preamble = True
-            self.bitcount = 0
-            self.first_one = True
+        self.preamble.append(self.get_pulse_type())
+        if len(self.preamble) < 4:
+            return
 
-        self.last_preamble = self.samplenum
+        preamble = tuple(self.preamble)
+        self.puty([1, preambles.get(preamble,
+                   ['Unknown Preamble', 'Unkown Prea.', 'U'])])
+        if preamble == (2, 1, 1, 2):
+            # 'B' starts a new block (and ends a short one).
+            if self.block:
+                self.put_block(self.ss_edge)
+            self.block, self.block_ss = [], self.ss_edge
+            self.status = [0, 0]
+        self.bitcount = 0
+        self.first_one = True
+        self.handle_pulse = self.decode_stream
 
     def decode(self, ss, es, data):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
 
         for (self.samplenum, pins) in data:
-            data = pins[0]
-
-            # Initialize self.olddata with the first sample value.
-            if self.olddata is None:
-                self.olddata = data
-                continue
-
-            # First we need to recover the clock.
-            if self.olddata == data:
-                self.pulse_width += 1
-                continue
-
-            # Found rising or falling edge.
-            if self.first_edge:
-                # Throw away first detected edge as it might be mangled data.
-                self.first_edge = False
-                self.pulse_width = 0
-            else:
-                if self.state == 'GET FIRST PULSE WIDTH':
-                    self.find_first_pulse_width()
-                elif self.state == 'GET SECOND PULSE WIDTH':
-                    self.find_second_pulse_width()
-                elif self.state == 'GET THIRD PULSE WIDTH':
-                    self.find_third_pulse_width()
-                elif self.state == 'DECODE STREAM':
-                    self.decode_stream()
-                elif self.state == 'DECODE PREAMBLE':
-                    self.decode_preamble()
-
-            self.pulse_width = 0
-
-            self.olddata = data
+            level = pins[0]
+
+            # Only edges matter, the pulse widths are the distances
+            # between them.
+            if self.olddata != level:
+                if self.olddata is not None:
+                    if self.last_edge is None:
+                        # Throw away first detected edge as it might be
+                        # mangled data.
+                        self.pulse_width = 0
+                    else:
+                        self.pulse_width = self.samplenum - self.last_edge - 1
+                        self.handle_pulse()
+                    self.last_edge = self.samplenum
+                self.olddata = level
+
+            data.skip()
+
+    def end(self):
+        # Emit a pending (short) block at the end of the stream.
+        if self.block:
+            self.put_block(self.last_edge)
@@ -38,6 +38,16 @@ Packet:
    Both data items are Python numbers (0/1), not strings. At the beginning of
    the decoding a packet is generated with <data1> = None and <data2> being the
    initial state of the CS# pin or None if the chip select pin is not supplied.
+ - 'TRANSFER': <data1> contains all MOSI data words of a transfer, <data2>
+   all MISO data words, or None if the respective channel was not supplied.
+   These are bytes objects for word sizes up to 8 bits, lists of numbers
+   otherwise. A transfer consists of all (complete) data words while CS# is
+   asserted, it is sent when CS# is deasserted (before the 'CS-CHANGE'
+   packet). Only available if the CS# pin is supplied.
+ - 'TRANSFER-RANGES': <data1> is the list of (ss, es) tuples of each data
+   word of the following 'TRANSFER' packet, i.e. what would have been the
+   ss/es of the respective 'DATA' packets. <data2> is None. It is sent right
+   before each 'TRANSFER' packet, with the same ss/es.
 
 Examples:
  ['CS-CHANGE', None, 1]
@@ -50,7 +60,14 @@ Examples:
  ['DATA', 0x65, 0x00]
  ['DATA', 0xa8, None]
  ['DATA', None, 0x55]
+ ['TRANSFER-RANGES', [(80, 97), (98, 115)], None]
+ ['TRANSFER', b'\xff\x65', b'\x3a\x00']
  ['CS-CHANGE', 0, 1]
+
+In fast mode, no 'BITS' packets and no bit annotations are generated. If the
+CS# pin is supplied, there are no 'DATA' packets either, stacked PDs get the
+data words in 'TRANSFER' packets only. Stacked PDs which annotate single bits
+(e.g. sdcard_spi, rfm12) only annotate whole bytes then.
 '''
 
 # Key: (CPOL, CPHA). Value: SPI mode.
@@ -96,6 +113,8 @@ class Decoder(srd.Decoder):
         {'id': 'bitorder', 'desc': 'Bit order',
             'default': 'msb-first', 'values': ('msb-first', 'lsb-first')},
         {'id': 'wordsize', 'desc': 'Word size', 'default': 8},
+        {'id': 'fast', 'desc': 'Fast mode (no bits output)?', 'default': 'no',
+            'values': ('yes', 'no')},
     )
     annotations = (
         ('miso-data', 'MISO data'),
@@ -121,8 +140,6 @@ class Decoder(srd.Decoder):
         self.oldclk = 1
         self.bitcount = 0
         self.misodata = self.mosidata = 0
-        self.misobits = []
-        self.mosibits = []
         self.ss_block = -1
         self.samplenum = -1
         self.cs_was_deasserted = False
@@ -130,6 +147,9 @@ class Decoder(srd.Decoder):
         self.oldpins = None
         self.have_cs = self.have_miso = self.have_mosi = None
         self.no_cs_notification = False
+        self.transfer_mosi = self.transfer_miso = None
+        self.transfer_ranges = []
+        self.ss_transfer = None
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
@@ -142,33 +162,64 @@ class Decoder(srd.Decoder):
         self.out_bitrate = self.register(srd.OUTPUT_META,
                 meta=(int, 'Bitrate', 'Bitrate during transfers'))
 
+        # Resolve the options once, instead of for every bit.
+        self.wordsize = self.options['wordsize']
+        self.msb_first = self.options['bitorder'] == 'msb-first'
+        self.cs_active = 0 if self.options['cs_polarity'] == 'active-low' else 1
+        # The clock level after the edge on which data is sampled.
+        mode = spi_mode[self.options['cpol'], self.options['cpha']]
+        self.sample_clk = 1 if mode in (0, 3) else 0
+        self.fast = self.options['fast'] == 'yes'
+        # Sample numbers of the bits of the current data word.
+        self.bitsamples = [0] * self.wordsize
+
     def putw(self, data):
         self.put(self.ss_block, self.samplenum, self.out_ann, data)
 
+    # Return the list of [bit, ss, es] of the current data word (last bit
+    # first), as used in 'BITS' packets.
+    def word_bits(self, data):
+        ws, samples = self.wordsize, self.bitsamples
+        bits = []
+        for i in range(ws):
+            shift = ws - 1 - i if self.msb_first else i
+            if i < ws - 1:
+                es = samples[i + 1]
+            else:
+                es = self.es_block
+            bits.insert(0, [(data >> shift) & 1, samples[i], es])
+        return bits
+
     def putdata(self):
         # Pass MISO and MOSI bits and then data to the next PD up the stack.
         so = self.misodata if self.have_miso else None
         si = self.mosidata if self.have_mosi else None
-        so_bits = self.misobits if self.have_miso else None
-        si_bits = self.mosibits if self.have_mosi else None
 
+        # Guesstimate the endsample of the last bit.
+        ss, es = self.ss_block, self.bitsamples[-1]
+        if self.wordsize > 1:
+            es += self.bitsamples[-1] - self.bitsamples[-2]
+        self.es_block = es
         if self.have_miso:
-            ss, es = self.misobits[-1][1], self.misobits[0][2]
             self.put(ss, es, self.out_bin, (0, bytes([so])))
         if self.have_mosi:
-            ss, es = self.mosibits[-1][1], self.mosibits[0][2]
             self.put(ss, es, self.out_bin, (1, bytes([si])))
 
-        self.put(ss, es, self.out_python, ['BITS', si_bits, so_bits])
-        self.put(ss, es, self.out_python, ['DATA', si, so])
+        if not self.fast:
+            so_bits = self.word_bits(so) if self.have_miso else None
+            si_bits = self.word_bits(si) if self.have_mosi else None
+            self.put(ss, es, self.out_python, ['BITS', si_bits, so_bits])
+        if not (self.fast and self.have_cs):
+            self.put(ss, es, self.out_python, ['DATA', si, so])
 
         # Bit annotations.
-        if self.have_miso:
-            for bit in self.misobits:
-                self.put(bit[1], bit[2], self.out_ann, [2, ['%d' % bit[0]]])
-        if self.have_mosi:
-            for bit in self.mosibits:
-                self.put(bit[1], bit[2], self.out_ann, [3, ['%d' % bit[0]]])
+        if not self.fast:
+            if self.have_miso:
+                for bit in so_bits:
+                    self.put(bit[1], bit[2], self.out_ann, [2, ['%d' % bit[0]]])
+            if self.have_mosi:
+                for bit in si_bits:
+                    self.put(bit[1], bit[2], self.out_ann, [3, ['%d' % bit[0]]])
 
         # Dataword annotations.
         if self.have_miso:
@@ -176,60 +227,60 @@ class Decoder(srd.Decoder):
         if self.have_mosi:
             self.put(ss, es, self.out_ann, [1, ['%02X' % self.mosidata]])
 
+        # Collect the words of the transfer.
+        if self.have_cs and self.oldcs == self.cs_active:
+            if self.ss_transfer is None:
+                self.ss_transfer = ss
+                container = bytearray if self.wordsize <= 8 else list
+                self.transfer_mosi = container() if self.have_mosi else None
+                self.transfer_miso = container() if self.have_miso else None
+            if self.have_mosi:
+                self.transfer_mosi.append(si)
+            if self.have_miso:
+                self.transfer_miso.append(so)
+            self.transfer_ranges.append((ss, es))
+
+    # Send the words received while CS# was asserted as one packet.
+    def puttransfer(self):
+        if self.ss_transfer is None:
+            return
+        si, so = self.transfer_mosi, self.transfer_miso
+        if self.wordsize <= 8:
+            si = bytes(si) if si is not None else None
+            so = bytes(so) if so is not None else None
+        self.put(self.ss_transfer, self.samplenum, self.out_python,
+                 ['TRANSFER-RANGES', self.transfer_ranges, None])
+        self.put(self.ss_transfer, self.samplenum, self.out_python,
+                 ['TRANSFER', si, so])
+        self.ss_transfer = None
+        self.transfer_mosi = self.transfer_miso = None
+        self.transfer_ranges = []
+
     def reset_decoder_state(self):
         self.misodata = 0 if self.have_miso else None
         self.mosidata = 0 if self.have_mosi else None
-        self.misobits = [] if self.have_miso else None
-        self.mosibits = [] if self.have_mosi else None
         self.bitcount = 0
 
     def handle_bit(self, miso, mosi, clk, cs):
+        bitcount = self.bitcount
+
         # If this is the first bit of a dataword, save its sample number.
-        if self.bitcount == 0:
+        if bitcount == 0:
             self.ss_block = self.samplenum
-            self.cs_was_deasserted = False
-            if self.have_cs:
-                active_low = (self.options['cs_polarity'] == 'active-low')
-                self.cs_was_deasserted = (cs == 1) if active_low else (cs == 0)
-
-        ws = self.options['wordsize']
+            self.cs_was_deasserted = self.have_cs and cs != self.cs_active
 
-        # Receive MISO bit into our shift register.
+        # Receive MISO/MOSI bits into our shift registers.
+        shift = self.wordsize - 1 - bitcount if self.msb_first else bitcount
         if self.have_miso:
-            if self.options['bitorder'] == 'msb-first':
-                self.misodata |= miso << (ws - 1 - self.bitcount)
-            else:
-                self.misodata |= miso << self.bitcount
-
-        # Receive MOSI bit into our shift register.
+            self.misodata |= miso << shift
         if self.have_mosi:
-            if self.options['bitorder'] == 'msb-first':
-                self.mosidata |= mosi << (ws - 1 - self.bitcount)
-            else:
-                self.mosidata |= mosi << self.bitcount
+            self.mosidata |= mosi << shift
+        self.bitsamples[bitcount] = self.samplenum
 
-        # Guesstimate the endsample for this bit (can be overridden below).
-        es = self.samplenum
-        if self.bitcount > 0:
-            if self.have_miso:
-                es += self.samplenum - self.misobits[0][1]
-            elif self.have_mosi:
-                es += self.samplenum - self.mosibits[0][1]
-
-        if self.have_miso:
-            self.misobits.insert(0, [miso, self.samplenum, es])
-        if self.have_mosi:
-            self.mosibits.insert(0, [mosi, self.samplenum, es])
-
-        if self.bitcount > 0 and self.have_miso:
-            self.misobits[1][2] = self.samplenum
-        if self.bitcount > 0 and self.have_mosi:
-            self.mosibits[1][2] = self.samplenum
-
-        self.bitcount += 1
+        self.bitcount = bitcount + 1
 
         # Continue to receive if not enough bits were received, yet.
-        if self.bitcount != ws:
+        if self.bitcount != self.wordsize:
             return
 
         self.putdata()
@@ -237,7 +288,7 @@ class Decoder(srd.Decoder):
         # Meta bitrate.
         elapsed = 1 / float(self.samplerate)
         elapsed *= (self.samplenum - self.ss_block + 1)
-        bitrate = int(1 / elapsed * self.options['wordsize'])
+        bitrate = int(1 / elapsed * self.wordsize)
         self.put(self.ss_block, self.samplenum, self.out_bitrate, bitrate)
 
         if self.have_cs and self.cs_was_deasserted:
@@ -247,6 +298,9 @@ class Decoder(srd.Decoder):
 
     def find_clk_edge(self, miso, mosi, clk, cs):
         if self.have_cs and self.oldcs != cs:
+            # Send the transfer when CS# gets deasserted.
+            if cs != self.cs_active:
+                self.puttransfer()
             # Send all CS# pin value changes.
             self.put(self.samplenum, self.samplenum, self.out_python,
                      ['CS-CHANGE', self.oldcs, cs])
@@ -261,14 +315,7 @@ class Decoder(srd.Decoder):
         self.oldclk = clk
 
         # Sample data on rising/falling clock edge (depends on mode).
-        mode = spi_mode[self.options['cpol'], self.options['cpha']]
-        if mode == 0 and clk == 0:   # Sample on rising clock edge
-            return
-        elif mode == 1 and clk == 1: # Sample on falling clock edge
-            return
-        elif mode == 2 and clk == 1: # Sample on falling clock edge
-            return
-        elif mode == 3 and clk == 0: # Sample on rising clock edge
+        if clk != self.sample_clk:
             return
 
         # Found the correct clock edge, now get the SPI bit(s).
@@ -281,6 +328,8 @@ class Decoder(srd.Decoder):
         for (self.samplenum, pins) in data:
 
             # Ignore identical samples early on (for performance reasons).
+            # Let the next iteration continue at the next change.
+            data.skip()
             if self.oldpins == pins:
                 continue
             self.oldpins, (clk, miso, mosi, cs) = pins, pins
@@ -20,6 +20,7 @@
 
 import sigrokdecode as srd
 from math import floor, ceil
+from common.bitwidth import estimate_bitwidth
 
 '''
 OUTPUT_PYTHON format:
@@ -39,6 +40,14 @@ This is the list of <ptype>s and their respective <pdata> values:
  - 'INVALID STOPBIT': The data is the (integer) value of the stop bit (0/1).
  - 'PARITY ERROR': The data is a tuple with two entries. The first one is
    the expected parity value, the second is the actual parity value.
+ - 'BYTES': Only in burst mode, which replaces the 'STARTBIT', 'DATA' and
+   'STOPBIT' packets of back-to-back frames. This is a tuple containing
+   two items:
+   - 1st item: the data values of all frames in the burst (bytes).
+   - 2nd item: the list of (ss, es) tuples of the data of each frame, i.e.
+     what would have been the ss/es of the individual 'DATA' packets.
+   A burst ends when the line is idle for one frame time, on errors, and
+   after MAX_BURST frames.
  - TODO: Frame error?
 
 The <rxtx> field is 0 for RX packets, 1 for TX packets.
@@ -48,6 +57,12 @@ The <rxtx> field is 0 for RX packets, 1 for TX packets.
 RX = 0
 TX = 1
 
+# Maximum number of frames in one 'BYTES' packet (burst mode).
+MAX_BURST = 1024
+
+# Number of edge intervals to collect before guessing the baud rate.
+AUTOBAUD_EDGES = 128
+
 # Given a parity type to check (odd, even, zero, one), the value of the
 # parity bit, the value of the data, and the length of the data (5-9 bits,
 # usually 8 bits) return True if the parity is correct, False otherwise.
@@ -108,6 +123,10 @@ class Decoder(srd.Decoder):
             'values': ('yes', 'no')},
         {'id': 'invert_tx', 'desc': 'Invert TX?', 'default': 'no',
             'values': ('yes', 'no')},
+        {'id': 'burst', 'desc': 'Burst mode (up to 8 data bits)?',
+            'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'autobaud', 'desc': 'Detect baud rate?', 'default': 'no',
+            'values': ('yes', 'no')},
     )
     annotations = (
         ('rx-data', 'RX data'),
@@ -161,6 +180,7 @@ class Decoder(srd.Decoder):
 
     def __init__(self, **kwargs):
         self.samplerate = None
+        self.bit_width = None
         self.samplenum = 0
         self.frame_start = [-1, -1]
         self.startbit = [-1, -1]
@@ -171,30 +191,97 @@ class Decoder(srd.Decoder):
         self.startsample = [-1, -1]
         self.state = ['WAIT FOR START BIT', 'WAIT FOR START BIT']
         self.oldbit = [1, 1]
-        self.oldpins = [1, 1]
         self.databits = [[], []]
+        # Precomputed (samplenum, handler) steps of the current frames.
+        self.schedule = [[], []]
+        self.step = [0, 0]
+        # Burst mode: data/ranges of the pending burst, and the samplenum
+        # at which it ends unless another frame starts.
+        self.burst = False
+        self.burst_data = [bytearray(), bytearray()]
+        self.burst_ranges = [[], []]
+        self.burst_end = [None, None]
+        # Autobaud: histogram of edge intervals (in samples), the last edge
+        # of each line, and whether a line was seen idle after locking in.
+        self.intervals = {}
+        self.num_intervals = 0
+        self.autobaud_edges = AUTOBAUD_EDGES
+        self.first_edge = None
+        self.last_edge = [None, None]
+        self.synced = [True, True]
 
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_bin = self.register(srd.OUTPUT_BINARY)
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.burst = self.options['burst'] == 'yes' and \
+            self.options['num_data_bits'] <= 8
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
             self.samplerate = value
-            # The width of one UART bit in number of samples.
+            # The width of one UART bit in number of samples. With autobaud
+            # it's only known after enough edges were seen.
+            if self.options['autobaud'] == 'yes':
+                return
             self.bit_width = float(self.samplerate) / float(self.options['baudrate'])
 
-    # Return true if we reached the middle of the desired bit, false otherwise.
-    def reached_bit(self, rxtx, bitnum):
-        # bitpos is the samplenumber which is in the middle of the
-        # specified UART bit (0 = start bit, 1..x = data, x+1 = parity bit
-        # (if used) or the first stop bit, and so on).
+    # Autobaud: add the interval since the previous edge of this line to
+    # the histogram. Once there are enough of them, lock in the baud rate.
+    def autobaud_edge(self, rxtx):
+        if self.first_edge is None:
+            self.first_edge = self.samplenum
+        last_edge, self.last_edge[rxtx] = self.last_edge[rxtx], self.samplenum
+        if last_edge is None:
+            return
+        interval = self.samplenum - last_edge
+        entry = self.intervals.setdefault(interval, [0, 0])
+        entry[0] += 1
+        entry[1] += interval
+        self.num_intervals += 1
+        if self.num_intervals < self.autobaud_edges:
+            return
+
+        # At most 9 equal bits in a row (start bit and 8 data bits).
+        estimate = estimate_bitwidth(self.intervals, 9)
+        if estimate is None:
+            # Try again later, with (twice) more data.
+            self.autobaud_edges *= 2
+            return
+
+        self.bit_width = bit_width = estimate[0]
+        self.intervals = {}
+        self.synced = [False, False]
+        baud = round(self.samplerate / bit_width)
+        self.put(self.first_edge, self.samplenum, self.out_ann,
+                 [rxtx + 10, ['Baud rate: %d' % baud, 'Baud: %d' % baud,
+                              '%d' % baud]])
+
+    # After locking in the baud rate, the line may be in the middle of a
+    # frame. Only accept a start bit after the line was high for at least
+    # one bit (i.e. what could be a stop bit). Like at the start of a
+    # capture, decoding may still be off for a few frames until it resyncs.
+    def wait_for_sync(self, rxtx, old_signal, signal):
+        if old_signal == signal:
+            return
+        last_edge, self.last_edge[rxtx] = self.last_edge[rxtx], self.samplenum
+        if old_signal == 1 and last_edge is not None and \
+                self.samplenum - last_edge >= self.bit_width:
+            self.synced[rxtx] = True
+
+    # Return the (fractional) samplenumber which is in the middle of the
+    # specified UART bit (0 = start bit, 1..x = data, x+1 = parity bit
+    # (if used) or the first stop bit, and so on).
+    def bit_pos(self, rxtx, bitnum):
         # The samples within bit are 0, 1, ..., (bit_width - 1), therefore
         # index of the middle sample within bit window is (bit_width - 1) / 2.
         bitpos = self.frame_start[rxtx] + (self.bit_width - 1) / 2.0
         bitpos += bitnum * self.bit_width
-        if self.samplenum >= bitpos:
+        return bitpos
+
+    # Return true if we reached the middle of the desired bit, false otherwise.
+    def reached_bit(self, rxtx, bitnum):
+        if self.samplenum >= self.bit_pos(rxtx, bitnum):
             return True
         return False
 
@@ -214,6 +301,30 @@ class Decoder(srd.Decoder):
         self.frame_start[rxtx] = self.samplenum
 
         self.state[rxtx] = 'GET START BIT'
+        self.schedule_frame(rxtx)
+
+    # Compute up front at which samplenum each step of the frame happens:
+    # the first sample at (or after) the middle of the respective bit, but
+    # at least one sample after the previous step. The decoder then only
+    # needs to look at these samples (and at edges) instead of all of them.
+    def schedule_frame(self, rxtx):
+        num_data_bits = self.options['num_data_bits']
+        has_parity = self.options['parity_type'] != 'none'
+        steps = [(0, self.get_start_bit)]
+        steps += [(b, self.get_data_bits) for b in range(1, num_data_bits + 1)]
+        # Without a parity bit this step only advances to the stop bit(s).
+        steps.append((num_data_bits + 1 if has_parity else None,
+                      self.get_parity_bit))
+        steps.append((num_data_bits + 1 + int(has_parity), self.get_stop_bits))
+
+        s = self.frame_start[rxtx] + 1
+        self.schedule[rxtx] = []
+        for bitnum, handler in steps:
+            if bitnum is not None:
+                s = max(s, ceil(self.bit_pos(rxtx, bitnum)))
+            self.schedule[rxtx].append((s, handler))
+            s += 1
+        self.step[rxtx] = 0
 
     def get_start_bit(self, rxtx, signal):
         # Skip samples until we're in the middle of the start bit.
@@ -224,6 +335,7 @@ class Decoder(srd.Decoder):
 
         # The startbit must be 0. If not, we report an error.
         if self.startbit[rxtx] != 0:
+            self.burst_flush(rxtx)
             self.putp(['INVALID STARTBIT', rxtx, self.startbit[rxtx]])
             # TODO: Abort? Ignore rest of the frame?
 
@@ -233,6 +345,9 @@ class Decoder(srd.Decoder):
 
         self.state[rxtx] = 'GET DATA BITS'
 
+        if self.burst:
+            return
+
         self.putp(['STARTBIT', rxtx, self.startbit[rxtx]])
         self.putg([rxtx + 2, ['Start bit', 'Start', 'S']])
 
@@ -254,11 +369,12 @@ class Decoder(srd.Decoder):
             self.databyte[rxtx] <<= 1
             self.databyte[rxtx] |= (signal << 0)
 
-        self.putg([rxtx + 12, ['%d' % signal]])
+        if not self.burst:
+            self.putg([rxtx + 12, ['%d' % signal]])
 
-        # Store individual data bits and their start/end samplenumbers.
-        s, halfbit = self.samplenum, int(self.bit_width / 2)
-        self.databits[rxtx].append([signal, s - halfbit, s + halfbit])
+            # Store individual data bits and their start/end samplenumbers.
+            s, halfbit = self.samplenum, int(self.bit_width / 2)
+            self.databits[rxtx].append([signal, s - halfbit, s + halfbit])
 
         # Return here, unless we already received all data bits.
         if self.cur_data_bit[rxtx] < self.options['num_data_bits'] - 1:
@@ -267,26 +383,56 @@ class Decoder(srd.Decoder):
 
         self.state[rxtx] = 'GET PARITY BIT'
 
+        if self.burst:
+            self.burst_add(rxtx)
+            return
+
         self.putpx(rxtx, ['DATA', rxtx,
             (self.databyte[rxtx], self.databits[rxtx])])
 
-        b, f = self.databyte[rxtx], self.options['format']
+        b = self.databyte[rxtx]
+        self.putx(rxtx, [rxtx, [self.format_value(b)]])
+
+        self.putbin(rxtx, (rxtx, bytes([b])))
+        self.putbin(rxtx, (2, bytes([b])))
+
+        self.databits = [[], []]
+
+    def format_value(self, b):
+        f = self.options['format']
         if f == 'ascii':
-            c = chr(b) if b in range(30, 126 + 1) else '[%02X]' % b
-            self.putx(rxtx, [rxtx, [c]])
+            return chr(b) if b in range(30, 126 + 1) else '[%02X]' % b
         elif f == 'dec':
-            self.putx(rxtx, [rxtx, [str(b)]])
+            return str(b)
         elif f == 'hex':
-            self.putx(rxtx, [rxtx, [hex(b)[2:].zfill(2).upper()]])
+            return hex(b)[2:].zfill(2).upper()
         elif f == 'oct':
-            self.putx(rxtx, [rxtx, [oct(b)[2:].zfill(3)]])
+            return oct(b)[2:].zfill(3)
         elif f == 'bin':
-            self.putx(rxtx, [rxtx, [bin(b)[2:].zfill(8)]])
+            return bin(b)[2:].zfill(8)
 
-        self.putbin(rxtx, (rxtx, bytes([b])))
-        self.putbin(rxtx, (2, bytes([b])))
-
-        self.databits = [[], []]
+    # Burst mode: collect the data of a frame, instead of emitting it.
+    def burst_add(self, rxtx):
+        s, halfbit = self.startsample[rxtx], self.bit_width / 2.0
+        ss, es = s - floor(halfbit), self.samplenum + ceil(halfbit)
+        self.burst_data[rxtx].append(self.databyte[rxtx])
+        self.burst_ranges[rxtx].append((ss, es))
+
+    # Burst mode: emit all frames collected so far, if any.
+    def burst_flush(self, rxtx):
+        self.burst_end[rxtx] = None
+        if not self.burst_data[rxtx]:
+            return
+        data, ranges = bytes(self.burst_data[rxtx]), self.burst_ranges[rxtx]
+        ss, es = ranges[0][0], ranges[-1][1]
+        self.put(ss, es, self.out_python, ['BYTES', rxtx, (data, ranges)])
+        sep = '' if self.options['format'] == 'ascii' else ' '
+        self.put(ss, es, self.out_ann,
+                 [rxtx, [sep.join(self.format_value(b) for b in data)]])
+        self.put(ss, es, self.out_bin, (rxtx, data))
+        self.put(ss, es, self.out_bin, (2, data))
+        self.burst_data[rxtx] = bytearray()
+        self.burst_ranges[rxtx] = []
 
     def get_parity_bit(self, rxtx, signal):
         # If no parity is used/configured, skip to the next state immediately.
@@ -304,9 +450,12 @@ class Decoder(srd.Decoder):
 
         if parity_ok(self.options['parity_type'], self.paritybit[rxtx],
                      self.databyte[rxtx], self.options['num_data_bits']):
+            if self.burst:
+                return
             self.putp(['PARITYBIT', rxtx, self.paritybit[rxtx]])
             self.putg([rxtx + 4, ['Parity bit', 'Parity', 'P']])
         else:
+            self.burst_flush(rxtx)
             # TODO: Return expected/actual parity values.
             self.putp(['PARITY ERROR', rxtx, (0, 1)]) # FIXME: Dummy tuple...
             self.putg([rxtx + 6, ['Parity error', 'Parity err', 'PE']])
@@ -323,12 +472,25 @@ class Decoder(srd.Decoder):
 
         # Stop bits must be 1. If not, we report an error.
         if self.stopbit1[rxtx] != 1:
+            self.burst_flush(rxtx)
             self.putp(['INVALID STOPBIT', rxtx, self.stopbit1[rxtx]])
             self.putg([rxtx + 8, ['Frame error', 'Frame err', 'FE']])
             # TODO: Abort? Ignore the frame? Other?
 
         self.state[rxtx] = 'WAIT FOR START BIT'
 
+        if self.burst:
+            # The burst ends unless the next frame starts within one frame
+            # time (start, data, parity and stop bit) after this one.
+            if len(self.burst_data[rxtx]) >= MAX_BURST:
+                self.burst_flush(rxtx)
+            elif self.burst_data[rxtx]:
+                num_bits = 2 + self.options['num_data_bits'] + \
+                    int(self.options['parity_type'] != 'none')
+                self.burst_end[rxtx] = self.samplenum + \
+                    ceil((num_bits + 0.5) * self.bit_width)
+            return
+
         self.putp(['STOPBIT', rxtx, self.stopbit1[rxtx]])
         self.putg([rxtx + 4, ['Stop bit', 'Stop', 'T']])
 
@@ -336,12 +498,7 @@ class Decoder(srd.Decoder):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
         for (self.samplenum, pins) in data:
-
-            # Note: Ignoring identical samples here for performance reasons
-            # is not possible for this PD, at least not in the current state.
-            # if self.oldpins == pins:
-            #     continue
-            self.oldpins, (rx, tx) = pins, pins
+            rx, tx = pins
 
             if self.options['invert_rx'] == 'yes':
                 rx = not rx
@@ -353,7 +510,9 @@ class Decoder(srd.Decoder):
             if has_pin == [False, False]:
                 raise ChannelError('Either TX or RX (or both) pins required.')
 
-            # State machine.
+            # State machine. Only edges and the precomputed bit-centre
+            # samples of a frame get here, see skip() below.
+            until = None
             for rxtx in (RX, TX):
                 # Don't try to handle RX (or TX) if not supplied.
                 if not has_pin[rxtx]:
@@ -361,16 +520,52 @@ class Decoder(srd.Decoder):
 
                 signal = rx if (rxtx == RX) else tx
 
+                # Autobaud: only collect edge intervals until locked in.
+                if self.bit_width is None:
+                    if signal != self.oldbit[rxtx]:
+                        self.autobaud_edge(rxtx)
+                    self.oldbit[rxtx] = signal
+                    continue
+
+                if not self.synced[rxtx]:
+                    self.wait_for_sync(rxtx, self.oldbit[rxtx], signal)
+                    if not self.synced[rxtx]:
+                        self.oldbit[rxtx] = signal
+                        continue
+
                 if self.state[rxtx] == 'WAIT FOR START BIT':
+                    burst_end = self.burst_end[rxtx]
+                    if burst_end is not None and self.samplenum >= burst_end:
+                        self.burst_flush(rxtx)
                     self.wait_for_start_bit(rxtx, self.oldbit[rxtx], signal)
-                elif self.state[rxtx] == 'GET START BIT':
-                    self.get_start_bit(rxtx, signal)
-                elif self.state[rxtx] == 'GET DATA BITS':
-                    self.get_data_bits(rxtx, signal)
-                elif self.state[rxtx] == 'GET PARITY BIT':
-                    self.get_parity_bit(rxtx, signal)
-                elif self.state[rxtx] == 'GET STOP BITS':
-                    self.get_stop_bits(rxtx, signal)
+                else:
+                    samplenum, handler = self.schedule[rxtx][self.step[rxtx]]
+                    if self.samplenum >= samplenum:
+                        handler(rxtx, signal)
+                        self.step[rxtx] += 1
 
                 # Save current RX/TX values for the next round.
                 self.oldbit[rxtx] = signal
+
+                # The next sample this line needs to see, unless it changes.
+                if self.state[rxtx] != 'WAIT FOR START BIT':
+                    samplenum = self.schedule[rxtx][self.step[rxtx]][0]
+                else:
+                    samplenum = self.burst_end[rxtx]
+                if samplenum is None:
+                    continue
+                if until is None or samplenum < until:
+                    until = samplenum
+
+            # Nothing happens until one of the lines changes, or until the
+            # next bit of a frame needs to be sampled.
+            if until is None:
+                data.skip()
+            else:
+                data.skip(until)
+
+    def end(self):
+        # Emit pending bursts at the end of the stream.
+        if self.burst:
+            self.burst_flush(RX)
+            self.burst_flush(TX)
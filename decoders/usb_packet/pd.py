@@ -33,7 +33,9 @@ Packet:
  - 'ADDR', <addr>
  - 'EP', <ep>
  - 'CRC5', <crc5>
+ - 'CRC5 ERROR', <crc5>
  - 'CRC16', <crc16>
+ - 'CRC16 ERROR', <crc16>
  - 'EOP', <eop>
  - 'FRAMENUM', <framenum>
  - 'DATABYTE', <databyte>
@@ -44,6 +46,7 @@ Packet:
  - 'E/U', <e/u>
  - 'ET', <et>
  - 'PACKET', [<pcategory>, <pname>, <pinfo>]
+ - 'TRANSACTION', [<token>, <addr>, <ep>, <datapid>, <databytes>, <handshake>]
 
 <pcategory>, <pname>, <pinfo>:
  - 'TOKEN', 'OUT', [<sync>, <pid>, <addr>, <ep>, <crc5>, <eop>]
@@ -75,12 +78,21 @@ Packet:
 <framenum>: USB (micro)frame number, 0-2047 (11 bits).
 <databyte>: A single data byte, e.g. 0x55.
 <databytes>: List of data bytes, e.g. [0x55, 0xaa, 0x99] (0 - 1024 bytes).
+<token>: 'OUT', 'IN', 'SETUP' or 'PING'.
+<datapid>: 'DATA0', 'DATA1', 'DATA2', 'MDATA' or None (no data packet).
+<handshake>: 'ACK', 'NAK', 'STALL', 'NYET' or None (e.g. isochronous).
 <hubaddr>: TODO
 <sc>: TODO
 <port>: TODO
 <s>: TODO
 <e/u>: TODO
 <et>: TODO
+
+'TRANSACTION' groups a token with the data and handshake packets following
+it. It is sent after the handshake, or when another packet (e.g. the next
+token or an SOF) shows that no handshake will follow. Packets with CRC
+errors are never part of a transaction (the receiver ignores them), so a
+broken data packet ends the transaction without data.
 '''
 
 # Packet IDs (PIDs).
@@ -117,6 +129,9 @@ pids = {
     '00001111': ['Reserved', 'Reserved PID'],
 }
 
+# The same table, indexed by the PID as a number (sent LSB-first).
+pids_num = {int(pid[::-1], 2): p for (pid, p) in pids.items()}
+
 def get_category(pidname):
     if pidname in ('OUT', 'IN', 'SOF', 'SETUP'):
         return 'TOKEN'
@@ -127,20 +142,24 @@ def get_category(pidname):
     else:
         return 'SPECIAL'
 
+ann_indices = {pidname: i + 11 for (i, pidname) in enumerate((
+    'OUT', 'IN', 'SOF', 'SETUP', 'DATA0', 'DATA1', 'DATA2', 'MDATA',
+    'ACK', 'NAK', 'STALL', 'NYET', 'PRE', 'ERR', 'SPLIT', 'PING',
+    'Reserved'))}
+
 def ann_index(pidname):
-    l = ['OUT', 'IN', 'SOF', 'SETUP', 'DATA0', 'DATA1', 'DATA2', 'MDATA',
-         'ACK', 'NAK', 'STALL', 'NYET', 'PRE', 'ERR', 'SPLIT', 'PING',
-         'Reserved']
-    if pidname not in l:
-        return 28
-    return l.index(pidname) + 11
-
-def bitstr_to_num(bitstr):
-    if not bitstr:
-        return 0
-    l = list(bitstr)
-    l.reverse()
-    return int(''.join(l), 2)
+    return ann_indices.get(pidname, 28)
+
+def bits_to_num(bits):
+    # Fields are sent LSB-first.
+    num = 0
+    for b in reversed(bits):
+        num = (num << 1) | b
+    return num
+
+def num_to_bitstr(num, numbits):
+    # Bitstring in bus order, i.e. the LSB is the left-most character.
+    return ''.join('1' if num & (1 << i) else '0' for i in range(numbits))
 
 class Decoder(srd.Decoder):
     api_version = 2
@@ -192,12 +211,17 @@ class Decoder(srd.Decoder):
     )
 
     def __init__(self):
-        self.bits = []
+        self.value = 0
         self.packet = []
         self.packet_summary = ''
         self.ss = self.es = None
         self.ss_packet = self.es_packet = None
-        self.state = 'WAIT FOR SOP'
+        self.transaction = None
+        self.ss_transaction = self.es_transaction = None
+        # CRC5 covers the token fields, CRC16 the data bytes, see USB 2.0
+        # spec, chapter 8.3.5.
+        self.crc5 = srd.crc(5, 0x05, 0x1f, True, True, 0x1f)
+        self.crc16 = srd.crc(16, 0x8005, 0xffff, True, True, 0xffff)
 
     def putpb(self, data):
         self.put(self.ss, self.es, self.out_python, data)
@@ -215,14 +239,55 @@ class Decoder(srd.Decoder):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
 
-    def handle_packet(self):
-        packet = ''
-        for (bit, ss, es) in self.bits:
-            packet += bit
+    def field(self, start, end):
+        return (self.value >> start) & ((1 << (end - start + 1)) - 1)
+
+    def puttransaction(self):
+        self.put(self.ss_transaction, self.es_transaction, self.out_python,
+                 ['TRANSACTION', self.transaction])
+        self.transaction = None
+
+    def handle_transaction(self, pidname, valid, fields):
+        category = get_category(pidname)
+        t = self.transaction
+        if pidname in ('OUT', 'IN', 'SETUP', 'PING'):
+            # A new token always ends the previous transaction. Tokens
+            # with CRC errors are ignored by the device.
+            if t:
+                self.puttransaction()
+            if valid:
+                self.transaction = [pidname, fields[0], fields[1],
+                                    None, None, None]
+                self.ss_transaction = self.ss_packet
+                self.es_transaction = self.es_packet
+        elif t is None:
+            return
+        elif category == 'DATA' and t[3] is None and valid:
+            t[3], t[4] = pidname, fields[0]
+            self.es_transaction = self.es_packet
+        elif category == 'HANDSHAKE':
+            t[5] = pidname
+            self.es_transaction = self.es_packet
+            self.puttransaction()
+        else:
+            # SOF, broken or unexpected packets: no handshake will follow.
+            self.puttransaction()
+
+    def handle_packet(self, bits, ranges):
+        numbits = len(bits)
+        if numbits < 16:
+            # Not even a SYNC and a PID field.
+            self.putp([28, ['Invalid packet: %d bits' % numbits,
+                            'Invalid', 'I']])
+            if self.transaction:
+                self.puttransaction()
+            return
+        self.value = bits_to_num(bits)
+        valid, fields = True, []
 
         # Bits[0:7]: SYNC
-        sync = packet[:7 + 1]
-        self.ss, self.es = self.bits[0][1], self.bits[7][2]
+        sync = num_to_bitstr(self.field(0, 7), 8)
+        self.ss, self.es = ranges[0][0], ranges[7][1]
         # The SYNC pattern for low-speed/full-speed is KJKJKJKK (00000001).
         if sync != '00000001':
             self.putpb(['SYNC ERROR', sync])
@@ -234,27 +299,30 @@ class Decoder(srd.Decoder):
         self.packet.append(sync)
 
         # Bits[8:15]: PID
-        pid = packet[8:15 + 1]
-        pidname = pids.get(pid, (pid, ''))[0]
-        self.ss, self.es = self.bits[8][1], self.bits[15][2]
+        pidnum = self.field(8, 15)
+        pid = num_to_bitstr(pidnum, 8)
+        pidname = pids_num.get(pidnum, (pid, ''))[0]
+        self.ss, self.es = ranges[8][0], ranges[15][1]
         self.putpb(['PID', pidname])
         self.putb([2, ['PID: %s' % pidname, pidname, pidname[0]]])
         self.packet.append(pid)
         self.packet_summary += pidname
 
         if pidname in ('OUT', 'IN', 'SOF', 'SETUP', 'PRE', 'PING'):
-            if pidname == 'SOF':
+            if numbits < 32:
+                valid = False
+            elif pidname == 'SOF':
                 # Bits[16:26]: Framenum
-                framenum = bitstr_to_num(packet[16:26 + 1])
-                self.ss, self.es = self.bits[16][1], self.bits[26][2]
+                framenum = self.field(16, 26)
+                self.ss, self.es = ranges[16][0], ranges[26][1]
                 self.putpb(['FRAMENUM', framenum])
                 self.putb([3, ['Frame: %d' % framenum, 'Frame', 'Fr', 'F']])
                 self.packet.append(framenum)
                 self.packet_summary += ' %d' % framenum
             else:
                 # Bits[16:22]: Addr
-                addr = bitstr_to_num(packet[16:22 + 1])
-                self.ss, self.es = self.bits[16][1], self.bits[22][2]
+                addr = self.field(16, 22)
+                self.ss, self.es = ranges[16][0], ranges[22][1]
                 self.putpb(['ADDR', addr])
                 self.putb([4, ['Address: %d' % addr, 'Addr: %d' % addr,
                                'Addr', 'A']])
@@ -262,47 +330,77 @@ class Decoder(srd.Decoder):
                 self.packet_summary += ' ADDR %d' % addr
 
                 # Bits[23:26]: EP
-                ep = bitstr_to_num(packet[23:26 + 1])
-                self.ss, self.es = self.bits[23][1], self.bits[26][2]
+                ep = self.field(23, 26)
+                self.ss, self.es = ranges[23][0], ranges[26][1]
                 self.putpb(['EP', ep])
                 self.putb([5, ['Endpoint: %d' % ep, 'EP: %d' % ep, 'EP', 'E']])
                 self.packet.append(ep)
                 self.packet_summary += ' EP %d' % ep
-
-            # Bits[27:31]: CRC5
-            crc5 = bitstr_to_num(packet[27:31 + 1])
-            self.ss, self.es = self.bits[27][1], self.bits[31][2]
-            self.putpb(['CRC5', crc5])
-            self.putb([6, ['CRC5: 0x%02X' % crc5, 'CRC5', 'C']])
-            self.packet.append(crc5)
+                fields = [addr, ep]
+
+            if valid:
+                # Bits[27:31]: CRC5, over bits[16:26].
+                crc5 = self.field(27, 31)
+                self.crc5.reset()
+                self.crc5.update_bits(bits[16:27])
+                valid = self.crc5.value == crc5
+                self.ss, self.es = ranges[27][0], ranges[31][1]
+                if valid:
+                    self.putpb(['CRC5', crc5])
+                    self.putb([6, ['CRC5: 0x%02X' % crc5, 'CRC5', 'C']])
+                else:
+                    self.putpb(['CRC5 ERROR', crc5])
+                    self.putb([7, ['CRC5 ERROR: 0x%02X (expected 0x%02X)' %
+                                   (crc5, self.crc5.value),
+                                   'CRC5 ERROR: 0x%02X' % crc5,
+                                   'CRC5 ERR', 'CE', 'C']])
+                self.packet.append(crc5)
         elif pidname in ('DATA0', 'DATA1', 'DATA2', 'MDATA'):
-            # Bits[16:packetlen-16]: Data
-            data = packet[16:-16]
-            # TODO: len(data) must be a multiple of 8.
-            databytes = []
-            self.packet_summary += ' ['
-            for i in range(0, len(data), 8):
-                db = bitstr_to_num(data[i:i + 8])
-                self.ss, self.es = self.bits[16 + i][1], self.bits[23 + i][2]
-                self.putpb(['DATABYTE', db])
-                self.putb([8, ['Databyte: %02X' % db, 'Data: %02X' % db,
-                               'DB: %02X' % db, '%02X' % db]])
-                databytes.append(db)
-                self.packet_summary += ' %02X' % db
-                data = data[8:]
-            self.packet_summary += ' ]'
-
-            # Convenience Python output (no annotation) for all bytes together.
-            self.ss, self.es = self.bits[16][1], self.bits[-16][2]
-            self.putpb(['DATABYTES', databytes])
-            self.packet.append(databytes)
-
-            # Bits[packetlen-16:packetlen]: CRC16
-            crc16 = bitstr_to_num(packet[-16:])
-            self.ss, self.es = self.bits[-16][1], self.bits[-1][2]
-            self.putpb(['CRC16', crc16])
-            self.putb([9, ['CRC16: 0x%04X' % crc16, 'CRC16', 'C']])
-            self.packet.append(crc16)
+            if numbits < 32:
+                valid = False
+            else:
+                # Bits[16:packetlen-16]: Data
+                # TODO: datalen must be a multiple of 8.
+                datalen = numbits - 32
+                data = self.field(16, numbits - 17)
+                data = data.to_bytes((datalen + 7) // 8, 'little')
+                databytes = list(data)
+                for (i, db) in enumerate(databytes):
+                    i *= 8
+                    self.ss = ranges[16 + i][0]
+                    self.es = ranges[min(23 + i, numbits - 17)][1]
+                    self.putpb(['DATABYTE', db])
+                    self.putb([8, ['Databyte: %02X' % db, 'Data: %02X' % db,
+                                   'DB: %02X' % db, '%02X' % db]])
+                self.packet_summary += ' [%s ]' % \
+                    ''.join(' %02X' % db for db in databytes)
+
+                # Convenience Python output (no annotation) for all bytes
+                # together.
+                self.ss, self.es = ranges[16][0], ranges[-16][1]
+                self.putpb(['DATABYTES', databytes])
+                self.packet.append(databytes)
+                fields = [databytes]
+
+                # Bits[packetlen-16:packetlen]: CRC16
+                crc16 = self.field(numbits - 16, numbits - 1)
+                self.crc16.reset()
+                if datalen % 8:
+                    self.crc16.update_bits(bits[16:-16])
+                else:
+                    self.crc16.update(data)
+                valid = self.crc16.value == crc16
+                self.ss, self.es = ranges[-16][0], ranges[-1][1]
+                if valid:
+                    self.putpb(['CRC16', crc16])
+                    self.putb([9, ['CRC16: 0x%04X' % crc16, 'CRC16', 'C']])
+                else:
+                    self.putpb(['CRC16 ERROR', crc16])
+                    self.putb([10, ['CRC16 ERROR: 0x%04X (expected 0x%04X)' %
+                                    (crc16, self.crc16.value),
+                                    'CRC16 ERROR: 0x%04X' % crc16,
+                                    'CRC16 ERR', 'CE', 'C']])
+                self.packet.append(crc16)
         elif pidname in ('ACK', 'NAK', 'STALL', 'NYET', 'ERR'):
             pass # Nothing to do, these only have SYNC+PID+EOP fields.
         else:
@@ -311,29 +409,28 @@ class Decoder(srd.Decoder):
         # Output a (summary of) the whole packet.
         pcategory, pname, pinfo = get_category(pidname), pidname, self.packet
         self.putpp(['PACKET', [pcategory, pname, pinfo]])
-        self.putp([ann_index(pidname), ['%s' % self.packet_summary]])
+        if valid:
+            self.putp([ann_index(pidname), ['%s' % self.packet_summary]])
+        else:
+            self.putp([28, ['Invalid: %s' % self.packet_summary,
+                            'Invalid', 'I']])
 
         self.packet, self.packet_summary = [], ''
 
+        self.handle_transaction(pidname, valid, fields)
+
     def decode(self, ss, es, data):
         (ptype, pdata) = data
 
-        # We only care about certain packet types for now.
-        if ptype not in ('SOP', 'BIT', 'EOP'):
+        # usb_signalling hands over whole packets, with NRZI decoding and
+        # bit-unstuffing already done. The per-bit packets aren't needed.
+        if ptype != 'PACKET':
             return
 
-        # State machine.
-        if self.state == 'WAIT FOR SOP':
-            if ptype != 'SOP':
-                return
-            self.ss_packet = ss
-            self.state = 'GET BIT'
-        elif self.state == 'GET BIT':
-            if ptype == 'BIT':
-                self.bits.append([pdata, ss, es])
-            elif ptype == 'EOP':
-                self.es_packet = es
-                self.handle_packet()
-                self.bits, self.state = [], 'WAIT FOR SOP'
-            else:
-                pass # TODO: Error
+        self.ss_packet, self.es_packet = ss, es
+        self.handle_packet(*pdata)
+
+    def end(self):
+        # A transaction may still lack its (optional) handshake.
+        if self.transaction:
+            self.puttransaction()
@@ -32,14 +32,25 @@ Packet:
  - 'SYM', <sym>
  - 'BIT', <bit>
  - 'STUFF BIT', None
+ - 'PACKET', [<bits>, <bitranges>]
  - 'EOP', None
 
 <sym>:
  - 'J', 'K', 'SE0', or 'SE1'
 
 <bit>:
- - 0 or 1
+ - '0' or '1'
  - Note: Symbols like SE0, SE1, and the J that's part of EOP don't yield 'BIT'.
+
+<bits>:
+ - List of all NRZI-decoded bits (integers 0 or 1) of a packet, from the
+   first SYNC bit up to the last bit before EOP. Stuff bits are removed.
+
+<bitranges>:
+ - List of (<ss>, <es>) tuples, one for each entry of <bits>.
+
+'PACKET' is sent once per packet, right before 'EOP'. In fast mode, only
+'SOP', 'PACKET' and 'EOP' are sent, and there are no per-bit annotations.
 '''
 
 # Low-/full-speed symbols.
@@ -92,6 +103,8 @@ class Decoder(srd.Decoder):
     options = (
         {'id': 'signalling', 'desc': 'Signalling',
             'default': 'full-speed', 'values': ('full-speed', 'low-speed')},
+        {'id': 'fast', 'desc': 'Fast mode (packets only)?', 'default': 'no',
+            'values': ('yes', 'no')},
     )
     annotations = (
         ('sym-j', 'J symbol'),
@@ -114,7 +127,10 @@ class Decoder(srd.Decoder):
         self.ss_sop = None
         self.ss_block = None
         self.samplenum = 0
-        self.syms = []
+        self.symtab = None
+        self.fast = False
+        self.packet_bits = []
+        self.packet_ranges = []
         self.bitrate = None
         self.bitwidth = None
         self.bitnum = 0
@@ -126,6 +142,10 @@ class Decoder(srd.Decoder):
     def start(self):
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        # Look up symbols by the raw sample bytes, no tuple per sample.
+        self.symtab = {bytes(pins): sym for (pins, sym) in
+                       symbols[self.options['signalling']].items()}
+        self.fast = self.options['fast'] == 'yes'
 
     def metadata(self, key, value):
         if key == srd.SRD_CONF_SAMPLERATE:
@@ -173,35 +193,44 @@ class Decoder(srd.Decoder):
         self.state = 'GET BIT'
 
     def handle_bit(self, sym, b):
-        if self.consecutive_ones == 6 and b == '0':
+        s, h = self.samplenum, self.halfbit
+        if self.consecutive_ones == 6 and b == 0:
             # Stuff bit.
-            self.putpb(['STUFF BIT', None])
-            self.putb([7, ['Stuff bit: %s' % b, 'SB: %s' % b, '%s' % b]])
-            self.putb([sym_idx[sym], ['%s' % sym]])
+            if not self.fast:
+                self.putpb(['STUFF BIT', None])
+                self.putb([7, ['Stuff bit: %d' % b, 'SB: %d' % b, '%d' % b]])
             self.consecutive_ones = 0
         else:
             # Normal bit (not a stuff bit).
-            self.putpb(['BIT', b])
-            self.putb([6, ['%s' % b]])
-            self.putb([sym_idx[sym], ['%s' % sym]])
-            if b == '1':
+            self.packet_bits.append(b)
+            self.packet_ranges.append((s - h, s + h))
+            if not self.fast:
+                self.putpb(['BIT', '%d' % b])
+                self.putb([6, ['%d' % b]])
+            if b:
                 self.consecutive_ones += 1
             else:
                 self.consecutive_ones = 0
+        if not self.fast:
+            self.putb([sym_idx[sym], ['%s' % sym]])
 
     def get_eop(self, sym):
         # EOP: SE0 for >= 1 bittime (usually 2 bittimes), then J.
-        self.syms.append(sym)
-        self.putpb(['SYM', sym])
-        self.putb([sym_idx[sym], ['%s' % sym, '%s' % sym[0]]])
+        if not self.fast:
+            self.putpb(['SYM', sym])
+            self.putb([sym_idx[sym], ['%s' % sym, '%s' % sym[0]]])
         self.bitnum += 1
         self.set_new_target_samplenum()
-        self.oldsym = sym
-        if self.syms[-2:] == ['SE0', 'J']:
+        oldsym, self.oldsym = self.oldsym, sym
+        if (oldsym, sym) == ('SE0', 'J'):
             # Got an EOP.
+            s, h = self.samplenum, self.halfbit
+            self.put(self.ss_sop, s + h, self.out_python,
+                     ['PACKET', [self.packet_bits, self.packet_ranges]])
             self.putpm(['EOP', None])
             self.putm([5, ['EOP', 'E']])
-            self.bitnum, self.syms, self.state = 0, [], 'IDLE'
+            self.bitnum, self.state = 0, 'IDLE'
+            self.packet_bits, self.packet_ranges = [], []
             self.consecutive_ones = 0
 
     def get_bit(self, sym):
@@ -211,9 +240,10 @@ class Decoder(srd.Decoder):
             self.ss_block = self.samplenum
             self.get_eop(sym)
             return
-        self.syms.append(sym)
-        self.putpb(['SYM', sym])
-        b = '0' if self.oldsym != sym else '1'
+        if not self.fast:
+            self.putpb(['SYM', sym])
+        # NRZI: a symbol change is a 0, no change is a 1.
+        b = 0 if self.oldsym != sym else 1
         self.handle_bit(sym, b)
         self.bitnum += 1
         self.set_new_target_samplenum()
@@ -226,17 +256,22 @@ class Decoder(srd.Decoder):
             # State machine.
             if self.state == 'IDLE':
                 # Ignore identical samples early on (for performance reasons).
-                if self.oldpins == pins:
-                    continue
-                self.oldpins = pins
-                sym = symbols[self.options['signalling']][tuple(pins)]
-                self.wait_for_sop(sym)
-            elif self.state in ('GET BIT', 'GET EOP'):
-                # Wait until we're in the middle of the desired bit.
-                if self.samplenum < self.samplenum_target:
-                    continue
-                sym = symbols[self.options['signalling']][tuple(pins)]
+                if self.oldpins != pins:
+                    self.oldpins = pins
+                    self.wait_for_sop(self.symtab[pins])
+            elif self.samplenum >= self.samplenum_target:
+                # We're in the middle of the desired bit.
+                sym = self.symtab[pins]
                 if self.state == 'GET BIT':
                     self.get_bit(sym)
                 elif self.state == 'GET EOP':
                     self.get_eop(sym)
+                    # Back to idle: compare against the J that ended EOP.
+                    self.oldpins = pins
+
+            # Nothing happens until the lines change, or until the middle
+            # of the next bit.
+            if self.state == 'IDLE':
+                data.skip()
+            else:
+                data.skip(self.samplenum_target)
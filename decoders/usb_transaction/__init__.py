@@ -0,0 +1,45 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+'''
+This decoder stacks on top of the 'usb_packet' PD and reassembles USB
+(low-speed and full-speed) transactions into transfers.
+
+Transfer layer (USB spec, chapters 5 and 8.5):
+
+Control transfers start with a SETUP transaction, followed by an optional
+data stage (IN or OUT transactions, as given by bit 7 of bmRequestType) and
+a status stage (a zero-length transaction in the other direction).
+
+Bulk and interrupt transfers consist of data transactions in one direction.
+A transfer ends with a packet shorter than the maximum packet size of the
+endpoint (possibly a zero-length packet).
+
+Transfers are tracked per device address and endpoint, and only ACKed data
+is part of a transfer. Polling that the device NAKs, and the SOF packets
+the host sends every frame, are collapsed into a single annotation per run.
+
+Memory use is bounded: at most 'max_size' payload bytes are kept per
+transfer, longer transfers are truncated (the full length is still
+reported).
+
+Details:
+http://www.usb.org/developers/docs/
+'''
+
+from .pd import Decoder
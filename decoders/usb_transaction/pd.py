@@ -0,0 +1,324 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+##
+
+
+import sigrokdecode as srd
+
+'''
+OUTPUT_PYTHON format:
+
+Packet:
+[<ptype>, <pdata>]
+
+<ptype>, <pdata>:
+ - 'TRANSFER',
+   [<addr>, <ep>, <kind>, <direction>, <setup>, <payload>, <length>, <status>]
+ - 'NAKS', [<addr>, <ep>, <direction>, <count>]
+ - 'SOFS', [<first framenum>, <last framenum>, <count>]
+
+<addr>: Device address, 0-127.
+<ep>: Endpoint number, 0-15.
+<kind>: 'CONTROL', or 'DATA' for bulk, interrupt and isochronous transfers.
+<direction>: 'IN' or 'OUT'. For control transfers, this is the direction
+  given in the SETUP packet (bit 7 of bmRequestType).
+<setup>: The 8 bytes of the SETUP packet (bytes), or None.
+<payload>: The transferred data (bytes), at most 'max_size' bytes.
+<length>: The total number of data bytes, can be more than len(<payload>).
+<status>: 'ACK' for completed transfers, 'STALL', or None if the transfer
+  was cut off (by a new SETUP, or the end of the capture) or isochronous.
+<count>: The number of NAKed transactions, or SOF packets, in a row.
+
+'NAKS' is sent once the endpoint's next non-NAKed transaction comes along,
+'SOFS' once any transaction other than a NAKed one comes along.
+
+A bulk or interrupt transfer ends with a packet shorter than the endpoint's
+max. packet size. The decoder takes that size from the endpoint descriptors
+when it sees a GET_DESCRIPTOR (configuration) request. For endpoints without
+a descriptor in the capture it uses the 'max_packet_size' option (or the
+largest packet seen, if that's larger). Set the option to the real size,
+e.g. 8 for low-speed interrupt endpoints, if the capture doesn't start with
+the enumeration. Otherwise such transfers get split or merged wrongly.
+'''
+
+class Transfer:
+    def __init__(self, kind, addr, ep, direction, ss):
+        self.kind, self.addr, self.ep = kind, addr, ep
+        self.direction = direction
+        self.setup = None
+        self.payload = bytearray()
+        self.length = 0
+        self.status = None
+        self.ss = self.es = ss
+        # Control transfers only.
+        self.data_dir = self.status_dir = None
+
+class Decoder(srd.Decoder):
+    api_version = 2
+    id = 'usb_transaction'
+    name = 'USB transaction'
+    longname = 'Universal Serial Bus (LS/FS) transaction'
+    desc = 'USB (low-speed and full-speed) transactions and transfers.'
+    license = 'gplv2+'
+    inputs = ['usb_packet']
+    outputs = ['usb_transaction']
+    options = (
+        {'id': 'max_packet_size',
+            'desc': 'Max. packet size without descriptor (bytes)',
+            'default': 64},
+        {'id': 'max_size', 'desc': 'Max. payload kept per transfer (bytes)',
+            'default': 65536},
+    )
+    annotations = (
+        ('control', 'Control transfer'),
+        ('in', 'IN transfer'),
+        ('out', 'OUT transfer'),
+        ('stall', 'Stalled transfer'),
+        ('nak', 'NAKed transactions'),
+        ('sof', 'SOF packets'),
+        ('warnings', 'Warnings'),
+    )
+    annotation_rows = (
+        ('transfers', 'Transfers', (0, 1, 2, 3)),
+        ('naks', 'NAKs', (4,)),
+        ('sofs', 'SOFs', (5,)),
+        ('warnings', 'Warnings', (6,)),
+    )
+    binary = (
+        ('setup', 'SETUP packets'),
+        ('data-in', 'IN payload'),
+        ('data-out', 'OUT payload'),
+    )
+
+    def __init__(self):
+        # Transfers in progress. Control transfers are keyed by (addr, ep),
+        # all others by (addr, ep, direction).
+        self.transfers = {}
+        # Largest packet seen per (addr, ep, direction).
+        self.largest = {}
+        # wMaxPacketSize from the endpoint descriptors, per
+        # (addr, ep, direction).
+        self.ep_max_packet_size = {}
+        # Runs of NAKed transactions per (addr, ep, direction), as
+        # [count, ss, es], and the current run of SOF packets, as
+        # [count, ss, es, first framenum, last framenum].
+        self.naks = {}
+        self.sofs = None
+
+    def start(self):
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+        self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_bin = self.register(srd.OUTPUT_BINARY)
+        self.max_packet_size = self.options['max_packet_size']
+        self.max_size = self.options['max_size']
+
+    def put_transfer(self, t):
+        payload = bytes(t.payload)
+        self.put(t.ss, t.es, self.out_python, ['TRANSFER', [t.addr, t.ep,
+                 t.kind, t.direction, t.setup, payload, t.length, t.status]])
+
+        status = t.status or 'incomplete'
+        if t.kind == 'CONTROL':
+            setup = ' '.join('%02X' % b for b in t.setup)
+            ann = [0, ['Addr %d EP %d: SETUP %s, %d bytes %s, %s' %
+                       (t.addr, t.ep, setup, t.length, t.direction, status),
+                       'SETUP %s, %d bytes' % (setup, t.length),
+                       'Control', 'C']]
+            direction = t.data_dir
+        else:
+            ann = [1 if t.direction == 'IN' else 2,
+                   ['Addr %d EP %d %s: %d bytes, %s' %
+                    (t.addr, t.ep, t.direction, t.length, status),
+                    '%s: %d bytes' % (t.direction, t.length),
+                    t.direction, t.direction[0]]]
+            direction = t.direction
+        if t.status == 'STALL':
+            ann[0] = 3
+        self.put(t.ss, t.es, self.out_ann, ann)
+
+        if payload:
+            self.put(t.ss, t.es, self.out_bin,
+                     (1 if direction == 'IN' else 2, payload))
+        if t.length > len(payload):
+            self.put(t.ss, t.es, self.out_ann,
+                     [6, ['Payload truncated: %d of %d bytes kept' %
+                          (len(payload), t.length), 'Truncated', 'T']])
+
+    def put_naks(self, key):
+        count, ss, es = self.naks.pop(key)
+        addr, ep, direction = key
+        self.put(ss, es, self.out_python,
+                 ['NAKS', [addr, ep, direction, count]])
+        self.put(ss, es, self.out_ann,
+                 [4, ['Addr %d EP %d %s: %d NAKs' % (addr, ep, direction,
+                      count), '%d NAKs' % count, 'NAK', 'N']])
+
+    def put_sofs(self):
+        count, ss, es, first, last = self.sofs
+        self.sofs = None
+        self.put(ss, es, self.out_python, ['SOFS', [first, last, count]])
+        self.put(ss, es, self.out_ann,
+                 [5, ['%d SOFs (frames %d-%d)' % (count, first, last),
+                      '%d SOFs' % count, 'SOF', 'S']])
+
+    def handle_sof(self, ss, es, framenum):
+        if self.sofs is None:
+            self.sofs = [0, ss, es, framenum, framenum]
+        s = self.sofs
+        s[0] += 1
+        s[2], s[4] = es, framenum
+
+    def append(self, t, es, databytes):
+        room = self.max_size - len(t.payload)
+        if room > 0:
+            t.payload.extend(databytes[:room])
+        t.length += len(databytes)
+        t.es = es
+
+    def handle_setup(self, ss, es, addr, ep, databytes, handshake):
+        key = (addr, ep)
+        t = self.transfers.pop(key, None)
+        if t:
+            # A new SETUP aborts any control transfer in progress.
+            self.put_transfer(t)
+        if handshake != 'ACK' or not databytes or len(databytes) != 8:
+            return
+
+        setup = bytes(databytes)
+        t = Transfer('CONTROL', addr, ep, 'IN' if setup[0] & 0x80 else 'OUT',
+                     ss)
+        t.setup, t.es = setup, es
+        # Without data stage (wLength == 0), the status stage is IN.
+        if setup[6] | (setup[7] << 8):
+            t.data_dir = t.direction
+        t.status_dir = 'OUT' if t.data_dir == 'IN' else 'IN'
+        self.transfers[key] = t
+        self.put(ss, es, self.out_bin, (0, setup))
+
+    def handle_control(self, t, es, token, databytes, handshake):
+        if handshake == 'STALL':
+            t.status = 'STALL'
+        elif handshake != 'ACK':
+            return
+        elif token == t.data_dir:
+            self.append(t, es, databytes or [])
+            return
+        elif token == t.status_dir:
+            t.status = 'ACK'
+        else:
+            return
+        t.es = es
+        del self.transfers[(t.addr, t.ep)]
+        if t.status == 'ACK':
+            self.handle_descriptors(t)
+        self.put_transfer(t)
+
+    def handle_descriptors(self, t):
+        # Only GET_DESCRIPTOR (configuration) has endpoint descriptors.
+        if t.setup[0] != 0x80 or t.setup[1] != 6 or t.setup[3] != 2:
+            return
+        d = t.payload
+        i = 0
+        while i + 1 < len(d) and d[i] >= 2:
+            length, dtype = d[i], d[i + 1]
+            if dtype == 5 and length >= 7 and i + 6 <= len(d):
+                ep = d[i + 2]
+                size = (d[i + 4] | (d[i + 5] << 8)) & 0x7ff
+                key = (t.addr, ep & 0x0f, 'IN' if ep & 0x80 else 'OUT')
+                if size:
+                    self.ep_max_packet_size[key] = size
+            i += length
+
+    def handle_data(self, ss, es, key, databytes, handshake):
+        t = self.transfers.get(key)
+        if handshake == 'STALL':
+            if t is None:
+                t = Transfer('DATA', key[0], key[1], key[2], ss)
+            else:
+                del self.transfers[key]
+            t.status, t.es = 'STALL', es
+            self.put_transfer(t)
+            return
+        if databytes is None or handshake not in ('ACK', None):
+            return
+
+        if t is None:
+            t = self.transfers[key] = Transfer('DATA', key[0], key[1],
+                                               key[2], ss)
+        self.append(t, es, databytes)
+
+        # A packet shorter than the max. packet size ends the transfer.
+        n = len(databytes)
+        largest = max(self.largest.get(key, 0), n)
+        self.largest[key] = largest
+        max_packet_size = self.ep_max_packet_size.get(key)
+        if max_packet_size is None:
+            max_packet_size = max(self.max_packet_size, largest)
+        if n < max_packet_size:
+            t.status = handshake
+            del self.transfers[key]
+            self.put_transfer(t)
+
+    def decode(self, ss, es, data):
+        ptype, pdata = data
+
+        if ptype == 'PACKET':
+            # Only SOFs are needed, everything else comes as transactions.
+            pcategory, pname, pinfo = pdata
+            if pname == 'SOF' and len(pinfo) > 2:
+                self.handle_sof(ss, es, pinfo[2])
+            return
+        if ptype != 'TRANSACTION':
+            return
+
+        token, addr, ep, datapid, databytes, handshake = pdata
+        if token not in ('SETUP', 'IN', 'OUT'):
+            return
+        direction = 'OUT' if token == 'SETUP' else token
+        key = (addr, ep, direction)
+
+        # Polling that the device NAKs is only counted.
+        if handshake == 'NAK':
+            n = self.naks.get(key)
+            if n is None:
+                self.naks[key] = [1, ss, es]
+            else:
+                n[0] += 1
+                n[2] = es
+            return
+        if key in self.naks:
+            self.put_naks(key)
+        if self.sofs:
+            self.put_sofs()
+
+        if token == 'SETUP':
+            self.handle_setup(ss, es, addr, ep, databytes, handshake)
+            return
+        t = self.transfers.get((addr, ep))
+        if t:
+            self.handle_control(t, es, token, databytes, handshake)
+        else:
+            self.handle_data(ss, es, key, databytes, handshake)
+
+    def end(self):
+        for key in list(self.naks):
+            self.put_naks(key)
+        if self.sofs:
+            self.put_sofs()
+        for t in self.transfers.values():
+            self.put_transfer(t)
+        self.transfers = {}
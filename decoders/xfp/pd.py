@@ -209,6 +209,8 @@ class Decoder(srd.Decoder):
         self.cnt = -1
         # Start/end sample numbers per data item
         self.sn = []
+        # Received data
+        self.mem = []
         # Multi-byte structure buffer
         self.buf = []
         # Filled in by address 0x7f in low memory
@@ -269,6 +271,10 @@ class Decoder(srd.Decoder):
             223: self.ignore,
             255: self.maybe_ascii,
         }
+        # All handlers in the order of their fields, and the next one to run
+        self.fields = sorted(self.MAP_LOWER_MEMORY.items()) + \
+            sorted(self.MAP_HIGH_TABLE_1.items())
+        self.field = 0
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
@@ -276,23 +282,33 @@ class Decoder(srd.Decoder):
     def decode(self, ss, es, data):
         cmd, data = data
 
-        # We only care about actual data bytes that are read (for now).
-        if cmd != 'DATA READ':
+        # Only whole I²C transactions (START to STOP) are used, and only
+        # the data bytes that are read (for now).
+        if cmd != 'TRANSACTION':
             return
 
-        self.cnt += 1
-        self.sn.append([ss, es])
-
-        self.buf.append(data)
-        if self.cnt < 0x80:
-            if self.cnt in self.MAP_LOWER_MEMORY:
-                self.MAP_LOWER_MEMORY[self.cnt](self.buf)
-                self.buf.clear()
-        elif self.cnt < 0x0100 and self.cur_highmem_page == 0x01:
-            # Serial ID memory map
-            if self.cnt in self.MAP_HIGH_TABLE_1:
-                self.MAP_HIGH_TABLE_1[self.cnt](self.buf)
-                self.buf.clear()
+        for addr, rw, databytes, acks, ranges, bits in data:
+            if rw == 'READ' and databytes:
+                self.handle_data(databytes, ranges[1:])
+
+    def handle_data(self, databytes, ranges):
+        # Nothing beyond the lower memory and one upper page is decoded.
+        n = 0x100 - len(self.mem)
+        self.mem.extend(databytes[:n])
+        self.sn.extend(ranges[:n])
+
+        # Feed each field handler its bytes, once all of them are available.
+        while self.field < len(self.fields):
+            end, handler = self.fields[self.field]
+            if end >= len(self.mem):
+                break
+            if end >= 0x80 and self.cur_highmem_page != 0x01:
+                # Only the serial ID memory map (table 1) is supported.
+                break
+            self.buf = self.mem[self.cnt + 1:end + 1]
+            self.cnt = end
+            handler(self.buf)
+            self.field += 1
 
     # Annotation helper
     def annotate(self, key, value, start_cnt=None, end_cnt=None):
@@ -373,7 +389,7 @@ class Decoder(srd.Decoder):
                     self.annotate(name, self.to_power(value),
                             cnt_idx + idx, cnt_idx + idx + 1)
                 else:
-                    self.annotate(name, "%d" % name, value, cnt_idx + idx,
+                    self.annotate(name, "%d" % value, cnt_idx + idx,
                             cnt_idx + idx + 1)
             idx += 2
 
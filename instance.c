@@ -298,7 +298,8 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
  * @param sess The session holding the protocol decoder instance.
  * @param decoder_id Decoder 'id' field.
  * @param options GHashtable of options which override the defaults set in
- *                the decoder class. May be NULL.
+ *                the decoder class. May be NULL, in which case all options
+ *                get their default values.
  *
  * @return Pointer to a newly allocated struct srd_decoder_inst, or
  *         NULL in case of failure.
@@ -308,9 +309,10 @@ SRD_API int srd_inst_channel_set_all(struct srd_decoder_inst *di,
 SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 		const char *decoder_id, GHashTable *options)
 {
-	int i;
+	int i, ret;
 	struct srd_decoder *dec;
 	struct srd_decoder_inst *di;
+	GHashTable *defaults;
 	char *inst_id;
 
 	srd_dbg("Creating new %s instance.", decoder_id);
@@ -377,7 +379,19 @@ SRD_API struct srd_decoder_inst *srd_inst_new(struct srd_session *sess,
 		return NULL;
 	}
 
-	if (options && srd_inst_option_set(di, options) != SRD_OK) {
+	/*
+	 * Without any options given, the instance still needs its own
+	 * 'options' dict, holding the default values. Otherwise it only
+	 * sees the class' 'options' tuple.
+	 */
+	if (options) {
+		ret = srd_inst_option_set(di, options);
+	} else {
+		defaults = g_hash_table_new(g_str_hash, g_str_equal);
+		ret = srd_inst_option_set(di, defaults);
+		g_hash_table_destroy(defaults);
+	}
+	if (ret != SRD_OK) {
 		g_free(di->dec_channelmap);
 		g_free(di);
 		return NULL;
@@ -550,6 +564,39 @@ SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di)
 	return SRD_OK;
 }
 
+/** @private */
+SRD_PRIV int srd_inst_end(struct srd_decoder_inst *di)
+{
+	PyObject *py_res;
+	GSList *l;
+	struct srd_decoder_inst *next_di;
+	int ret;
+
+	/* The end() method is optional. */
+	if (PyObject_HasAttrString(di->py_inst, "end")) {
+		srd_dbg("Calling end() method on protocol decoder instance %s.",
+				di->inst_id);
+		if (!(py_res = PyObject_CallMethod(di->py_inst, "end", NULL))) {
+			srd_exception_catch("Protocol decoder instance %s: ",
+					di->inst_id);
+			return SRD_ERR_PYTHON;
+		}
+		Py_DecRef(py_res);
+	}
+
+	/*
+	 * End all the PDs stacked on top of this one. This has to happen
+	 * afterwards, since this PD's end() may have sent them more data.
+	 */
+	for (l = di->next_di; l; l = l->next) {
+		next_di = l->data;
+		if ((ret = srd_inst_end(next_di)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
 /**
  * Run the specified decoder function.
  *
@@ -596,19 +643,33 @@ SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 	 * Create new srd_logic object. Each iteration around the PD's loop
 	 * will fill one sample into this object.
 	 */
-	logic = PyObject_New(srd_logic, &srd_logic_type);
-	Py_INCREF(logic);
+	if (!(logic = PyObject_New(srd_logic, &srd_logic_type))) {
+		srd_exception_catch("Protocol decoder instance %s: ",
+				di->inst_id);
+		return SRD_ERR_PYTHON;
+	}
 	logic->di = (struct srd_decoder_inst *)di;
 	logic->start_samplenum = start_samplenum;
 	logic->itercnt = 0;
 	logic->inbuf = (uint8_t *)inbuf;
 	logic->inbuflen = inbuflen;
-	logic->sample = PyList_New(2);
-	Py_INCREF(logic->sample);
+	if (!(logic->sample = PyList_New(2))) {
+		Py_DECREF(logic);
+		srd_exception_catch("Protocol decoder instance %s: ",
+				di->inst_id);
+		return SRD_ERR_PYTHON;
+	}
+
+	py_res = PyObject_CallMethod(di->py_inst, "decode", "KKO",
+			start_samplenum, end_samplenum, logic);
+
+	/*
+	 * The logic object (and its sample list) only lives for the duration
+	 * of this call, unless the PD kept a reference to it.
+	 */
+	Py_DECREF(logic);
 
-	Py_IncRef(di->py_inst);
-	if (!(py_res = PyObject_CallMethod(di->py_inst, "decode",
-			"KKO", start_samplenum, end_samplenum, logic))) {
+	if (!py_res) {
 		srd_exception_catch("Protocol decoder instance %s: ",
 				di->inst_id);
 		return SRD_ERR_PYTHON;
@@ -660,6 +721,9 @@ SRD_PRIV void srd_inst_free_all(struct srd_session *sess, GSList *stack)
 	if (!stack) {
 		g_slist_free(sess->di_list);
 		sess->di_list = NULL;
+		srd_ann_store_reset(sess);
+		/* Sample data held back for the freed instances is useless. */
+		sess->stats.bytes_buffered = 0;
 	}
 }
 
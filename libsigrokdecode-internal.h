@@ -37,6 +37,20 @@ typedef struct {
 	PyObject *sample;
 } srd_logic;
 
+struct srd_ann_store {
+	/* Number of samples per bucket on the lowest summary level. */
+	uint64_t bucket_size;
+
+	/* Annotation rows, keyed by decoder instance. */
+	GHashTable *instances;
+
+	/* Interned annotation texts (char **), indexed by text ID. */
+	GPtrArray *texts;
+
+	/* Text IDs (+1), keyed by the joined annotation texts. */
+	GHashTable *text_ids;
+};
+
 struct srd_session {
 	int session_id;
 
@@ -45,6 +59,19 @@ struct srd_session {
 
 	/* List of frontend callbacks to receive decoder output. */
 	GSList *callbacks;
+
+	/* Annotation store, NULL unless enabled by the frontend. */
+	struct srd_ann_store *ann_store;
+
+	/* Statistics, and the chunking policy of srd_session_send(). */
+	struct srd_session_stats stats;
+
+	/* Sample data held back for coalescing (chunk_min_bytes large). */
+	uint8_t *chunk_buf;
+	int chunk_unitsize;
+	uint64_t chunk_start_samplenum;
+	/* Difference between the frontend's end_samplenum and start + length. */
+	uint64_t chunk_end_offset;
 };
 
 /* srd.c */
@@ -55,10 +82,18 @@ SRD_PRIV int session_is_valid(struct srd_session *sess);
 SRD_PRIV struct srd_pd_callback *srd_pd_output_callback_find(struct srd_session *sess,
 		int output_type);
 
+/* annstore.c */
+SRD_PRIV int srd_ann_store_add(struct srd_decoder_inst *di,
+		uint64_t start_sample, uint64_t end_sample, int ann_class,
+		char **ann_text);
+SRD_PRIV void srd_ann_store_reset(struct srd_session *sess);
+SRD_PRIV void srd_ann_store_free(struct srd_ann_store *store);
+
 /* instance.c */
 SRD_PRIV struct srd_decoder_inst *srd_inst_find_by_obj( const GSList *stack,
 		const PyObject *obj);
 SRD_PRIV int srd_inst_start(struct srd_decoder_inst *di);
+SRD_PRIV int srd_inst_end(struct srd_decoder_inst *di);
 SRD_PRIV int srd_inst_decode(const struct srd_decoder_inst *di,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen);
@@ -134,6 +134,11 @@ enum srd_output_type {
 
 enum srd_configkey {
 	SRD_CONF_SAMPLERATE = 10000,
+	/**
+	 * Maximum number of samples a decoder should hold back output for,
+	 * e.g. when waiting for the end of a frame. 0 means no limit.
+	 */
+	SRD_CONF_LATENCY,
 };
 
 struct srd_decoder {
@@ -266,6 +271,44 @@ struct srd_pd_callback {
 	void *cb_data;
 };
 
+/** Statistics and chunking policy of a decoding session. */
+struct srd_session_stats {
+	/** Number of srd_session_send() calls. */
+	uint64_t chunks_received;
+	/** Number of bytes received via srd_session_send(). */
+	uint64_t bytes_received;
+	/** Number of chunks passed to the decoder instances. */
+	uint64_t chunks_decoded;
+	/** Number of bytes passed to the decoder instances. */
+	uint64_t bytes_decoded;
+	/** Number of bytes currently held back for coalescing. */
+	uint64_t bytes_buffered;
+	/** Chunks smaller than this are coalesced (0 = disabled). */
+	uint64_t chunk_min_bytes;
+	/** Chunks larger than this are split (0 = disabled). */
+	uint64_t chunk_max_bytes;
+};
+
+/** Number of zoom levels in the annotation store's count summary. */
+#define SRD_ANN_STORE_LEVELS 16
+
+/** One annotation row of a session's annotation store, in columnar form. */
+struct srd_ann_store_row {
+	/** Number of annotations in this row. */
+	uint64_t num_anns;
+	/** Start samples of the annotations, in ascending order. */
+	const uint64_t *start_sample;
+	/** End samples of the annotations. */
+	const uint64_t *end_sample;
+	/** Annotation classes of the annotations. */
+	const int *ann_class;
+	/** Text IDs of the annotations, see srd_ann_store_text_get(). */
+	const uint32_t *text_id;
+};
+
+typedef void (*srd_ann_store_callback)(const struct srd_ann_store_row *row,
+					uint64_t index, void *cb_data);
+
 /* srd.c */
 SRD_API int srd_init(const char *path);
 SRD_API int srd_exit(void);
@@ -278,10 +321,31 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 SRD_API int srd_session_send(struct srd_session *sess,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen);
+SRD_API int srd_session_chunking_set(struct srd_session *sess,
+		uint64_t min_bytes, uint64_t max_bytes);
+SRD_API int srd_session_stats_get(struct srd_session *sess,
+		struct srd_session_stats *stats);
+SRD_API int srd_session_terminate(struct srd_session *sess);
 SRD_API int srd_session_destroy(struct srd_session *sess);
 SRD_API int srd_pd_output_callback_add(struct srd_session *sess,
 		int output_type, srd_pd_output_callback cb, void *cb_data);
 
+/* annstore.c */
+SRD_API int srd_ann_store_enable(struct srd_session *sess, uint64_t bucket_size);
+SRD_API int srd_ann_store_row_get(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row,
+		struct srd_ann_store_row *row);
+SRD_API int srd_ann_store_query(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row,
+		uint64_t start_sample, uint64_t end_sample,
+		srd_ann_store_callback cb, void *cb_data);
+SRD_API char **srd_ann_store_text_get(struct srd_session *sess,
+		uint32_t text_id);
+SRD_API int srd_ann_store_summary_get(struct srd_session *sess,
+		const struct srd_decoder_inst *di, int ann_row, int level,
+		uint64_t *num_buckets, const uint64_t **buckets,
+		const uint32_t **counts);
+
 /* decoder.c */
 SRD_API const GSList *srd_decoder_list(void);
 SRD_API struct srd_decoder *srd_decoder_get_by_id(const char *id);
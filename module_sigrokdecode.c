@@ -29,6 +29,9 @@ extern SRD_PRIV PyTypeObject srd_Decoder_type;
 /* type_logic.c */
 extern SRD_PRIV PyTypeObject srd_logic_type;
 
+/* type_crc.c */
+extern SRD_PRIV PyTypeObject srd_crc_type;
+
 /*
  * When initialized, a reference to this module inside the Python interpreter
  * lives here.
@@ -58,6 +61,10 @@ PyMODINIT_FUNC PyInit_sigrokdecode(void)
 	if (PyType_Ready(&srd_logic_type) < 0)
 		return NULL;
 
+	srd_crc_type.tp_new = PyType_GenericNew;
+	if (PyType_Ready(&srd_crc_type) < 0)
+		return NULL;
+
 	mod = PyModule_Create(&sigrokdecode_module);
 	Py_INCREF(&srd_Decoder_type);
 	if (PyModule_AddObject(mod, "Decoder",
@@ -67,6 +74,10 @@ PyMODINIT_FUNC PyInit_sigrokdecode(void)
 	if (PyModule_AddObject(mod, "srd_logic",
 	    (PyObject *)&srd_logic_type) == -1)
 		return NULL;
+	Py_INCREF(&srd_crc_type);
+	if (PyModule_AddObject(mod, "crc",
+	    (PyObject *)&srd_crc_type) == -1)
+		return NULL;
 
 	/* Expose output types as symbols in the sigrokdecode module */
 	if (PyModule_AddIntConstant(mod, "OUTPUT_ANN", SRD_OUTPUT_ANN) == -1)
@@ -80,6 +91,8 @@ PyMODINIT_FUNC PyInit_sigrokdecode(void)
 	/* Expose meta input symbols. */
 	if (PyModule_AddIntConstant(mod, "SRD_CONF_SAMPLERATE", SRD_CONF_SAMPLERATE) == -1)
 		return NULL;
+	if (PyModule_AddIntConstant(mod, "SRD_CONF_LATENCY", SRD_CONF_LATENCY) == -1)
+		return NULL;
 
 	mod_sigrokdecode = mod;
 
@@ -22,6 +22,7 @@
 #include "libsigrokdecode.h"
 #include "config.h"
 #include <inttypes.h>
+#include <string.h>
 #include <glib.h>
 
 /**
@@ -80,6 +81,9 @@ SRD_API int srd_session_new(struct srd_session **sess)
 		return SRD_ERR_MALLOC;
 	(*sess)->session_id = ++max_session_id;
 	(*sess)->di_list = (*sess)->callbacks = NULL;
+	(*sess)->ann_store = NULL;
+	memset(&(*sess)->stats, 0, sizeof(struct srd_session_stats));
+	(*sess)->chunk_buf = NULL;
 
 	/* Keep a list of all sessions, so we can clean up as needed. */
 	sessions = g_slist_append(sessions, *sess);
@@ -130,8 +134,8 @@ static int srd_inst_send_meta(struct srd_decoder_inst *di, int key,
 {
 	PyObject *py_ret;
 
-	if (key != SRD_CONF_SAMPLERATE)
-		/* This is the only key we pass on to the decoder for now. */
+	if (key != SRD_CONF_SAMPLERATE && key != SRD_CONF_LATENCY)
+		/* These are the only keys we pass on to the decoder for now. */
 		return SRD_OK;
 
 	if (!PyObject_HasAttrString(di->py_inst, "metadata"))
@@ -139,8 +143,7 @@ static int srd_inst_send_meta(struct srd_decoder_inst *di, int key,
 		return SRD_OK;
 
 	py_ret = PyObject_CallMethod(di->py_inst, "metadata", "lK",
-			(long)SRD_CONF_SAMPLERATE,
-			(unsigned long long)g_variant_get_uint64(data));
+			(long)key, (unsigned long long)g_variant_get_uint64(data));
 	Py_XDECREF(py_ret);
 
 	return SRD_OK;
@@ -180,9 +183,9 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 		return SRD_ERR_ARG;
 	}
 
-	/* Hardcoded to samplerate/uint64 for now. */
+	/* Hardcoded to samplerate/latency, both uint64, for now. */
 
-	if (key != SRD_CONF_SAMPLERATE) {
+	if (key != SRD_CONF_SAMPLERATE && key != SRD_CONF_LATENCY) {
 		srd_err("Unknown config key %d.", key);
 		return SRD_ERR_ARG;
 	}
@@ -192,8 +195,9 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 		return SRD_ERR_ARG;
 	}
 
-	srd_dbg("Setting session %d samplerate to %"PRIu64".",
-			sess->session_id, g_variant_get_uint64(data));
+	srd_dbg("Setting session %d %s to %"PRIu64".", sess->session_id,
+			key == SRD_CONF_SAMPLERATE ? "samplerate" : "latency",
+			g_variant_get_uint64(data));
 
 	ret = SRD_OK;
 	for (l = sess->di_list; l; l = l->next) {
@@ -206,6 +210,180 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
 	return ret;
 }
 
+/* Pass one chunk of sample data to all decoder instances. */
+static int session_decode(struct srd_session *sess,
+		uint64_t start_samplenum, uint64_t end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen)
+{
+	GSList *d;
+	int ret;
+
+	sess->stats.chunks_decoded++;
+	sess->stats.bytes_decoded += inbuflen;
+
+	for (d = sess->di_list; d; d = d->next) {
+		if ((ret = srd_inst_decode(d->data, start_samplenum,
+				end_samplenum, inbuf, inbuflen)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+/*
+ * Pass sample data to all decoder instances, split into chunks of at most
+ * chunk_max_bytes. The sample numbers of every chunk are derived from the
+ * chunk's position, using the same end_samplenum convention the frontend
+ * used (i.e. end_offset = end_samplenum - start_samplenum - num_samples).
+ */
+static int session_decode_split(struct srd_session *sess,
+		uint64_t start_samplenum, uint64_t end_offset, int unitsize,
+		const uint8_t *inbuf, uint64_t inbuflen)
+{
+	uint64_t max_bytes, len, offset, samplenum;
+	int ret;
+
+	max_bytes = sess->stats.chunk_max_bytes;
+	if (max_bytes) {
+		/* Never split a sample. */
+		max_bytes -= max_bytes % unitsize;
+		if (max_bytes == 0)
+			max_bytes = unitsize;
+	}
+
+	for (offset = 0; offset < inbuflen; offset += len) {
+		len = inbuflen - offset;
+		if (max_bytes && len > max_bytes)
+			len = max_bytes;
+		samplenum = start_samplenum + offset / unitsize;
+		if ((ret = session_decode(sess, samplenum,
+				samplenum + len / unitsize + end_offset,
+				inbuf + offset, len)) != SRD_OK)
+			return ret;
+	}
+
+	return SRD_OK;
+}
+
+/* Pass the sample data held back for coalescing to the decoders. */
+static int session_chunk_flush(struct srd_session *sess)
+{
+	uint64_t len;
+
+	if (!(len = sess->stats.bytes_buffered))
+		return SRD_OK;
+	sess->stats.bytes_buffered = 0;
+
+	return session_decode_split(sess, sess->chunk_start_samplenum,
+			sess->chunk_end_offset, sess->chunk_unitsize,
+			sess->chunk_buf, len);
+}
+
+/*
+ * Return the size of one sample, as used by all decoder instances which
+ * take data from the frontend, or 0 if they don't agree on one.
+ */
+static int session_unitsize(struct srd_session *sess)
+{
+	GSList *d;
+	struct srd_decoder_inst *di;
+	int unitsize;
+
+	unitsize = 0;
+	for (d = sess->di_list; d; d = d->next) {
+		di = d->data;
+		if (unitsize && di->data_unitsize != unitsize)
+			return 0;
+		unitsize = di->data_unitsize;
+	}
+
+	return unitsize;
+}
+
+/**
+ * Set the chunking policy of a session.
+ *
+ * Passing every tiny chunk of sample data to the decoders has a fixed
+ * per-chunk overhead, while huge chunks are bad for cache locality. With a
+ * chunking policy, srd_session_send() coalesces consecutive chunks smaller
+ * than min_bytes into one, and splits chunks larger than max_bytes into
+ * several. The sample numbers seen by the decoders stay exactly the same.
+ *
+ * Coalesced data is held back until enough of it has been sent, the
+ * policy is changed, or the session is terminated via
+ * srd_session_terminate(). Chunks are never split within a sample.
+ *
+ * @param sess The session to configure.
+ * @param min_bytes Coalesce chunks smaller than this. 0 disables coalescing.
+ * @param max_bytes Split chunks larger than this. 0 disables splitting.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_session_chunking_set(struct srd_session *sess,
+		uint64_t min_bytes, uint64_t max_bytes)
+{
+	uint8_t *buf;
+	int ret;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (min_bytes && max_bytes && max_bytes < min_bytes) {
+		srd_err("Maximum chunk size must not be below the minimum.");
+		return SRD_ERR_ARG;
+	}
+
+	/* Don't lose data coalesced under the old policy. */
+	if ((ret = session_chunk_flush(sess)) != SRD_OK)
+		return ret;
+
+	buf = NULL;
+	if (min_bytes && !(buf = g_try_malloc(min_bytes))) {
+		srd_err("Failed to g_malloc() chunk buffer.");
+		return SRD_ERR_MALLOC;
+	}
+	g_free(sess->chunk_buf);
+	sess->chunk_buf = buf;
+	sess->stats.chunk_min_bytes = min_bytes;
+	sess->stats.chunk_max_bytes = max_bytes;
+
+	srd_dbg("Session %d chunking: min %" PRIu64 " bytes, max %" PRIu64
+			" bytes.", sess->session_id, min_bytes, max_bytes);
+
+	return SRD_OK;
+}
+
+/**
+ * Get the statistics of a session.
+ *
+ * @param sess The session.
+ * @param stats Pointer to a struct which will be filled in. This includes
+ *              the chunking policy set via srd_session_chunking_set().
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_session_stats_get(struct srd_session *sess,
+		struct srd_session_stats *stats)
+{
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	if (!stats)
+		return SRD_ERR_ARG;
+
+	*stats = sess->stats;
+
+	return SRD_OK;
+}
+
 /**
  * Send a chunk of logic sample data to a running decoder session.
  *
@@ -217,6 +395,9 @@ SRD_API int srd_session_metadata_set(struct srd_session *sess, int key,
  * srd_inst_channel_set_all(). If no channel map has been configured, it is
  * the minimum number of bytes needed to store the default channels.
  *
+ * If a chunking policy was set via srd_session_chunking_set(), the data
+ * may be held back, or passed to the decoders in several chunks.
+ *
  * @param sess The session to use.
  * @param start_samplenum The sample number of the first sample in this chunk.
  * @param end_samplenum The sample number of the last sample in this chunk.
@@ -231,8 +412,9 @@ SRD_API int srd_session_send(struct srd_session *sess,
 		uint64_t start_samplenum, uint64_t end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen)
 {
-	GSList *d;
-	int ret;
+	struct srd_session_stats *stats;
+	uint64_t end_offset;
+	int unitsize, ret;
 
 	if (session_is_valid(sess) != SRD_OK) {
 		srd_err("Invalid session.");
@@ -243,9 +425,98 @@ SRD_API int srd_session_send(struct srd_session *sess,
 			"number %" PRIu64 ", %" PRIu64 " bytes at 0x%p",
 			start_samplenum, inbuflen, inbuf);
 
+	stats = &sess->stats;
+	stats->chunks_received++;
+	stats->bytes_received += inbuflen;
+
+	/*
+	 * Without a chunking policy, or without a sample size all decoders
+	 * agree on, the data goes to the decoders as is.
+	 */
+	unitsize = session_unitsize(sess);
+	if ((!stats->chunk_min_bytes && !stats->chunk_max_bytes) || !unitsize
+			|| !inbuf || inbuflen == 0 || inbuflen % unitsize) {
+		if ((ret = session_chunk_flush(sess)) != SRD_OK)
+			return ret;
+		return session_decode(sess, start_samplenum, end_samplenum,
+				inbuf, inbuflen);
+	}
+
+	end_offset = end_samplenum - start_samplenum - inbuflen / unitsize;
+
+	if (!stats->chunk_min_bytes)
+		return session_decode_split(sess, start_samplenum, end_offset,
+				unitsize, inbuf, inbuflen);
+
+	/*
+	 * Only chunks which directly follow the held back data can be
+	 * coalesced with it. Also flush if this chunk doesn't fit anymore.
+	 */
+	if (stats->bytes_buffered && (unitsize != sess->chunk_unitsize
+			|| start_samplenum != sess->chunk_start_samplenum
+			+ stats->bytes_buffered / unitsize
+			|| end_offset != sess->chunk_end_offset
+			|| stats->bytes_buffered + inbuflen > stats->chunk_min_bytes)) {
+		if ((ret = session_chunk_flush(sess)) != SRD_OK)
+			return ret;
+	}
+
+	/* Large enough on its own, no need to copy it. */
+	if (inbuflen >= stats->chunk_min_bytes)
+		return session_decode_split(sess, start_samplenum, end_offset,
+				unitsize, inbuf, inbuflen);
+
+	if (!stats->bytes_buffered) {
+		sess->chunk_start_samplenum = start_samplenum;
+		sess->chunk_end_offset = end_offset;
+		sess->chunk_unitsize = unitsize;
+	}
+	memcpy(sess->chunk_buf + stats->bytes_buffered, inbuf, inbuflen);
+	stats->bytes_buffered += inbuflen;
+
+	if (stats->bytes_buffered == stats->chunk_min_bytes)
+		return session_chunk_flush(sess);
+
+	return SRD_OK;
+}
+
+/**
+ * Terminate a decoding session.
+ *
+ * This signals the end of the sample data to all decoder instances in the
+ * session. Their (optional) end() method gets called, which allows them to
+ * flush data they were holding back, e.g. a partially received frame.
+ * Instances stacked on top of others are ended after the instances below
+ * them, so they also get whatever those flushed.
+ *
+ * Frontends decoding live acquisitions should call this when the
+ * acquisition stops. The session can't receive more data afterwards,
+ * unless it is started again.
+ *
+ * @param sess The session to terminate.
+ *
+ * @return SRD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.4.0
+ */
+SRD_API int srd_session_terminate(struct srd_session *sess)
+{
+	GSList *d;
+	int ret;
+
+	if (session_is_valid(sess) != SRD_OK) {
+		srd_err("Invalid session.");
+		return SRD_ERR_ARG;
+	}
+
+	/* Data held back for coalescing is part of the stream, too. */
+	if ((ret = session_chunk_flush(sess)) != SRD_OK)
+		return ret;
+
+	srd_dbg("Calling end() on all instances in session %d.", sess->session_id);
+
 	for (d = sess->di_list; d; d = d->next) {
-		if ((ret = srd_inst_decode(d->data, start_samplenum,
-				end_samplenum, inbuf, inbuflen)) != SRD_OK)
+		if ((ret = srd_inst_end(d->data)) != SRD_OK)
 			return ret;
 	}
 
@@ -277,6 +548,8 @@ SRD_API int srd_session_destroy(struct srd_session *sess)
 		srd_inst_free_all(sess, NULL);
 	if (sess->callbacks)
 		g_slist_free_full(sess->callbacks, g_free);
+	srd_ann_store_free(sess->ann_store);
+	g_free(sess->chunk_buf);
 	sessions = g_slist_remove(sessions, sess);
 	g_free(sess);
 
@@ -18,7 +18,8 @@
  * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
  */
 
-#include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
+#include "../libsigrokdecode-internal.h" /* First, to avoid compiler warning. */
+#include "../libsigrokdecode.h"
 #include <stdlib.h>
 #include <check.h>
 #include "lib.h"
@@ -86,6 +87,75 @@ START_TEST(test_init_exit_3)
 }
 END_TEST
 
+/*
+ * Check whether the sigrokdecode.crc helper computes the standard check
+ * values (CRC of "123456789") for a few common CRCs, and whether feeding
+ * bits gives the same result as feeding whole bytes.
+ * If it doesn't (or segfaults) this test will fail.
+ */
+START_TEST(test_crc)
+{
+	int ret;
+
+	srd_init(NULL);
+	ret = PyRun_SimpleString(
+		"import sigrokdecode as srd\n"
+		"def check(data, *args, **kwargs):\n"
+		"    crc = srd.crc(*args, **kwargs)\n"
+		"    crc.update(data)\n"
+		"    return crc.value\n"
+		"d = b'123456789'\n"
+		"assert check(d, 5, 0x05, init=0x1f, refin=True, refout=True,\n"
+		"             xorout=0x1f) == 0x19\n"
+		"assert check(d, 7, 0x09) == 0x75\n"
+		"assert check(d, 8, 0x07) == 0xf4\n"
+		"assert check(d, 15, 0x4599) == 0x059e\n"
+		"assert check(d, 16, 0x8005, init=0xffff, refin=True,\n"
+		"             refout=True) == 0x4b37\n"
+		"assert check(list(d), 16, 0x1021, init=0xffff) == 0x29b1\n"
+		"assert check(d, 32, 0x04c11db7, init=0xffffffff, refin=True,\n"
+		"             refout=True, xorout=0xffffffff) == 0xcbf43926\n"
+		"crc = srd.crc(15, 0x4599)\n"
+		"for b in d:\n"
+		"    crc.update_bits([(b >> i) & 1 for i in range(7, -1, -1)])\n"
+		"assert crc.value == 0x059e\n"
+		"crc.reset()\n"
+		"crc.update_bits(int.from_bytes(d[:8], 'big'), 64)\n"
+		"crc.update_bits(d[8], 8)\n"
+		"assert crc.value == 0x059e\n");
+	fail_unless(ret == 0, "CRC check values do not match.");
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether invalid CRC parameters are rejected.
+ * If they aren't (or it segfaults) this test will fail.
+ */
+START_TEST(test_crc_bogus)
+{
+	int ret;
+
+	srd_init(NULL);
+	ret = PyRun_SimpleString(
+		"import sigrokdecode as srd\n"
+		"for args in ((0, 1), (33, 1), (8, 0x107)):\n"
+		"    try:\n"
+		"        srd.crc(*args)\n"
+		"    except ValueError:\n"
+		"        continue\n"
+		"    raise AssertionError(args)\n"
+		"try:\n"
+		"    srd.crc(8, 0x07).update([256])\n"
+		"except ValueError:\n"
+		"    pass\n"
+		"else:\n"
+		"    raise AssertionError('byte range')\n");
+	fail_unless(ret == 0, "Invalid CRC parameters were accepted.");
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_core(void)
 {
 	Suite *s;
@@ -100,5 +170,11 @@ Suite *suite_core(void)
 	tcase_add_test(tc, test_init_exit_3);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("crc");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_crc);
+	tcase_add_test(tc, test_crc_bogus);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
@@ -47,6 +47,7 @@ int main(void)
 	srunner_add_suite(srunner, suite_decoder());
 	srunner_add_suite(srunner, suite_inst());
 	srunner_add_suite(srunner, suite_session());
+	srunner_add_suite(srunner, suite_stack());
 
 	srunner_run_all(srunner, CK_VERBOSE);
 	ret = srunner_ntests_failed(srunner);
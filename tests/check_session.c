@@ -22,6 +22,8 @@
 #include "../libsigrokdecode.h"
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
+#include <sys/resource.h>
 #include <check.h>
 #include "lib.h"
 
@@ -136,6 +138,165 @@ START_TEST(test_session_destroy_bogus)
 }
 END_TEST
 
+/*
+ * Check whether srd_session_terminate() works, for decoders with and
+ * without an end() method.
+ * If it returns != SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_terminate)
+{
+	int ret;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst1, *inst2;
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load_all();
+	srd_session_new(&sess);
+	inst1 = srd_inst_new(sess, "i2c", NULL);
+	inst2 = srd_inst_new(sess, "i2cdemux", NULL);
+	srd_inst_stack(sess, inst1, inst2);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+	ret = srd_session_terminate(sess);
+	fail_unless(ret == SRD_OK, "srd_session_terminate() failed: %d.", ret);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_session_terminate() fails for bogus sessions.
+ * If it returns SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_terminate_bogus)
+{
+	int ret;
+
+	srd_init(NULL);
+	ret = srd_session_terminate(NULL);
+	fail_unless(ret != SRD_OK, "srd_session_terminate(NULL) worked.");
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_session_chunking_set() works, and rejects bogus
+ * parameters.
+ * If it doesn't (or segfaults) this test will fail.
+ */
+START_TEST(test_session_chunking_set)
+{
+	int ret;
+	struct srd_session *sess;
+	struct srd_session_stats stats;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	ret = srd_session_chunking_set(sess, 4096, 1024 * 1024);
+	fail_unless(ret == SRD_OK, "srd_session_chunking_set() failed: %d.", ret);
+	ret = srd_session_stats_get(sess, &stats);
+	fail_unless(ret == SRD_OK, "srd_session_stats_get() failed: %d.", ret);
+	fail_unless(stats.chunk_min_bytes == 4096);
+	fail_unless(stats.chunk_max_bytes == 1024 * 1024);
+	ret = srd_session_chunking_set(sess, 0, 0);
+	fail_unless(ret == SRD_OK, "Disabling chunking failed: %d.", ret);
+	ret = srd_session_chunking_set(sess, 1024, 16);
+	fail_unless(ret != SRD_OK, "Max. chunk size below min. worked.");
+	ret = srd_session_chunking_set(NULL, 0, 0);
+	fail_unless(ret != SRD_OK, "srd_session_chunking_set(NULL) worked.");
+	ret = srd_session_stats_get(sess, NULL);
+	fail_unless(ret != SRD_OK, "srd_session_stats_get(NULL) worked.");
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/* Decode one UART frame in chunks of 'chunklen' bytes. */
+static void chunking_decode(uint64_t min_bytes, uint64_t max_bytes,
+		int chunklen, struct srd_session_stats *stats,
+		uint64_t *ann_start)
+{
+	int i, len;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct srd_ann_store_row row;
+	uint8_t samples[18 * 4];
+	/* One UART frame with 'A' (0x41) on RX, idle before and after. */
+	const uint8_t rx_bits[18] = {
+		1, 1, 1, 1, 0, 1, 0, 0, 0, 0, 0, 1, 0, 1, 1, 1, 1, 1,
+	};
+
+	/* 4 samples per bit, TX is idle (high). */
+	for (i = 0; i < (int)sizeof(samples); i++)
+		samples[i] = 0x02 | rx_bits[i / 4];
+
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(4 * 115200));
+	srd_ann_store_enable(sess, 4);
+	srd_session_chunking_set(sess, min_bytes, max_bytes);
+	srd_session_start(sess);
+	for (i = 0; i < (int)sizeof(samples); i += chunklen) {
+		len = MIN(chunklen, (int)sizeof(samples) - i);
+		srd_session_send(sess, i, i + len, samples + i, len);
+	}
+	srd_session_terminate(sess);
+	srd_session_stats_get(sess, stats);
+	srd_ann_store_row_get(sess, inst, 0, &row);
+	fail_unless(row.num_anns == 3, "Expected 3 RX annotations, got %d.",
+			(int)row.num_anns);
+	for (i = 0; i < 3; i++)
+		ann_start[i] = row.start_sample[i];
+	srd_session_destroy(sess);
+}
+
+/*
+ * Check whether coalescing and splitting chunks leaves the decoder
+ * output unchanged, and shows up in the statistics.
+ * If it doesn't (or segfaults) this test will fail.
+ */
+START_TEST(test_session_chunking_decode)
+{
+	int i;
+	struct srd_session_stats stats;
+	uint64_t ref[3], ann_start[3];
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+
+	/* Reference: the whole buffer in one go, no chunking policy. */
+	chunking_decode(0, 0, 72, &stats, ref);
+	fail_unless(stats.chunks_received == 1 && stats.chunks_decoded == 1);
+
+	/* Coalesce 9-byte chunks into 36-byte chunks. */
+	chunking_decode(36, 0, 9, &stats, ann_start);
+	fail_unless(stats.chunks_received == 8);
+	fail_unless(stats.chunks_decoded == 2, "Decoded %d chunks.",
+			(int)stats.chunks_decoded);
+	fail_unless(stats.bytes_decoded == 72 && stats.bytes_buffered == 0);
+	for (i = 0; i < 3; i++)
+		fail_unless(ann_start[i] == ref[i]);
+
+	/* Split into 10-byte chunks. */
+	chunking_decode(0, 10, 72, &stats, ann_start);
+	fail_unless(stats.chunks_received == 1);
+	fail_unless(stats.chunks_decoded == 8, "Decoded %d chunks.",
+			(int)stats.chunks_decoded);
+	for (i = 0; i < 3; i++)
+		fail_unless(ann_start[i] == ref[i]);
+
+	/* Leftover data must be flushed by srd_session_terminate(). */
+	chunking_decode(64, 64, 5, &stats, ann_start);
+	fail_unless(stats.bytes_decoded == 72 && stats.bytes_buffered == 0);
+	for (i = 0; i < 3; i++)
+		fail_unless(ann_start[i] == ref[i]);
+
+	srd_exit();
+}
+END_TEST
+
 static void conf_check_ok(struct srd_session *sess, int key, uint64_t x)
 {
 	int ret;
@@ -188,6 +349,10 @@ START_TEST(test_session_metadata_set)
 		conf_check_ok(sess, SRD_CONF_SAMPLERATE, i);
 	/* Try the max. possible value. */
 	conf_check_ok(sess, SRD_CONF_SAMPLERATE, UINT64_MAX);
+	/* The latency budget is a uint64, too. */
+	conf_check_ok(sess, SRD_CONF_LATENCY, 0);
+	conf_check_ok(sess, SRD_CONF_LATENCY, 1000);
+	conf_check_ok(sess, SRD_CONF_LATENCY, UINT64_MAX);
 	srd_session_destroy(sess);
 	srd_exit();
 }
@@ -207,6 +372,7 @@ START_TEST(test_session_metadata_set_bogus)
 	/* Incorrect gvariant type (currently only uint64 is used). */
 	conf_check_fail_str(sess, SRD_CONF_SAMPLERATE, "");
 	conf_check_fail_str(sess, SRD_CONF_SAMPLERATE, "Foo");
+	conf_check_fail_str(sess, SRD_CONF_LATENCY, "Foo");
 
 	/* NULL data pointer. */
 	conf_check_fail_null(sess, SRD_CONF_SAMPLERATE);
@@ -224,6 +390,265 @@ START_TEST(test_session_metadata_set_bogus)
 }
 END_TEST
 
+/*
+ * Check whether srd_ann_store_enable() works.
+ * If it returns != SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_ann_store_enable)
+{
+	int ret;
+	struct srd_session *sess;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	ret = srd_ann_store_enable(sess, 1024);
+	fail_unless(ret == SRD_OK, "srd_ann_store_enable() failed: %d.", ret);
+	/* Enabling it a second time must work, too. */
+	ret = srd_ann_store_enable(sess, 1);
+	fail_unless(ret == SRD_OK, "srd_ann_store_enable() 2 failed: %d.", ret);
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether srd_ann_store_enable() fails for bogus parameters.
+ * If it returns SRD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_ann_store_enable_bogus)
+{
+	int ret;
+	struct srd_session *sess;
+
+	srd_init(NULL);
+	srd_session_new(&sess);
+	ret = srd_ann_store_enable(NULL, 1024);
+	fail_unless(ret != SRD_OK, "srd_ann_store_enable(NULL) worked.");
+	ret = srd_ann_store_enable(sess, 0);
+	fail_unless(ret != SRD_OK, "srd_ann_store_enable() with bucket "
+			"size 0 worked.");
+	/* The bucket size of the highest summary level must not overflow. */
+	ret = srd_ann_store_enable(sess, UINT64_MAX >> 1);
+	fail_unless(ret != SRD_OK, "srd_ann_store_enable() with huge "
+			"bucket size worked.");
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static void ann_store_count_cb(const struct srd_ann_store_row *row,
+		uint64_t index, void *cb_data)
+{
+	(void)row;
+	(void)index;
+
+	(*(int *)cb_data)++;
+}
+
+/*
+ * Check whether decoded annotations end up in the annotation store, and
+ * whether range queries and the summary return them.
+ * If any of them are missing (or it segfaults) this test will fail.
+ */
+START_TEST(test_ann_store_query)
+{
+	int ret, i, num;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	struct srd_ann_store_row row;
+	uint64_t num_buckets;
+	const uint64_t *buckets;
+	const uint32_t *counts;
+	char **ann_text;
+	uint8_t samples[18 * 4];
+	/* One UART frame with 'A' (0x41) on RX, idle before and after. */
+	const uint8_t rx_bits[18] = {
+		1, 1, 1, 1, 0, 1, 0, 0, 0, 0, 0, 1, 0, 1, 1, 1, 1, 1,
+	};
+
+	/* 4 samples per bit, TX is idle (high). */
+	for (i = 0; i < (int)sizeof(samples); i++)
+		samples[i] = 0x02 | rx_bits[i / 4];
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(4 * 115200));
+	ret = srd_ann_store_enable(sess, 4);
+	fail_unless(ret == SRD_OK, "srd_ann_store_enable() failed: %d.", ret);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, sizeof(samples), samples,
+			sizeof(samples));
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+
+	/* Row 0 ('RX'): start bit, data, stop bit. */
+	ret = srd_ann_store_row_get(sess, inst, 0, &row);
+	fail_unless(ret == SRD_OK, "srd_ann_store_row_get() failed: %d.", ret);
+	fail_unless(row.num_anns == 3, "Expected 3 RX annotations, got %d.",
+			(int)row.num_anns);
+	for (i = 1; i < (int)row.num_anns; i++)
+		fail_unless(row.start_sample[i - 1] <= row.start_sample[i]);
+	ann_text = srd_ann_store_text_get(sess, row.text_id[1]);
+	fail_unless(ann_text != NULL && !strcmp(ann_text[0], "A"));
+
+	/* Row 1 ('RX bits'): all 8 data bits. */
+	num = 0;
+	srd_ann_store_query(sess, inst, 1, 0, sizeof(samples),
+			ann_store_count_cb, &num);
+	fail_unless(num == 8, "Expected 8 RX bit annotations, got %d.", num);
+
+	/* Only the bits overlapping samples 28..29. */
+	num = 0;
+	srd_ann_store_query(sess, inst, 1, 28, 29, ann_store_count_cb, &num);
+	fail_unless(num > 0 && num < 8, "Range query returned %d bits.", num);
+
+	/* Nothing after the end of the capture. */
+	num = 0;
+	srd_ann_store_query(sess, inst, 1, 1000, 2000, ann_store_count_cb, &num);
+	fail_unless(num == 0, "Query past the end returned %d bits.", num);
+
+	/* The summary must count every annotation exactly once per level. */
+	for (i = 0; i < SRD_ANN_STORE_LEVELS; i++) {
+		ret = srd_ann_store_summary_get(sess, inst, 1, i,
+				&num_buckets, &buckets, &counts);
+		fail_unless(ret == SRD_OK);
+		num = 0;
+		while (num_buckets--)
+			num += counts[num_buckets];
+		fail_unless(num == 8, "Summary level %d counted %d bits.", i, num);
+	}
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether the summary only keeps the buckets holding annotations,
+ * for a capture starting at a high sample number.
+ * If it allocates a bucket for every sample before that (or segfaults)
+ * this test will fail.
+ */
+START_TEST(test_ann_store_summary_sparse)
+{
+	int ret, i, num;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	uint64_t j, num_buckets;
+	const uint64_t *buckets;
+	const uint32_t *counts;
+	uint8_t samples[18 * 4];
+	/* One UART frame with 'A' (0x41) on RX, idle before and after. */
+	const uint8_t rx_bits[18] = {
+		1, 1, 1, 1, 0, 1, 0, 0, 0, 0, 0, 1, 0, 1, 1, 1, 1, 1,
+	};
+	const uint64_t start = 1ULL << 40;
+
+	for (i = 0; i < (int)sizeof(samples); i++)
+		samples[i] = 0x02 | rx_bits[i / 4];
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	inst = srd_inst_new(sess, "uart", NULL);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(4 * 115200));
+	srd_ann_store_enable(sess, 1);
+	srd_session_start(sess);
+	ret = srd_session_send(sess, start, start + sizeof(samples), samples,
+			sizeof(samples));
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+
+	/* 8 RX bits, one per 4 samples: at most 8 buckets on any level. */
+	for (i = 0; i < SRD_ANN_STORE_LEVELS; i++) {
+		ret = srd_ann_store_summary_get(sess, inst, 1, i,
+				&num_buckets, &buckets, &counts);
+		fail_unless(ret == SRD_OK);
+		fail_unless(num_buckets > 0 && num_buckets <= 8,
+				"Summary level %d has %d buckets.", i,
+				(int)num_buckets);
+		num = 0;
+		for (j = 0; j < num_buckets; j++) {
+			fail_unless(buckets[j] >= (start >> i));
+			fail_unless(j == 0 || buckets[j - 1] < buckets[j]);
+			num += counts[j];
+		}
+		fail_unless(num == 8, "Summary level %d counted %d bits.", i, num);
+	}
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
+static long max_rss_kb(void)
+{
+	struct rusage ru;
+
+	getrusage(RUSAGE_SELF, &ru);
+
+	return ru.ru_maxrss;
+}
+
+/*
+ * Check whether srd_session_send() runs in constant memory.
+ * Every call used to leak the srd_logic object and the sample list
+ * handed to decode(), roughly 100 bytes per chunk. After a warm-up,
+ * 10^6 more calls must not grow the peak RSS noticeably.
+ * If they do (or it segfaults) this test will fail.
+ */
+START_TEST(test_session_send_soak)
+{
+	int ret;
+	uint64_t i, samplenum;
+	long rss;
+	struct srd_session *sess;
+	struct srd_decoder_inst *inst;
+	GHashTable *options;
+	/* RX and TX both idle (high). */
+	const uint8_t samples[4] = { 0x03, 0x03, 0x03, 0x03 };
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load("uart");
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, g_strdup("baudrate"),
+			g_variant_ref_sink(g_variant_new_int64(115200)));
+	inst = srd_inst_new(sess, "uart", options);
+	g_hash_table_destroy(options);
+	fail_unless(inst != NULL, "srd_inst_new() failed.");
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(4 * 115200));
+	srd_session_start(sess);
+
+	samplenum = 0;
+	for (i = 0; i < 100000; i++, samplenum += sizeof(samples)) {
+		ret = srd_session_send(sess, samplenum,
+				samplenum + sizeof(samples), samples,
+				sizeof(samples));
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	rss = max_rss_kb();
+
+	for (i = 0; i < 1000000; i++, samplenum += sizeof(samples)) {
+		ret = srd_session_send(sess, samplenum,
+				samplenum + sizeof(samples), samples,
+				sizeof(samples));
+		fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	}
+	fail_unless(max_rss_kb() - rss < 8192, "RSS grew by %ld KB.",
+			max_rss_kb() - rss);
+
+	srd_session_destroy(sess);
+	srd_exit();
+}
+END_TEST
+
 Suite *suite_session(void)
 {
 	Suite *s;
@@ -240,11 +665,37 @@ Suite *suite_session(void)
 	tcase_add_test(tc, test_session_destroy_bogus);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("terminate");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_terminate);
+	tcase_add_test(tc, test_session_terminate_bogus);
+	suite_add_tcase(s, tc);
+
 	tc = tcase_create("config");
 	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
 	tcase_add_test(tc, test_session_metadata_set);
 	tcase_add_test(tc, test_session_metadata_set_bogus);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("chunking");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_chunking_set);
+	tcase_add_test(tc, test_session_chunking_decode);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("ann_store");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_ann_store_enable);
+	tcase_add_test(tc, test_ann_store_enable_bogus);
+	tcase_add_test(tc, test_ann_store_query);
+	tcase_add_test(tc, test_ann_store_summary_sparse);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("soak");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_set_timeout(tc, 300);
+	tcase_add_test(tc, test_session_send_soak);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
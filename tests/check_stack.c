@@ -0,0 +1,197 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+ */
+
+#include "../libsigrokdecode.h" /* First, to avoid compiler warning. */
+#include <stdint.h>
+#include <stdlib.h>
+#include <check.h>
+#include "lib.h"
+
+/* One CS#-framed SPI transfer of up to 8 bytes. */
+struct spi_transfer {
+	int len;
+	uint8_t mosi[8];
+	uint8_t miso[8];
+};
+
+/* Stacked decoder and number of annotations it sent. */
+struct ann_count {
+	struct srd_decoder_inst *di;
+	int num;
+};
+
+static void ann_count_cb(struct srd_proto_data *pdata, void *cb_data)
+{
+	struct ann_count *ac;
+
+	ac = cb_data;
+	if (pdata->pdo->di == ac->di)
+		ac->num++;
+}
+
+/*
+ * Turn SPI transfers into samples, in SPI mode 0 with active-low CS#.
+ * CLK, MISO, MOSI and CS# are bits 0-3 of a sample, every bit takes
+ * 4 samples. Returns the number of samples, 'buf' must be large enough.
+ */
+static int spi_samples(uint8_t *buf, const struct spi_transfer *t, int num)
+{
+	int n, i, j, k, bit;
+	uint8_t s;
+
+	n = 0;
+	for (k = 0; k < 4; k++)
+		buf[n++] = 0x08;
+	for (i = 0; i < num; i++) {
+		for (k = 0; k < 3; k++)
+			buf[n++] = 0x00;
+		for (j = 0; j < t[i].len; j++) {
+			for (bit = 7; bit >= 0; bit--) {
+				s = ((t[i].miso[j] >> bit) & 1) << 1;
+				s |= ((t[i].mosi[j] >> bit) & 1) << 2;
+				buf[n++] = s;
+				buf[n++] = s;
+				buf[n++] = s | 0x01;
+				buf[n++] = s | 0x01;
+			}
+		}
+		for (k = 0; k < 3; k++)
+			buf[n++] = 0x08;
+	}
+
+	return n;
+}
+
+/*
+ * Decode SPI transfers with the spi PD (in normal or fast mode) and the
+ * PD 'decoder_id' stacked on top of it. Returns the number of
+ * annotations of the stacked PD.
+ */
+static int spi_stack_decode(const char *decoder_id, const char *fast,
+		const struct spi_transfer *t, int num)
+{
+	int ret, len;
+	struct srd_session *sess;
+	struct srd_decoder_inst *spi;
+	struct ann_count ac;
+	GHashTable *options;
+	uint8_t samples[4096];
+
+	len = spi_samples(samples, t, num);
+
+	srd_session_new(&sess);
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, g_free,
+			(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, g_strdup("fast"),
+			g_variant_ref_sink(g_variant_new_string(fast)));
+	spi = srd_inst_new(sess, "spi", options);
+	g_hash_table_destroy(options);
+	fail_unless(spi != NULL, "srd_inst_new() failed.");
+	ac.di = srd_inst_new(sess, decoder_id, NULL);
+	ac.num = 0;
+	fail_unless(ac.di != NULL, "srd_inst_new() failed.");
+	srd_inst_stack(sess, spi, ac.di);
+	srd_pd_output_callback_add(sess, SRD_OUTPUT_ANN, ann_count_cb, &ac);
+	srd_session_metadata_set(sess, SRD_CONF_SAMPLERATE,
+			g_variant_new_uint64(1000000));
+	srd_session_start(sess);
+	ret = srd_session_send(sess, 0, len, samples, len);
+	fail_unless(ret == SRD_OK, "srd_session_send() failed: %d.", ret);
+	srd_session_destroy(sess);
+
+	return ac.num;
+}
+
+/*
+ * Check whether sdcard_spi works on top of spi in fast mode, where spi
+ * only sends 'TRANSFER' packets.
+ * If it outputs no (or the wrong number of) annotations this test fails.
+ */
+START_TEST(test_stack_spi_fast_sdcard_spi)
+{
+	int num;
+	/* CMD0 and CMD16 (block length 512), each with its R1 reply. */
+	const struct spi_transfer t[] = {
+		{ 8, { 0x40, 0x00, 0x00, 0x00, 0x00, 0x95, 0xff, 0xff },
+		     { 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0x01 } },
+		{ 8, { 0x50, 0x00, 0x00, 0x02, 0x00, 0x15, 0xff, 0xff },
+		     { 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0x00 } },
+	};
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load_all();
+
+	num = spi_stack_decode("sdcard_spi", "no", t, 2);
+	fail_unless(num == 34, "Expected 34 annotations, got %d.", num);
+
+	/* Command, argument, CRC7, command description and R1, twice. */
+	num = spi_stack_decode("sdcard_spi", "yes", t, 2);
+	fail_unless(num == 10, "Expected 10 annotations in fast mode, "
+			"got %d.", num);
+
+	srd_exit();
+}
+END_TEST
+
+/*
+ * Check whether rfm12 works on top of spi in fast mode, where spi only
+ * sends 'TRANSFER' packets.
+ * If it outputs no (or the wrong number of) annotations this test fails.
+ */
+START_TEST(test_stack_spi_fast_rfm12)
+{
+	int num;
+	/* Configuration setting command and status read command. */
+	const struct spi_transfer t[] = {
+		{ 2, { 0x80, 0xd7 }, { 0x00, 0x00 } },
+		{ 2, { 0x00, 0x00 }, { 0x81, 0x23 } },
+	};
+
+	srd_init(DECODERS_DIR);
+	srd_decoder_load_all();
+
+	num = spi_stack_decode("rfm12", "no", t, 2);
+	fail_unless(num == 25, "Expected 25 annotations, got %d.", num);
+
+	/*
+	 * One annotation per row and command: command/parameters and
+	 * interpretation, then command, return values and interpretation.
+	 */
+	num = spi_stack_decode("rfm12", "yes", t, 2);
+	fail_unless(num == 5, "Expected 5 annotations in fast mode, "
+			"got %d.", num);
+
+	srd_exit();
+}
+END_TEST
+
+Suite *suite_stack(void)
+{
+	Suite *s;
+	TCase *tc;
+
+	s = suite_create("stack");
+
+	tc = tcase_create("spi");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_stack_spi_fast_sdcard_spi);
+	tcase_add_test(tc, test_stack_spi_fast_rfm12);
+	suite_add_tcase(s, tc);
+
+	return s;
+}
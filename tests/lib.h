@@ -28,5 +28,6 @@ Suite *suite_core(void);
 Suite *suite_decoder(void);
 Suite *suite_inst(void);
 Suite *suite_session(void);
+Suite *suite_stack(void);
 
 #endif
@@ -0,0 +1,342 @@
+/*
+ * This file is part of the libsigrokdecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include "libsigrokdecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include "libsigrokdecode.h"
+#include "config.h"
+#include <stdint.h>
+
+/*
+ * Table-driven CRC engine for protocol decoders.
+ *
+ * Non-reflected CRCs keep the register aligned to the top of a 32-bit
+ * word, reflected CRCs keep it aligned to the bottom. That way a single
+ * 256-entry table handles every width from 1 to 32 bits, and bits can
+ * be shifted in one at a time (e.g. for CAN's CRC-15, or USB's CRC-5)
+ * without converting between the two representations.
+ */
+typedef struct {
+	PyObject_HEAD
+	int width;
+	uint32_t poly;
+	uint32_t init;
+	uint32_t xorout;
+	int refin;
+	int refout;
+	/* Polynomial in register representation (shifted or reflected). */
+	uint32_t regpoly;
+	uint32_t reg;
+	uint32_t table[256];
+} srd_crc;
+
+static uint32_t reflect(uint32_t value, int width)
+{
+	uint32_t out;
+	int i;
+
+	out = 0;
+	for (i = 0; i < width; i++) {
+		out = (out << 1) | (value & 1);
+		value >>= 1;
+	}
+
+	return out;
+}
+
+static uint32_t crc_mask(int width)
+{
+	return width == 32 ? 0xffffffff : (1UL << width) - 1;
+}
+
+static void crc_reset(srd_crc *crc)
+{
+	if (crc->refin)
+		crc->reg = reflect(crc->init, crc->width);
+	else
+		crc->reg = crc->init << (32 - crc->width);
+}
+
+static void crc_make_table(srd_crc *crc)
+{
+	uint32_t reg;
+	int i, bit;
+
+	if (crc->refin) {
+		crc->regpoly = reflect(crc->poly, crc->width);
+		for (i = 0; i < 256; i++) {
+			reg = i;
+			for (bit = 0; bit < 8; bit++)
+				reg = (reg & 1) ? (reg >> 1) ^ crc->regpoly : reg >> 1;
+			crc->table[i] = reg;
+		}
+	} else {
+		crc->regpoly = crc->poly << (32 - crc->width);
+		for (i = 0; i < 256; i++) {
+			reg = (uint32_t)i << 24;
+			for (bit = 0; bit < 8; bit++)
+				reg = (reg & 0x80000000) ? (reg << 1) ^ crc->regpoly : reg << 1;
+			crc->table[i] = reg;
+		}
+	}
+}
+
+static void crc_update_byte(srd_crc *crc, uint8_t byte)
+{
+	if (crc->refin)
+		crc->reg = crc->table[(crc->reg ^ byte) & 0xff] ^ (crc->reg >> 8);
+	else
+		crc->reg = crc->table[(crc->reg >> 24) ^ byte] ^ (crc->reg << 8);
+}
+
+static void crc_update_bit(srd_crc *crc, int bit)
+{
+	if (crc->refin) {
+		if ((crc->reg ^ bit) & 1)
+			crc->reg = (crc->reg >> 1) ^ crc->regpoly;
+		else
+			crc->reg >>= 1;
+	} else {
+		if ((crc->reg >> 31) ^ bit)
+			crc->reg = (crc->reg << 1) ^ crc->regpoly;
+		else
+			crc->reg <<= 1;
+	}
+}
+
+static uint32_t crc_value(const srd_crc *crc)
+{
+	uint32_t value;
+
+	if (crc->refin)
+		value = crc->reg;
+	else
+		value = crc->reg >> (32 - crc->width);
+	if (crc->refin != crc->refout)
+		value = reflect(value, crc->width);
+
+	return (value ^ crc->xorout) & crc_mask(crc->width);
+}
+
+static int crc_check_ready(const srd_crc *crc)
+{
+	if (crc->width)
+		return 1;
+	PyErr_SetString(PyExc_RuntimeError, "CRC object not initialized.");
+
+	return 0;
+}
+
+static int crc_init(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+	srd_crc *crc;
+	int width, refin, refout;
+	unsigned long poly, init, xorout;
+	char *keywords[] = {"width", "poly", "init", "refin", "refout",
+			"xorout", NULL};
+
+	crc = (srd_crc *)self;
+	init = xorout = 0;
+	refin = refout = 0;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ik|kppk", keywords,
+			&width, &poly, &init, &refin, &refout, &xorout))
+		return -1;
+
+	if (width < 1 || width > 32) {
+		PyErr_Format(PyExc_ValueError, "Invalid CRC width %d.", width);
+		return -1;
+	}
+	if (poly > crc_mask(width) || init > crc_mask(width)
+			|| xorout > crc_mask(width)) {
+		PyErr_SetString(PyExc_ValueError,
+				"CRC parameter wider than the CRC.");
+		return -1;
+	}
+
+	crc->width = width;
+	crc->poly = poly;
+	crc->init = init;
+	crc->xorout = xorout;
+	crc->refin = refin;
+	crc->refout = refout;
+	crc_make_table(crc);
+	crc_reset(crc);
+
+	return 0;
+}
+
+static PyObject *crc_update(PyObject *self, PyObject *args)
+{
+	srd_crc *crc;
+	PyObject *py_data, *py_seq, *py_item;
+	Py_buffer view;
+	Py_ssize_t len, i;
+	const uint8_t *buf;
+	long byte;
+
+	crc = (srd_crc *)self;
+	if (!crc_check_ready(crc) || !PyArg_ParseTuple(args, "O", &py_data))
+		return NULL;
+
+	/* Fast path for bytes, bytearray and friends. */
+	if (PyObject_CheckBuffer(py_data)) {
+		if (PyObject_GetBuffer(py_data, &view, PyBUF_SIMPLE) < 0)
+			return NULL;
+		buf = view.buf;
+		for (i = 0; i < view.len; i++)
+			crc_update_byte(crc, buf[i]);
+		PyBuffer_Release(&view);
+		Py_RETURN_NONE;
+	}
+
+	/* Any other sequence of integers in the range 0..255. */
+	if (!(py_seq = PySequence_Fast(py_data, "expected bytes or a sequence")))
+		return NULL;
+	len = PySequence_Fast_GET_SIZE(py_seq);
+	for (i = 0; i < len; i++) {
+		py_item = PySequence_Fast_GET_ITEM(py_seq, i);
+		byte = PyLong_AsLong(py_item);
+		if (byte == -1 && PyErr_Occurred()) {
+			Py_DECREF(py_seq);
+			return NULL;
+		}
+		if (byte < 0 || byte > 0xff) {
+			Py_DECREF(py_seq);
+			PyErr_Format(PyExc_ValueError, "Byte value %ld out of range.",
+					byte);
+			return NULL;
+		}
+		crc_update_byte(crc, byte);
+	}
+	Py_DECREF(py_seq);
+
+	Py_RETURN_NONE;
+}
+
+static PyObject *crc_update_bits(PyObject *self, PyObject *args)
+{
+	srd_crc *crc;
+	PyObject *py_bits, *py_seq, *py_item;
+	unsigned long long value;
+	Py_ssize_t len, i;
+	int nbits;
+	long bit;
+
+	crc = (srd_crc *)self;
+	nbits = -1;
+	if (!crc_check_ready(crc)
+			|| !PyArg_ParseTuple(args, "O|i", &py_bits, &nbits))
+		return NULL;
+
+	if (nbits >= 0) {
+		/* An integer holding nbits bits, fed MSB-first. */
+		if (nbits > 64) {
+			PyErr_SetString(PyExc_ValueError,
+					"At most 64 bits can be fed at once.");
+			return NULL;
+		}
+		value = PyLong_AsUnsignedLongLong(py_bits);
+		if (value == (unsigned long long)-1 && PyErr_Occurred())
+			return NULL;
+		if (!crc->refin) {
+			/* Whole bytes can go through the table. */
+			while (nbits >= 8) {
+				nbits -= 8;
+				crc_update_byte(crc, (value >> nbits) & 0xff);
+			}
+		}
+		while (nbits > 0) {
+			nbits--;
+			crc_update_bit(crc, (value >> nbits) & 1);
+		}
+		Py_RETURN_NONE;
+	}
+
+	/* A sequence of bits, in transmission order. */
+	if (!(py_seq = PySequence_Fast(py_bits, "expected a sequence of bits")))
+		return NULL;
+	len = PySequence_Fast_GET_SIZE(py_seq);
+	for (i = 0; i < len; i++) {
+		py_item = PySequence_Fast_GET_ITEM(py_seq, i);
+		bit = PyLong_AsLong(py_item);
+		if (bit == -1 && PyErr_Occurred()) {
+			Py_DECREF(py_seq);
+			return NULL;
+		}
+		crc_update_bit(crc, bit ? 1 : 0);
+	}
+	Py_DECREF(py_seq);
+
+	Py_RETURN_NONE;
+}
+
+static PyObject *crc_reset_method(PyObject *self, PyObject *args)
+{
+	(void)args;
+
+	if (!crc_check_ready((srd_crc *)self))
+		return NULL;
+	crc_reset((srd_crc *)self);
+
+	Py_RETURN_NONE;
+}
+
+static PyObject *crc_get_value(PyObject *self, void *closure)
+{
+	(void)closure;
+
+	if (!crc_check_ready((srd_crc *)self))
+		return NULL;
+
+	return PyLong_FromUnsignedLong(crc_value((srd_crc *)self));
+}
+
+static PyObject *crc_get_width(PyObject *self, void *closure)
+{
+	(void)closure;
+
+	return PyLong_FromLong(((srd_crc *)self)->width);
+}
+
+static PyMethodDef crc_methods[] = {
+	{"update", crc_update, METH_VARARGS,
+	 "Feed bytes (bytes, bytearray or a sequence of integers)"},
+	{"update_bits", crc_update_bits, METH_VARARGS,
+	 "Feed a sequence of bits, or (value, nbits) MSB-first"},
+	{"reset", crc_reset_method, METH_NOARGS,
+	 "Restart the calculation from the initial value"},
+	{NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef crc_getset[] = {
+	{"value", crc_get_value, NULL, "The CRC of all data fed so far", NULL},
+	{"width", crc_get_width, NULL, "The CRC width in bits", NULL},
+	{NULL, NULL, NULL, NULL, NULL}
+};
+
+/** @cond PRIVATE */
+SRD_PRIV PyTypeObject srd_crc_type = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "sigrokdecode.crc",
+	.tp_basicsize = sizeof(srd_crc),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_doc = "crc(width, poly, init=0, refin=False, refout=False, xorout=0)\n\n"
+		"Table-driven CRC calculation, with streaming byte and bit updates",
+	.tp_init = crc_init,
+	.tp_methods = crc_methods,
+	.tp_getset = crc_getset,
+};
+/** @endcond */
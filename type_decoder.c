@@ -88,8 +88,10 @@ static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
 		return SRD_ERR_PYTHON;
 	}
 
-	if (!(pda = g_try_malloc(sizeof(struct srd_proto_data_annotation))))
+	if (!(pda = g_try_malloc(sizeof(struct srd_proto_data_annotation)))) {
+		g_strfreev(ann_text);
 		return SRD_ERR_MALLOC;
+	}
 	pda->ann_class = ann_class;
 	pda->ann_text = ann_text;
 	pdata->data = pda;
@@ -97,6 +99,14 @@ static int convert_annotation(struct srd_decoder_inst *di, PyObject *obj,
 	return SRD_OK;
 }
 
+static void release_annotation(struct srd_proto_data_annotation *pda)
+{
+	if (!pda)
+		return;
+	g_strfreev(pda->ann_text);
+	g_free(pda);
+}
+
 static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
 		struct srd_proto_data *pdata)
 {
@@ -151,20 +161,30 @@ static int convert_binary(struct srd_decoder_inst *di, PyObject *obj,
 		return SRD_ERR_PYTHON;
 	}
 
-	if (!(pdb = g_try_malloc(sizeof(struct srd_proto_data_binary))))
-		return SRD_ERR_MALLOC;
 	if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
 		return SRD_ERR_PYTHON;
+	if (!(pdb = g_try_malloc(sizeof(struct srd_proto_data_binary))))
+		return SRD_ERR_MALLOC;
 	pdb->bin_class = bin_class;
 	pdb->size = size;
-	if (!(pdb->data = g_try_malloc(pdb->size)))
+	if (!(pdb->data = g_try_malloc(pdb->size))) {
+		g_free(pdb);
 		return SRD_ERR_MALLOC;
+	}
 	memcpy((void *)pdb->data, (const void *)buf, pdb->size);
 	pdata->data = pdb;
 
 	return SRD_OK;
 }
 
+static void release_binary(struct srd_proto_data_binary *pdb)
+{
+	if (!pdb)
+		return;
+	g_free((void *)pdb->data);
+	g_free(pdb);
+}
+
 static int convert_meta(struct srd_proto_data *pdata, PyObject *obj)
 {
 	long long intvalue;
@@ -202,6 +222,7 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 	struct srd_decoder_inst *di, *next_di;
 	struct srd_pd_output *pdo;
 	struct srd_proto_data *pdata;
+	struct srd_proto_data_annotation *pda;
 	uint64_t start_sample, end_sample;
 	int output_id;
 	struct srd_pd_callback *cb;
@@ -243,14 +264,22 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 
 	switch (pdo->output_type) {
 	case SRD_OUTPUT_ANN:
-		/* Annotations are only fed to callbacks. */
-		if ((cb = srd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		/* Annotations are only fed to callbacks and the store. */
+		cb = srd_pd_output_callback_find(di->sess, pdo->output_type);
+		if (cb || di->sess->ann_store) {
 			/* Convert from PyDict to srd_proto_data_annotation. */
 			if (convert_annotation(di, py_data, pdata) != SRD_OK) {
 				/* An error was already logged. */
 				break;
 			}
-			cb->cb(pdata, cb->cb_data);
+			pda = pdata->data;
+			if (srd_ann_store_add(di, start_sample, end_sample,
+					pda->ann_class, pda->ann_text) != SRD_OK)
+				srd_err("Failed to store annotation of %s.",
+					di->inst_id);
+			if (cb)
+				cb->cb(pdata, cb->cb_data);
+			release_annotation(pdata->data);
 		}
 		break;
 	case SRD_OUTPUT_PYTHON:
@@ -281,6 +310,7 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 				break;
 			}
 			cb->cb(pdata, cb->cb_data);
+			release_binary(pdata->data);
 		}
 		break;
 	case SRD_OUTPUT_META:
@@ -291,6 +321,8 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 				break;
 			}
 			cb->cb(pdata, cb->cb_data);
+			if (pdata->data)
+				g_variant_unref(pdata->data);
 		}
 		break;
 	default:
@@ -23,8 +23,19 @@
 #include <inttypes.h>
 #include <string.h>
 
+static void srd_logic_dealloc(PyObject *self)
+{
+	srd_logic *logic;
+
+	logic = (srd_logic *)self;
+	Py_XDECREF(logic->sample);
+	PyObject_Del(self);
+}
+
 static PyObject *srd_logic_iter(PyObject *self)
 {
+	Py_INCREF(self);
+
 	return self;
 }
 
@@ -73,14 +84,81 @@ static PyObject *srd_logic_iternext(PyObject *self)
 	return logic->sample;
 }
 
+/* Return 1 if the sample differs from the last one handed to the PD. */
+static int srd_logic_sample_changed(const srd_logic *logic,
+		const uint8_t *sample_pos)
+{
+	const struct srd_decoder_inst *di;
+	int i, ch, sample;
+
+	di = logic->di;
+	for (i = 0; i < di->dec_num_channels; i++) {
+		if ((ch = di->dec_channelmap[i]) == -1)
+			continue;
+		sample = *(sample_pos + ch / 8) & (1 << (ch % 8)) ? 1 : 0;
+		if (sample != di->channel_samples[i])
+			return 1;
+	}
+
+	return 0;
+}
+
+/*
+ * Skip ahead over samples which are identical to the current one, without
+ * creating any Python objects for them. The next iteration returns either
+ * the first sample that differs, or the sample number 'until' (if given),
+ * whichever comes first. This lets edge-driven PDs avoid running their
+ * state machine for every single sample.
+ */
+static PyObject *srd_logic_skip(PyObject *self, PyObject *args)
+{
+	srd_logic *logic;
+	unsigned long long until;
+	uint64_t num_samples, end;
+	uint8_t *sample_pos;
+
+	logic = (srd_logic *)self;
+	until = UINT64_MAX;
+	if (!PyArg_ParseTuple(args, "|K", &until))
+		return NULL;
+
+	/* Nothing to compare against before the first sample. */
+	if (logic->itercnt == 0)
+		Py_RETURN_NONE;
+
+	num_samples = logic->inbuflen / logic->di->data_unitsize;
+	end = num_samples;
+	if (until < logic->start_samplenum + num_samples)
+		end = until > logic->start_samplenum ?
+			until - logic->start_samplenum : 0;
+
+	sample_pos = logic->inbuf + logic->itercnt * logic->di->data_unitsize;
+	while (logic->itercnt < end) {
+		if (srd_logic_sample_changed(logic, sample_pos))
+			break;
+		logic->itercnt++;
+		sample_pos += logic->di->data_unitsize;
+	}
+
+	Py_RETURN_NONE;
+}
+
+static PyMethodDef srd_logic_methods[] = {
+	{"skip", srd_logic_skip, METH_VARARGS,
+	 "Skip samples identical to the current one, up to an optional samplenum"},
+	{NULL, NULL, 0, NULL}
+};
+
 /** @cond PRIVATE */
 SRD_PRIV PyTypeObject srd_logic_type = {
 	PyVarObject_HEAD_INIT(NULL, 0)
 	.tp_name = "srd_logic",
 	.tp_basicsize = sizeof(srd_logic),
+	.tp_dealloc = srd_logic_dealloc,
 	.tp_flags = Py_TPFLAGS_DEFAULT,
 	.tp_doc = "Sigrokdecode logic sample object",
 	.tp_iter = srd_logic_iter,
 	.tp_iternext = srd_logic_iternext,
+	.tp_methods = srd_logic_methods,
 };
 /** @endcond */
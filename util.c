@@ -176,22 +176,33 @@ err_out:
  */
 SRD_PRIV int py_strseq_to_char(const PyObject *py_strseq, char ***outstr)
 {
-	PyObject *py_str;
+	PyObject *py_item, *py_str;
 	int list_len, i;
 	char **out, *str;
 
 	list_len = PySequence_Size((PyObject *)py_strseq);
-	if (!(out = g_try_malloc(sizeof(char *) * (list_len + 1)))) {
+	if (!(out = g_try_malloc0(sizeof(char *) * (list_len + 1)))) {
 		srd_err("Failed to g_malloc() 'out'.");
 		return SRD_ERR_MALLOC;
 	}
 	for (i = 0; i < list_len; i++) {
-		if (!(py_str = PyUnicode_AsEncodedString(
-		    PySequence_GetItem((PyObject *)py_strseq, i), "utf-8", NULL)))
+		if (!(py_item = PySequence_GetItem((PyObject *)py_strseq, i))) {
+			g_strfreev(out);
+			return SRD_ERR_PYTHON;
+		}
+		py_str = PyUnicode_AsEncodedString(py_item, "utf-8", NULL);
+		Py_DECREF(py_item);
+		if (!py_str) {
+			g_strfreev(out);
 			return SRD_ERR_PYTHON;
-		if (!(str = PyBytes_AS_STRING(py_str)))
+		}
+		if (!(str = PyBytes_AS_STRING(py_str))) {
+			Py_DECREF(py_str);
+			g_strfreev(out);
 			return SRD_ERR_PYTHON;
+		}
 		out[i] = g_strdup(str);
+		Py_DECREF(py_str);
 	}
 	out[i] = NULL;
 	*outstr = out;